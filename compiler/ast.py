@@ -8,12 +8,46 @@ import StringIO
 
 import visitor
 import utils
+from location import Location, NoLoc
 
 
 class AstNode(object):
+    # ASTs for large modules are kept around through every pass, so nodes use __slots__
+    # instead of dicts, and locations are stored compactly. fileIndex is an index into
+    # _fileNames; begin and end are a row and column packed into one integer. Locations
+    # are created when they're accessed. id is set by addNodeIds.
+    __slots__ = ["fileIndex", "begin", "end", "id"]
+
     def __init__(self, location):
         self.location = location
 
+    @property
+    def location(self):
+        fileIndex = self.fileIndex
+        if fileIndex < 0:
+            return _specialLocations[fileIndex]
+        begin = self.begin
+        end = self.end
+        return Location(_fileNames[fileIndex],
+                        begin >> _COLUMN_BITS, begin & _COLUMN_MASK,
+                        end >> _COLUMN_BITS, end & _COLUMN_MASK)
+
+    @location.setter
+    def location(self, location):
+        if location is None or location is NoLoc:
+            self.fileIndex = -1 if location is NoLoc else -2
+            self.begin = 0
+            self.end = 0
+            return
+        fileIndex = _fileIndices.get(location.fileName)
+        if fileIndex is None:
+            fileIndex = len(_fileNames)
+            _fileNames.append(location.fileName)
+            _fileIndices[location.fileName] = fileIndex
+        self.fileIndex = fileIndex
+        self.begin = (location.beginRow << _COLUMN_BITS) | location.beginColumn
+        self.end = (location.endRow << _COLUMN_BITS) | location.endColumn
+
     def __str__(self):
         buf = StringIO.StringIO()
         printer = AstPrinter(buf)
@@ -22,7 +56,8 @@ class AstNode(object):
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and \
-            all(v == other.__dict__[k] for k, v in self.__dict__.iteritems() if k != "location")
+            all(getattr(self, k, None) == getattr(other, k, None)
+                for k in _comparedFields(self.__class__))
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -35,6 +70,8 @@ class AstNode(object):
 
 
 class AstModule(AstNode):
+    __slots__ = ["definitions"]
+
     def __init__(self, definitions, location):
         super(AstModule, self).__init__(location)
         self.definitions = definitions
@@ -50,6 +87,8 @@ class AstModule(AstNode):
 
 
 class AstAttribute(AstNode):
+    __slots__ = ["name"]
+
     def __init__(self, name, location):
         super(AstAttribute, self).__init__(location)
         self.name = name
@@ -65,12 +104,16 @@ class AstAttribute(AstNode):
 
 
 class AstDefinition(AstNode):
+    __slots__ = ["attribs"]
+
     def __init__(self, attribs, location):
         super(AstDefinition, self).__init__(location)
         self.attribs = attribs
 
 
 class AstVariableDefinition(AstDefinition):
+    __slots__ = ["keyword", "pattern", "expression"]
+
     def __init__(self, attribs, keyword, pattern, expression, location):
         super(AstVariableDefinition, self).__init__(attribs, location)
         self.keyword = keyword
@@ -92,6 +135,8 @@ class AstVariableDefinition(AstDefinition):
 
 
 class AstFunctionDefinition(AstDefinition):
+    __slots__ = ["name", "typeParameters", "parameters", "returnType", "body"]
+
     def __init__(self, attribs, name, typeParameters, parameters, returnType, body, location):
         super(AstFunctionDefinition, self).__init__(attribs, location)
         self.name = name
@@ -120,6 +165,8 @@ class AstFunctionDefinition(AstDefinition):
 
 
 class AstClassDefinition(AstDefinition):
+    __slots__ = ["name", "typeParameters", "constructor", "supertype", "superArgs", "members"]
+
     def __init__(self, attribs, name, typeParameters, constructor,
                  supertype, superArgs, members, location):
         super(AstClassDefinition, self).__init__(attribs, location)
@@ -160,6 +207,8 @@ class AstClassDefinition(AstDefinition):
 
 
 class AstPrimaryConstructorDefinition(AstDefinition):
+    __slots__ = ["parameters"]
+
     def __init__(self, attribs, parameters, location):
         super(AstPrimaryConstructorDefinition, self).__init__(attribs, location)
         self.parameters = parameters
@@ -175,6 +224,8 @@ class AstPrimaryConstructorDefinition(AstDefinition):
 
 
 class AstTypeParameter(AstDefinition):
+    __slots__ = ["name", "variance", "upperBound", "lowerBound"]
+
     def __init__(self, attribs, variance, name, upperBound, lowerBound, location):
         super(AstTypeParameter, self).__init__(attribs, location)
         self.name = name
@@ -198,6 +249,8 @@ class AstTypeParameter(AstDefinition):
 
 
 class AstParameter(AstDefinition):
+    __slots__ = ["var", "pattern"]
+
     def __init__(self, attribs, var, pattern, location):
         super(AstParameter, self).__init__(attribs, location)
         self.var = var
@@ -217,10 +270,12 @@ class AstParameter(AstDefinition):
 
 
 class AstPattern(AstNode):
-    pass
+    __slots__ = []
 
 
 class AstVariablePattern(AstNode):
+    __slots__ = ["name", "ty"]
+
     def __init__(self, name, ty, location):
         super(AstVariablePattern, self).__init__(location)
         self.name = name
@@ -240,10 +295,12 @@ class AstVariablePattern(AstNode):
 
 
 class AstType(AstNode):
-    pass
+    __slots__ = []
 
 
 class AstUnitType(AstType):
+    __slots__ = []
+
     def __repr__(self):
         return "AstUnitType"
 
@@ -252,6 +309,8 @@ class AstUnitType(AstType):
 
 
 class AstI8Type(AstType):
+    __slots__ = []
+
     def __repr__(self):
         return "AstI8Type"
 
@@ -260,6 +319,8 @@ class AstI8Type(AstType):
 
 
 class AstI16Type(AstType):
+    __slots__ = []
+
     def __repr__(self):
         return "AstI16Type"
 
@@ -268,6 +329,8 @@ class AstI16Type(AstType):
 
 
 class AstI32Type(AstType):
+    __slots__ = []
+
     def __repr__(self):
         return "AstI32Type"
 
@@ -276,6 +339,8 @@ class AstI32Type(AstType):
 
 
 class AstI64Type(AstType):
+    __slots__ = []
+
     def __repr__(self):
         return "AstI64Type"
 
@@ -284,6 +349,8 @@ class AstI64Type(AstType):
 
 
 class AstF32Type(AstType):
+    __slots__ = []
+
     def __repr__(self):
         return "AstF32Type"
 
@@ -292,6 +359,8 @@ class AstF32Type(AstType):
 
 
 class AstF64Type(AstType):
+    __slots__ = []
+
     def __repr__(self):
         return "AstF64Type"
 
@@ -300,6 +369,8 @@ class AstF64Type(AstType):
 
 
 class AstBooleanType(AstType):
+    __slots__ = []
+
     def __repr__(self):
         return "AstBooleanType"
 
@@ -308,6 +379,8 @@ class AstBooleanType(AstType):
 
 
 class AstClassType(AstType):
+    __slots__ = ["name", "typeArguments", "flags"]
+
     def __init__(self, name, typeArguments, flags, location):
         super(AstClassType, self).__init__(location)
         self.name = name
@@ -330,10 +403,12 @@ class AstClassType(AstType):
 
 
 class AstExpression(AstNode):
-    pass
+    __slots__ = []
 
 
 class AstLiteralExpression(AstExpression):
+    __slots__ = ["literal"]
+
     def __init__(self, literal, location):
         super(AstLiteralExpression, self).__init__(location)
         self.literal = literal
@@ -349,6 +424,8 @@ class AstLiteralExpression(AstExpression):
 
 
 class AstVariableExpression(AstExpression):
+    __slots__ = ["name"]
+
     def __init__(self, name, location):
         super(AstVariableExpression, self).__init__(location)
         self.name = name
@@ -364,6 +441,8 @@ class AstVariableExpression(AstExpression):
 
 
 class AstThisExpression(AstExpression):
+    __slots__ = []
+
     def __repr__(self):
         return "AstThisExpression"
 
@@ -372,6 +451,8 @@ class AstThisExpression(AstExpression):
 
 
 class AstSuperExpression(AstExpression):
+    __slots__ = []
+
     def __repr__(self):
         return "AstSuperExpression"
 
@@ -380,6 +461,8 @@ class AstSuperExpression(AstExpression):
 
 
 class AstBlockExpression(AstExpression):
+    __slots__ = ["statements"]
+
     def __init__(self, statements, location):
         super(AstBlockExpression, self).__init__(location)
         self.statements = statements
@@ -395,6 +478,8 @@ class AstBlockExpression(AstExpression):
 
 
 class AstAssignExpression(AstExpression):
+    __slots__ = ["left", "right"]
+
     def __init__(self, left, right, location):
         super(AstAssignExpression, self).__init__(location)
         self.left = left
@@ -411,6 +496,8 @@ class AstAssignExpression(AstExpression):
 
 
 class AstPropertyExpression(AstExpression):
+    __slots__ = ["receiver", "propertyName"]
+
     def __init__(self, receiver, propertyName, location):
         super(AstPropertyExpression, self).__init__(location)
         self.receiver = receiver
@@ -430,6 +517,8 @@ class AstPropertyExpression(AstExpression):
 
 
 class AstCallExpression(AstExpression):
+    __slots__ = ["callee", "typeArguments", "arguments"]
+
     def __init__(self, callee, typeArguments, arguments, location):
         super(AstCallExpression, self).__init__(location)
         self.callee = callee
@@ -448,6 +537,8 @@ class AstCallExpression(AstExpression):
 
 
 class AstUnaryExpression(AstExpression):
+    __slots__ = ["operator", "expr"]
+
     def __init__(self, operator, expr, location):
         super(AstUnaryExpression, self).__init__(location)
         self.operator = operator
@@ -467,6 +558,8 @@ class AstUnaryExpression(AstExpression):
 
 
 class AstBinaryExpression(AstExpression):
+    __slots__ = ["operator", "left", "right"]
+
     def __init__(self, operator, left, right, location):
         super(AstBinaryExpression, self).__init__(location)
         self.operator = operator
@@ -487,6 +580,8 @@ class AstBinaryExpression(AstExpression):
 
 
 class AstFunctionValueExpression(AstExpression):
+    __slots__ = ["expr"]
+
     def __init__(self, expr, location):
         super(AstFunctionValueExpression, self).__init__(location)
         self.expr = expr
@@ -502,6 +597,8 @@ class AstFunctionValueExpression(AstExpression):
 
 
 class AstIfExpression(AstExpression):
+    __slots__ = ["condition", "trueExpr", "falseExpr"]
+
     def __init__(self, condition, trueExpr, falseExpr, location):
         super(AstIfExpression, self).__init__(location)
         self.condition = condition
@@ -520,6 +617,8 @@ class AstIfExpression(AstExpression):
 
 
 class AstWhileExpression(AstExpression):
+    __slots__ = ["condition", "body"]
+
     def __init__(self, condition, body, location):
         super(AstWhileExpression, self).__init__(location)
         self.condition = condition
@@ -537,6 +636,8 @@ class AstWhileExpression(AstExpression):
 
 
 class AstBreakExpression(AstExpression):
+    __slots__ = []
+
     def __repr__(self):
         return "AstBreakExpression"
 
@@ -545,6 +646,8 @@ class AstBreakExpression(AstExpression):
 
 
 class AstContinueExpression(AstExpression):
+    __slots__ = []
+
     def __repr__(self):
         return "AstContinueExpression"
 
@@ -553,6 +656,8 @@ class AstContinueExpression(AstExpression):
 
 
 class AstPartialFunctionExpression(AstExpression):
+    __slots__ = ["cases"]
+
     def __init__(self, cases, location):
         super(AstPartialFunctionExpression, self).__init__(location)
         self.cases = cases
@@ -568,6 +673,8 @@ class AstPartialFunctionExpression(AstExpression):
 
 
 class AstPartialFunctionCase(AstNode):
+    __slots__ = ["pattern", "condition", "expression"]
+
     def __init__(self, pattern, condition, expression, location):
         super(AstPartialFunctionCase, self).__init__(location)
         self.pattern = pattern
@@ -586,6 +693,8 @@ class AstPartialFunctionCase(AstNode):
 
 
 class AstMatchExpression(AstExpression):
+    __slots__ = ["expression", "matcher"]
+
     def __init__(self, expression, matcher, location):
         super(AstMatchExpression, self).__init__(location)
         self.expression = expression
@@ -603,6 +712,8 @@ class AstMatchExpression(AstExpression):
 
 
 class AstThrowExpression(AstExpression):
+    __slots__ = ["exception"]
+
     def __init__(self, exception, location):
         super(AstThrowExpression, self).__init__(location)
         self.exception = exception
@@ -618,6 +729,8 @@ class AstThrowExpression(AstExpression):
 
 
 class AstTryCatchExpression(AstExpression):
+    __slots__ = ["expression", "catchHandler", "finallyHandler"]
+
     def __init__(self, expression, catchHandler, finallyHandler, location):
         super(AstTryCatchExpression, self).__init__(location)
         self.expression = expression
@@ -636,6 +749,8 @@ class AstTryCatchExpression(AstExpression):
 
 
 class AstLambdaExpression(AstExpression):
+    __slots__ = ["name", "typeParameters", "parameters", "body"]
+
     def __init__(self, name, typeParameters, parameters, body, location):
         super(AstLambdaExpression, self).__init__(location)
         self.name = name
@@ -658,6 +773,8 @@ class AstLambdaExpression(AstExpression):
 
 
 class AstReturnExpression(AstExpression):
+    __slots__ = ["expression"]
+
     def __init__(self, expression, location):
         super(AstReturnExpression, self).__init__(location)
         self.expression = expression
@@ -673,10 +790,12 @@ class AstReturnExpression(AstExpression):
 
 
 class AstLiteral(AstNode):
-    pass
+    __slots__ = []
 
 
 class AstIntegerLiteral(AstLiteral):
+    __slots__ = ["value", "width"]
+
     def __init__(self, value, width, location):
         super(AstIntegerLiteral, self).__init__(location)
         self.value = value
@@ -693,6 +812,8 @@ class AstIntegerLiteral(AstLiteral):
 
 
 class AstFloatLiteral(AstLiteral):
+    __slots__ = ["value", "width"]
+
     def __init__(self, value, width, location):
         super(AstFloatLiteral, self).__init__(location)
         self.value = value
@@ -709,6 +830,8 @@ class AstFloatLiteral(AstLiteral):
 
 
 class AstBooleanLiteral(AstLiteral):
+    __slots__ = ["value"]
+
     def __init__(self, value, location):
         super(AstBooleanLiteral, self).__init__(location)
         self.value = value
@@ -724,6 +847,8 @@ class AstBooleanLiteral(AstLiteral):
 
 
 class AstNullLiteral(AstLiteral):
+    __slots__ = []
+
     def __repr__(self):
         return "AstNullLiteral"
 
@@ -732,6 +857,8 @@ class AstNullLiteral(AstLiteral):
 
 
 class AstStringLiteral(AstLiteral):
+    __slots__ = ["value"]
+
     def __init__(self, value, location):
         super(AstStringLiteral, self).__init__(location)
         self.value = value
@@ -746,6 +873,90 @@ class AstStringLiteral(AstLiteral):
         return utils.encodeString(self.value)
 
 
+_fileNames = []
+_fileIndices = {}
+_specialLocations = [None, NoLoc]   # indexed by negative fileIndex
+_COLUMN_BITS = 32
+_COLUMN_MASK = (1 << _COLUMN_BITS) - 1
+
+
+def _comparedFields(nodeClass):
+    # Returns the names of the fields compared by AstNode.__eq__: every slot except the
+    # ones holding the location.
+    fields = _comparedFieldsCache.get(nodeClass)
+    if fields is None:
+        fields = [name for cls in reversed(nodeClass.__mro__)
+                  for name in cls.__dict__.get("__slots__", [])
+                  if name not in ("fileIndex", "begin", "end")]
+        _comparedFieldsCache[nodeClass] = fields
+    return fields
+
+_comparedFieldsCache = {}
+
+
+def encodeAst(ast):
+    # Converts an AST into nested tuples, lists, and primitive values, which can be
+    # written with marshal. Each node becomes a tuple of its class name, location, and
+    # compared fields (including id). File names are collected into a separate table, so
+    # the encoding doesn't depend on this process's _fileNames.
+    fileNames = []
+    fileIndices = {}
+
+    def encode(value):
+        if isinstance(value, AstNode):
+            fileIndex = value.fileIndex
+            if fileIndex >= 0:
+                fileName = _fileNames[fileIndex]
+                fileIndex = fileIndices.get(fileName)
+                if fileIndex is None:
+                    fileIndex = len(fileNames)
+                    fileNames.append(fileName)
+                    fileIndices[fileName] = fileIndex
+            fields = tuple(encode(getattr(value, name, None))
+                           for name in _comparedFields(value.__class__))
+            return (value.__class__.__name__, fileIndex, value.begin, value.end) + fields
+        elif isinstance(value, list):
+            return [encode(v) for v in value]
+        else:
+            assert not isinstance(value, tuple)
+            return value
+
+    return (fileNames, encode(ast))
+
+
+def decodeAst(data):
+    # Reverses encodeAst. Node ids are restored, so addNodeIds doesn't need to run again.
+    fileNames, tree = data
+    fileIndices = []
+    for fileName in fileNames:
+        fileIndex = _fileIndices.get(fileName)
+        if fileIndex is None:
+            fileIndex = len(_fileNames)
+            _fileNames.append(fileName)
+            _fileIndices[fileName] = fileIndex
+        fileIndices.append(fileIndex)
+    nodeClasses = globals()
+
+    def decode(value):
+        if isinstance(value, tuple):
+            nodeClass = nodeClasses[value[0]]
+            node = nodeClass.__new__(nodeClass)
+            fileIndex = value[1]
+            node.fileIndex = fileIndices[fileIndex] if fileIndex >= 0 else fileIndex
+            node.begin = value[2]
+            node.end = value[3]
+            for name, field in zip(_comparedFields(nodeClass), value[4:]):
+                if field is not None or name != "id":
+                    setattr(node, name, decode(field))
+            return node
+        elif isinstance(value, list):
+            return [decode(v) for v in value]
+        else:
+            return value
+
+    return decode(tree)
+
+
 class AstNodeVisitor(visitor.Visitor):
     def visitChildren(self, node):
         for child in node.children():
@@ -0,0 +1,77 @@
+# Copyright 2014, Jay Conrod. All rights reserved.
+#
+# This file is part of Gypsum. Use of this source code is governed by
+# the GPL license that can be found in the LICENSE.txt file.
+
+
+import hashlib
+import marshal
+import os
+import os.path
+import tempfile
+import zlib
+
+import ast
+
+
+class AstCache(object):
+    # Stores parsed ASTs in a directory, so unchanged sources don't need to be lexed, laid
+    # out, and parsed again. Entries are keyed by a hash of the file name, the source, and
+    # the front-end modules, so changes to the lexer or parser invalidate old entries.
+    # Entries which can't be read are treated as missing.
+    def __init__(self, directory, version=None):
+        self.directory = directory
+        self.version = version if version is not None else frontEndVersion()
+
+    def load(self, fileName, source):
+        try:
+            with open(self.entryPath(fileName, source), "rb") as entryFile:
+                data = marshal.loads(zlib.decompress(entryFile.read()))
+            return ast.decodeAst(data)
+        except (IOError, EOFError, ValueError, TypeError, KeyError, IndexError, zlib.error):
+            return None
+
+    def store(self, fileName, source, module):
+        # The entry is written to a temporary file first, so concurrent compilers never
+        # see a partially written entry.
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        data = zlib.compress(marshal.dumps(ast.encodeAst(module), 2))
+        fd, tempPath = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as entryFile:
+                entryFile.write(data)
+            os.rename(tempPath, self.entryPath(fileName, source))
+        except:
+            os.remove(tempPath)
+            raise
+
+    def entryPath(self, fileName, source):
+        key = hashlib.sha1()
+        key.update(self.version)
+        key.update(fileName + "\0")
+        key.update(source)
+        return os.path.join(self.directory, key.hexdigest() + ".ast")
+
+
+# Modules which produce ASTs, and every local module they import.
+_FRONT_END_MODULES = ["ast", "combinators", "data", "errors", "layout", "lexer", "location",
+                      "parser", "tok", "utils", "visitor"]
+
+
+def frontEndVersion():
+    # Returns a hash of the source code of the modules which produce ASTs.
+    global _frontEndVersion
+    if _frontEndVersion is None:
+        versionHash = hashlib.sha1()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in _FRONT_END_MODULES:
+            with open(os.path.join(directory, name + ".py"), "rb") as moduleFile:
+                versionHash.update(moduleFile.read())
+        _frontEndVersion = versionHash.hexdigest()
+    return _frontEndVersion
+
+_frontEndVersion = None
+
+
+__all__ = ["AstCache"]
@@ -96,7 +96,7 @@ def _initialize():
         else:
             m = re.match(r"([A-Za-z0-9_-]+)(\??)", typeName)
             clas = _builtinClassNameMap[m.group(1)]
-            flags = frozenset([ir_types.NULLABLE_TYPE_FLAG] if m.group(2) == "?" else [])
+            flags = ir_types.NULLABLE_TYPE_FLAG if m.group(2) == "?" else 0
             return ir_types.ClassType(clas, (), flags)
 
     def buildFunction(functionData):
@@ -149,6 +149,8 @@ def _initialize():
         inheritedMethodCount = len(clas.methods)
         for m in classData["methods"]:
             addMethod(clas.methods, inheritedMethodCount, buildMethod(m, clas))
+        # addMethod replaces overridden methods in place, which getMemberIndex can't detect.
+        clas.buildMemberIndex()
 
         _builtinClassTypeMap[buildType(clas.name)] = clas
 
@@ -4,57 +4,195 @@
 # the GPL license that can be found in the LICENSE.txt file.
 
 
+import sys
+
 from location import Location
+from tok import TokenTable, TAG_CODES
+
+
+class TokenStream(object):
+    # Buffers tokens from an iterable as the parser asks for them, so the parser can consume
+    # the output of iterLex and iterLayout without those being turned into lists first.
+    # Parsers share a stream and refer to tokens by position. Since the parser may
+    # backtrack, tokens stay in the buffer once they've been read, until a parser which
+    # knows nothing will backtrack past a position releases the tokens before it (see
+    # CommittedRep). The buffer is a TokenTable, so buffered tokens are stored compactly.
+    # If memo is a MemoTable, Memo parsers cache their results in it for the duration of
+    # the parse.
+    #
+    # Positions are counted from the beginning of the stream; base is the position of the
+    # first token in the buffer. Released tokens are only removed from streams which read
+    # from an iterator, since other streams' tokens are held by the caller anyway.
+    def __init__(self, tokens, memo=None, filename=None):
+        if isinstance(tokens, TokenTable):
+            self.buffer = tokens
+            self.iterator = None
+        elif isinstance(tokens, list):
+            self.buffer = TokenTable.fromTokens(tokens)
+            self.iterator = None
+        else:
+            self.buffer = TokenTable()
+            self.iterator = iter(tokens)
+
+        self.size = len(self.buffer)
+        self.base = 0
+        self.canRelease = self.iterator is not None
+
+        # Locations where results beginning before base begin, as (row, column) pairs,
+        # keyed by position. Only positions passed to release as keepBegin are kept.
+        self.releasedBegins = {}
+        self.filename = filename
+        self.memo = memo
+        if memo is not None:
+            memo.clear()
+
+        # Parsers return the FAIL sentinel when they fail. The information needed to report
+        # the most recent failure is kept here. failReason is either a message or the
+        # parser that failed, which can build a message later (see failureMessage). The
+        # failure's location spans tokens failBegin through failEnd. failRetry is False if
+        # the failure happened inside a Commit.
+        self.failReason = None
+        self.failBegin = 0
+        self.failEnd = 0
+        self.failRetry = True
+
+    def fill(self, pos):
+        # Reads tokens until the token at pos is buffered. Returns False if the stream
+        # ends first.
+        while pos >= self.size:
+            if self.iterator is None:
+                return False
+            try:
+                self.buffer.append(next(self.iterator))
+                self.size += 1
+            except StopIteration:
+                self.iterator = None
+                return False
+        return True
+
+    def isEmpty(self, pos):
+        return pos >= self.size and not self.fill(pos)
+
+    def release(self, pos, keepBegin):
+        # Allows tokens before pos to be removed from the buffer. Parsers won't read these
+        # tokens again, but a result that begins at keepBegin may still need its location.
+        # To avoid copying the buffer too often, it's only trimmed once at least half of
+        # it may be removed.
+        if not self.canRelease or pos <= self.base:
+            return
+        buffer = self.buffer
+        if self.base <= keepBegin < pos and keepBegin not in self.releasedBegins:
+            index = keepBegin - self.base
+            self.releasedBegins[keepBegin] = (buffer.beginRows[index],
+                                              buffer.beginColumns[index])
+        count = pos - self.base
+        if count < _MIN_RELEASE_COUNT or 2 * count < len(buffer):
+            return
+        trimmed = TokenTable(buffer.fileName, buffer.source)
+        trimmed.extend(buffer[index] for index in xrange(count, len(buffer)))
+        self.buffer = trimmed
+        self.base = pos
+
+    def location(self, begin, end):
+        # Returns the location of tokens begin through end. A parser that doesn't consume
+        # anything has the location of the next token, so end may be past the end of the
+        # stream. In that case, the last token's location is used.
+        if end >= self.size and not self.fill(end):
+            end = self.size - 1
+            if end < 0:
+                return Location(self.filename, 1, 1, 1, 1)
+            if begin > end:
+                begin = end
+        buffer = self.buffer
+        base = self.base
+        if begin >= base:
+            beginRow = buffer.beginRows[begin - base]
+            beginColumn = buffer.beginColumns[begin - base]
+        else:
+            beginRow, beginColumn = self.releasedBegins[begin]
+        return Location(buffer.fileName, beginRow, beginColumn,
+                        buffer.endRows[end - base], buffer.endColumns[end - base])
+
+    def fail(self, reason, begin, end):
+        self.failReason = reason
+        self.failBegin = begin
+        self.failEnd = end
+        self.failRetry = True
+        return FAIL
+
+    def saveFailure(self):
+        return self.failReason, self.failBegin, self.failEnd, self.failRetry
+
+    def restoreFailure(self, failure):
+        self.failReason, self.failBegin, self.failEnd, self.failRetry = failure
+        return FAIL
+
+    def failure(self):
+        # Builds a Failure describing the most recent failure.
+        reason = self.failReason
+        if isinstance(reason, Parser):
+            message = reason.failureMessage(self, self.failBegin)
+        else:
+            message = reason
+        failure = Failure(self.location(self.failBegin, self.failEnd), message)
+        failure.retry = self.failRetry
+        return failure
 
 
 class Reader(object):
+    # A position in a token stream. Parsers don't use readers internally (they pass
+    # positions around instead), but readers are a convenient way to start a parse.
     def __init__(self, filename, tokens, pos=0):
         self.filename = filename
-        self.tokens = tokens
+        self.tokens = tokens if isinstance(tokens, TokenStream) \
+                      else TokenStream(tokens, filename=filename)
+        if self.tokens.filename is None:
+            self.tokens.filename = filename
         self.pos = pos
 
     def isEmpty(self):
-        return self.pos == len(self.tokens)
+        return self.tokens.isEmpty(self.pos)
 
     def token(self):
         assert not self.isEmpty()
-        return self.tokens[self.pos]
+        return self.tokens.buffer[self.pos - self.tokens.base]
+
+    def tag(self):
+        assert not self.isEmpty()
+        return self.tokens.buffer.tag(self.pos - self.tokens.base)
+
+    def text(self):
+        assert not self.isEmpty()
+        return self.tokens.buffer.text(self.pos - self.tokens.base)
 
     def location(self):
-        if not self.isEmpty():
-            return self.tokens[self.pos].location
-        elif len(self.tokens) > 0:
-            return self.tokens[-1].location
-        else:
-            return Location(self.filename, 1, 1, 1, 1)
+        return self.tokens.location(self.pos, self.pos)
 
     def next(self):
         assert not self.isEmpty()
         return Reader(self.filename, self.tokens, self.pos + 1)
 
 
-class ParseResult(object):
-    def __init__(self, location):
-        self.location = location
-
-
-class Success(ParseResult):
-    def __init__(self, location, value, next):
-        super(Success, self).__init__(location)
-        self.value = value;
+class Success(object):
+    # The result of a successful parse. begin and end are the indices of the first and last
+    # tokens in the result's location; the location itself is only created when it's
+    # needed. next is the position after the parsed tokens.
+    def __init__(self, value, begin, end, next):
+        self.value = value
+        self.begin = begin
+        self.end = end
         self.next = next
 
     def __nonzero__(self):
         return True
 
     def __repr__(self):
-        return "Success(%s, %s, %s)" % \
-          (repr(self.location), repr(self.value), repr(self.next.pos))
+        return "Success(%s, %d, %d, %d)" % (repr(self.value), self.begin, self.end, self.next)
 
 
-class Failure(ParseResult):
+class Failure(object):
     def __init__(self, location, message):
-        super(Failure, self).__init__(location)
+        self.location = location
         self.message = message
         self.retry = True
 
@@ -65,12 +203,84 @@ class Failure(ParseResult):
         return "Failure(%s, %s, %s)" % (self.location, self.message, self.retry)
 
 
+# Returned by parsers when they fail. Details are stored in the TokenStream.
+FAIL = Failure(None, None)
+
+# The fewest released tokens a TokenStream removes from its buffer at once.
+_MIN_RELEASE_COUNT = 256
+
+
 class FailValue(object):
     def __init__(self, message="syntax error"):
         self.message = message
 
 
+class First(object):
+    # Describes which tokens a parser may start with. texts contains (tag code, text) pairs
+    # for tokens that must match exactly, and tags contains tag codes for tokens that may
+    # have any text. A parser is nullable if it may succeed without consuming anything.
+    # If unknown is true, the parser must always be tried: we can't tell which tokens it
+    # starts with, or it may fail without retry on tokens it doesn't start with.
+    def __init__(self, texts=frozenset(), tags=frozenset(), nullable=False, unknown=False):
+        self.texts = texts
+        self.tags = tags
+        self.nullable = nullable
+        self.unknown = unknown
+
+    def __or__(self, other):
+        return First(self.texts | other.texts, self.tags | other.tags,
+                     self.nullable or other.nullable, self.unknown or other.unknown)
+
+    def then(self, other):
+        # Returns the FIRST set of a sequence of a parser with this set followed by a
+        # parser with the other set.
+        if not self.nullable:
+            return self
+        return First(self.texts | other.texts, self.tags | other.tags,
+                     other.nullable, self.unknown or other.unknown)
+
+    def optional(self):
+        return First(self.texts, self.tags, True, self.unknown)
+
+    def canStartWith(self, tagCode, text):
+        return self.unknown or self.nullable or tagCode in self.tags or \
+               (tagCode, text) in self.texts
+
+
+UNKNOWN_FIRST = First(unknown=True)
+
+
 class Parser(object):
+    # Parsers implement parse, which takes a TokenStream and a position and returns either
+    # a Success or FAIL. Calling a parser with a Reader parses from the reader's position
+    # and returns a Failure with a message if parsing fails.
+    #
+    # Parsers also implement computeFirst, which returns a First describing tokens the
+    # parser may start with. Choice uses this to skip alternatives that can't match.
+    firstSet = None
+
+    def __call__(self, reader):
+        stream = reader.tokens
+        result = self.parse(stream, reader.pos)
+        if result is FAIL:
+            return stream.failure()
+        return result
+
+    def failureMessage(self, stream, pos):
+        return "syntax error"
+
+    def first(self):
+        # The grammar is recursive, so we may be asked for our own FIRST set while it's
+        # being computed. That would only happen with left recursion, which these parsers
+        # don't support anyway, so UNKNOWN_FIRST is a safe answer.
+        if self.firstSet is None:
+            self.firstSet = UNKNOWN_FIRST
+            self.firstSet = self.computeFirst()
+        return self.firstSet
+
+    def computeFirst(self):
+        return UNKNOWN_FIRST
+
     def __xor__(self, other):
         return Process(self, other)
 
@@ -78,36 +288,58 @@ class Parser(object):
         return Concatenate(self, other)
 
     def __or__(self, other):
-        return Alternate(self, other)
+        left = self.parsers if isinstance(self, Choice) else [self]
+        right = other.parsers if isinstance(other, Choice) else [other]
+        return Choice(left + right)
 
 
 class Reserved(Parser):
     def __init__(self, tag, text):
         self.tag = tag
+        self.tagCode = TAG_CODES[tag]
         self.text = text
 
-    def __call__(self, reader):
-        if reader.isEmpty():
-            return Failure(reader.location(), "unexpected end of file")
-        token = reader.token()
-        if token.tag is not self.tag or token.text != self.text:
-            return Failure(token.location, "expected %s but found %s" % (self.text, token.text))
+    def parse(self, stream, pos):
+        if pos >= stream.size and not stream.fill(pos):
+            return stream.fail(self, pos, pos)
+        buffer = stream.buffer
+        index = pos - stream.base
+        if buffer.tags[index] != self.tagCode or buffer.text(index) != self.text:
+            return stream.fail(self, pos, pos)
         else:
-            return Success(token.location, token.text, reader.next())
+            return Success(self.text, pos, pos, pos + 1)
+
+    def computeFirst(self):
+        return First(texts=frozenset([(self.tagCode, self.text)]))
+
+    def failureMessage(self, stream, pos):
+        if stream.isEmpty(pos):
+            return "unexpected end of file"
+        return "expected %s but found %s" % (self.text, stream.buffer.text(pos - stream.base))
 
 
 class Tag(Parser):
     def __init__(self, tag):
         self.tag = tag
-
-    def __call__(self, reader):
-        if reader.isEmpty():
-            return Failure(reader.location(), "unexpected end of file")
-        token = reader.token()
-        if token.tag is not self.tag:
-            return Failure(token.location, "expected %s but found %s" % (self.tag, token.tag))
+        self.tagCode = TAG_CODES[tag]
+
+    def parse(self, stream, pos):
+        if pos >= stream.size and not stream.fill(pos):
+            return stream.fail(self, pos, pos)
+        buffer = stream.buffer
+        index = pos - stream.base
+        if buffer.tags[index] != self.tagCode:
+            return stream.fail(self, pos, pos)
         else:
-            return Success(token.location, token.text, reader.next())
+            return Success(buffer.text(index), pos, pos, pos + 1)
+
+    def computeFirst(self):
+        return First(tags=frozenset([self.tagCode]))
+
+    def failureMessage(self, stream, pos):
+        if stream.isEmpty(pos):
+            return "unexpected end of file"
+        return "expected %s but found %s" % (self.tag, stream.buffer.tag(pos - stream.base))
 
 
 class Commit(Parser):
@@ -115,22 +347,122 @@ class Commit(Parser):
         assert isinstance(parser, Parser)
         self.parser = parser
 
-    def __call__(self, reader):
-        result = self.parser(reader)
-        if not result:
-            result.retry = False
+    def parse(self, stream, pos):
+        memo = stream.memo
+        if memo is not None:
+            memo.evict(pos)
+        result = self.parser.parse(stream, pos)
+        if result is FAIL:
+            stream.failRetry = False
         return result
 
+    def computeFirst(self):
+        # A Commit fails without retry on tokens its parser can't start with, so it must
+        # always be tried.
+        return UNKNOWN_FIRST
+
+
+class MemoTable(object):
+    # Cache for Memo parsers, used for packrat parsing. Results are keyed by token position
+    # and parser. Parsers rarely backtrack to a position before a Commit, so when a Commit
+    # is reached, entries for earlier positions are discarded. This keeps the table small;
+    # if an evicted result is needed again, it is just parsed again.
+    #
+    # Hits and misses are counted for each Memo by name, so it's easy to see which rules
+    # benefit from caching. Counters accumulate if the table is used for several parses.
+    def __init__(self):
+        self.entries = {}
+        self.low = 0
+        self.hits = {}
+        self.misses = {}
+
+    def clear(self):
+        self.entries = {}
+        self.low = 0
+
+    def evict(self, pos):
+        if pos <= self.low:
+            return
+        for p in xrange(self.low, pos):
+            self.entries.pop(p, None)
+        self.low = pos
+
+    def parse(self, memo, stream, pos):
+        results = self.entries.get(pos)
+        if results is not None and memo in results:
+            self.hits[memo.name] = self.hits.get(memo.name, 0) + 1
+            result = results[memo]
+            if type(result) is tuple:
+                return stream.restoreFailure(result)
+            return result
+        self.misses[memo.name] = self.misses.get(memo.name, 0) + 1
+        result = memo.parser.parse(stream, pos)
+        if pos >= self.low:
+            entry = stream.saveFailure() if result is FAIL else result
+            self.entries.setdefault(pos, {})[memo] = entry
+        return result
+
+    def hitRate(self, name):
+        hits = self.hits.get(name, 0)
+        total = hits + self.misses.get(name, 0)
+        return float(hits) / total if total > 0 else 0.0
+
+    def stats(self):
+        names = sorted(set(self.hits.keys() + self.misses.keys()))
+        return [(name, self.hits.get(name, 0), self.misses.get(name, 0), self.hitRate(name))
+                for name in names]
+
+
+class Memo(Parser):
+    # Caches the results of a parser in the stream's MemoTable. If the stream has no
+    # MemoTable, this just calls the parser. Since results may be shared, parsers that
+    # consume them must not modify them.
+    def __init__(self, parser, name):
+        assert isinstance(parser, Parser)
+        self.parser = parser
+        self.name = name
+
+    def parse(self, stream, pos):
+        memo = stream.memo
+        if memo is None:
+            return self.parser.parse(stream, pos)
+        return memo.parse(self, stream, pos)
+
+    def computeFirst(self):
+        return self.parser.first()
+
+
+def rule(builder):
+    # Decorator for functions that build grammar rules. The first call builds the parser;
+    # later calls with the same arguments return the same object. This lets the whole
+    # grammar be built once and shared by every parse, and it means each Lazy referring
+    # to a rule resolves to the shared parser instead of building its own copy.
+    parsers = {}
+    def build(*args):
+        parser = parsers.get(args)
+        if parser is None:
+            parser = builder(*args)
+            parsers[args] = parser
+        return parser
+    build.__name__ = builder.__name__
+    build.parsers = parsers
+    return build
+
 
 class Lazy(Parser):
     def __init__(self, parserFunc):
         self.parserFunc = parserFunc
         self.parser = None
 
-    def __call__(self, reader):
+    def parse(self, stream, pos):
+        if not self.parser:
+            self.parser = self.parserFunc()
+        return self.parser.parse(stream, pos)
+
+    def computeFirst(self):
         if not self.parser:
             self.parser = self.parserFunc()
-        return self.parser(reader)
+        return self.parser.first()
 
 
 class Phrase(Parser):
@@ -138,12 +470,15 @@ class Phrase(Parser):
         assert isinstance(parser, Parser)
         self.parser = parser
 
-    def __call__(self, reader):
-        result = self.parser(reader)
-        if result and not result.next.isEmpty():
-            return Failure(result.location, "found garbage at end of file")
+    def parse(self, stream, pos):
+        result = self.parser.parse(stream, pos)
+        if result is not FAIL and not stream.isEmpty(result.next):
+            return stream.fail("found garbage at end of file", result.begin, result.end)
         return result
 
+    def computeFirst(self):
+        return self.parser.first()
+
 
 class Process(Parser):
     def __init__(self, parser, process):
@@ -151,15 +486,20 @@ class Process(Parser):
         self.parser = parser
         self.process = process
 
-    def __call__(self, reader):
-        result = self.parser(reader)
-        if not result:
+    def parse(self, stream, pos):
+        result = self.parser.parse(stream, pos)
+        if result is FAIL:
             return result
-        value = self.process(result.value, result.location)
+        begin = result.begin
+        end = result.end
+        value = self.process(result.value, stream.location(begin, end))
         if isinstance(value, FailValue):
-            return Failure(result.location, value.message)
+            return stream.fail(value.message, begin, end)
         else:
-            return Success(result.location, value, result.next)
+            return Success(value, begin, end, result.next)
+
+    def computeFirst(self):
+        return self.parser.first()
 
 
 def If(parser, f):
@@ -171,11 +511,14 @@ class Opt(Parser):
         assert isinstance(parser, Parser)
         self.parser = parser
 
-    def __call__(self, reader):
-        result = self.parser(reader)
-        if result or not result.retry:
+    def parse(self, stream, pos):
+        result = self.parser.parse(stream, pos)
+        if result is not FAIL or not stream.failRetry:
             return result
-        return Success(reader.location(), None, reader)
+        return Success(None, pos, pos, pos)
+
+    def computeFirst(self):
+        return self.parser.first().optional()
 
 
 class Concatenate(Parser):
@@ -184,31 +527,84 @@ class Concatenate(Parser):
         self.left = left
         self.right = right
 
-    def __call__(self, reader):
-        left_result = self.left(reader)
-        if not left_result:
+    def parse(self, stream, pos):
+        left_result = self.left.parse(stream, pos)
+        if left_result is FAIL:
             return left_result
-        right_result = self.right(left_result.next)
-        if not right_result:
+        right_result = self.right.parse(stream, left_result.next)
+        if right_result is FAIL:
             return right_result
-        return Success(left_result.location.combine(right_result.location),
-                       (left_result.value, right_result.value),
-                       right_result.next)
-
-
-class Alternate(Parser):
-    def __init__(self, left, right):
-        assert isinstance(left, Parser) and isinstance(right, Parser)
-        self.left = left
-        self.right = right
+        return Success((left_result.value, right_result.value),
+                       left_result.begin, right_result.end, right_result.next)
+
+    def computeFirst(self):
+        left = self.left.first()
+        if not left.nullable:
+            return left
+        return left.then(self.right.first())
+
+
+class Choice(Parser):
+    # Tries each parser in order and returns the first success (or the first failure that
+    # can't be retried). "a | b | c" builds a Choice of all three.
+    #
+    # Instead of trying every alternative, Choice looks up the next token in a table
+    # built from the alternatives' FIRST sets, and only tries the alternatives that could
+    # start with it. If all of them fail, the result must be the same failure reported
+    # by trying everything, which comes from the last alternative, so that one is always
+    # tried at the end.
+    def __init__(self, parsers):
+        assert len(parsers) > 0 and all(isinstance(p, Parser) for p in parsers)
+        self.parsers = parsers
+        self.textTables = None
+        self.tagTable = None
+        self.defaultParsers = None
+        self.endParsers = None
+
+    def parse(self, stream, pos):
+        if self.tagTable is None:
+            self.buildTables()
+        if pos >= stream.size and not stream.fill(pos):
+            parsers = self.endParsers
+        else:
+            buffer = stream.buffer
+            index = pos - stream.base
+            tagCode = buffer.tags[index]
+            parsers = None
+            texts = self.textTables.get(tagCode)
+            if texts is not None:
+                parsers = texts.get(buffer.text(index))
+            if parsers is None:
+                parsers = self.tagTable.get(tagCode, self.defaultParsers)
+
+        for parser in parsers:
+            result = parser.parse(stream, pos)
+            if result is not FAIL or not stream.failRetry:
+                return result
+        return result
 
-    def __call__(self, reader):
-        result = self.left(reader)
-        if result:
-            return result
-        if not result.retry:
-            return result
-        return self.right(reader)
+    def computeFirst(self):
+        return reduce(lambda a, b: a | b, (p.first() for p in self.parsers))
+
+    def buildTables(self):
+        firsts = [p.first() for p in self.parsers]
+        def viable(canStart):
+            parsers = [p for p, first in zip(self.parsers, firsts) if canStart(first)]
+            if not parsers or parsers[-1] is not self.parsers[-1]:
+                parsers.append(self.parsers[-1])
+            return parsers
+
+        texts = reduce(lambda a, b: a | b, (first.texts for first in firsts))
+        tags = reduce(lambda a, b: a | b, (first.tags for first in firsts))
+        self.textTables = {}
+        for tagCode, text in texts:
+            self.textTables.setdefault(tagCode, {})[text] = \
+                viable(lambda first: first.canStartWith(tagCode, text))
+        self.tagTable = {}
+        for tagCode in tags | frozenset(self.textTables.keys()):
+            self.tagTable[tagCode] = viable(lambda first: first.canStartWith(tagCode, None))
+        self.defaultParsers = viable(lambda first: first.canStartWith(None, None))
+        self.endParsers = viable(lambda first: first.unknown or first.nullable)
 
 
 class Rep(Parser):
@@ -216,19 +612,48 @@ class Rep(Parser):
         assert isinstance(parser, Parser)
         self.parser = parser
 
-    def __call__(self, reader):
+    def parse(self, stream, pos):
+        elements = []
+        end = pos
+        next = pos
+        result = self.parser.parse(stream, next)
+        while result is not FAIL:
+            elements.append(result.value)
+            end = result.end
+            next = result.next
+            result = self.parser.parse(stream, next)
+        if not stream.failRetry:
+            return result
+        return Success(elements, pos, end, next)
+
+    def computeFirst(self):
+        return self.parser.first().optional()
+
+
+class CommittedRep(Rep):
+    # Like Rep, but once an element has been parsed, the tokens before the end of its
+    # result are released from the stream, along with memoized results for them. This is
+    # only correct where no enclosing parser can backtrack into the repetition, and where
+    # enclosing results begin where the repetition does, as with the definitions in a
+    # module. Each definition is committed once its keyword is read, so the stream only
+    # needs to hold the definition being parsed.
+    def parse(self, stream, pos):
         elements = []
-        location = reader.location()
-        next = reader
-        result = self.parser(next)
-        while result:
+        end = pos
+        next = pos
+        result = self.parser.parse(stream, next)
+        while result is not FAIL:
             elements.append(result.value)
-            location = location.combine(result.location)
+            end = result.end
             next = result.next
-            result = self.parser(next)
-        if not result.retry:
+            stream.release(end, pos)
+            memo = stream.memo
+            if memo is not None:
+                memo.evict(end)
+            result = self.parser.parse(stream, next)
+        if not stream.failRetry:
             return result
-        return Success(location, elements, next)
+        return Success(elements, pos, end, next)
 
 
 def Rep1(parser):
@@ -258,34 +683,116 @@ class LeftRec(Parser):
         self.next = next
         self.combine = combine
 
-    def __call__(self, reader):
-        result = self.left(reader)
-        if not result:
+    def parse(self, stream, pos):
+        result = self.left.parse(stream, pos)
+        if result is FAIL:
             return result
 
         while True:
-            nextResult = self.next(result.next)
-            if not nextResult:
+            nextResult = self.next.parse(stream, result.next)
+            if nextResult is FAIL:
                 break
 
-            loc = result.location.combine(nextResult.location)
+            loc = stream.location(result.begin, nextResult.end)
             nextValue = self.combine(result.value, nextResult.value, loc)
             if isinstance(nextValue, FailValue):
                 break
 
-            result = nextResult
-            result.value = nextValue
+            result = Success(nextValue, nextResult.begin, nextResult.end, nextResult.next)
         return result
 
+    def computeFirst(self):
+        return self.left.first()
+
+
+class Precedence(Parser):
+    # Parses terms separated by binary operators using precedence climbing. precedenceOf
+    # maps the text of an operator (a token with the given tag) to its level; operators at
+    # lower levels bind more tightly. Operators are read once, and their levels are
+    # remembered by text.
+    #
+    # Consecutive operators at the same level are collected into a list of the form
+    # [(None, term), (op, term), ...], which is passed to process along with its location,
+    # as with Process. If the term after an operator can't be parsed, the expression ends
+    # before the operator.
+    #
+    # This matches the result of nesting LeftRec parsers, one for each level, with
+    # suffixes that accept only operators of that level. Spans of results match too: like
+    # LeftRec, a result spans the last operator and its right operand.
+    def __init__(self, term, tag, precedenceOf, process):
+        assert isinstance(term, Parser)
+        self.term = term
+        self.tagCode = TAG_CODES[tag]
+        self.precedenceOf = precedenceOf
+        self.process = process
+        self.levels = {}
+
+    def parse(self, stream, pos):
+        return self.parseLevels(stream, pos, sys.maxint)
+
+    def computeFirst(self):
+        return self.term.first()
+
+    def levelAt(self, stream, pos):
+        if pos >= stream.size and not stream.fill(pos):
+            return None
+        buffer = stream.buffer
+        index = pos - stream.base
+        if buffer.tags[index] != self.tagCode:
+            return None
+        text = buffer.text(index)
+        level = self.levels.get(text)
+        if level is None:
+            level = self.precedenceOf(text)
+            self.levels[text] = level
+        return level
+
+    def parseLevels(self, stream, pos, maxLevel):
+        # Parses an expression containing operators up to maxLevel.
+        result = self.term.parse(stream, pos)
+        if result is FAIL:
+            return result
+
+        minLevel = 0
+        while True:
+            opPos = result.next
+            level = self.levelAt(stream, opPos)
+            if level is None or level < minLevel or level > maxLevel:
+                return result
+
+            chain = [(None, result.value)]
+            while True:
+                memo = stream.memo
+                if memo is not None:
+                    memo.evict(opPos + 1)
+                right = self.parseLevels(stream, opPos + 1, level - 1)
+                if right is FAIL:
+                    break
+                chain.append((stream.buffer.text(opPos - stream.base), right.value))
+                begin = opPos
+                end = right.end
+                next = right.next
+                opPos = next
+                if self.levelAt(stream, opPos) != level:
+                    break
+            if len(chain) == 1:
+                return result
+
+            value = self.process(chain, stream.location(begin, end))
+            if isinstance(value, FailValue):
+                return stream.fail(value.message, begin, end)
+            result = Success(value, begin, end, next)
+            minLevel = level + 1
+
 
 class Break(Parser):
     def __init__(self, parser):
         assert isinstance(parser, Parser)
         self.parser = parser
 
-    def __call__(self, reader):
+    def parse(self, stream, pos):
         import pdb; pdb.set_trace()
-        result = self.parser(reader)
+        result = self.parser.parse(stream, pos)
         return result
 
 
@@ -298,6 +805,6 @@ def untangle(parsed):
             elements.extend(untangle(element))
         return elements
 
-__all__ = ["Reader", "Rep", "Rep1", "RepSep", "Rep1Sep", "Phrase", "Tag",
-           "Reserved", "Opt", "Lazy", "LeftRec", "Commit", "If", "FailValue",
-           "untangle"]
+__all__ = ["TokenStream", "Reader", "Rep", "CommittedRep", "Rep1", "RepSep", "Rep1Sep",
+           "Phrase", "Tag", "Reserved", "Opt", "Choice", "MemoTable", "Memo", "rule", "Lazy", "LeftRec",
+           "Precedence", "Commit", "If", "FailValue", "untangle"]
@@ -7,6 +7,7 @@
 import ast
 import builtins
 import data
+from flags import LET
 import ir
 import ir_types
 
@@ -28,57 +29,128 @@ class CompileInfo(object):
             package = ir.Package()
         self.ast = ast
         self.package = package
-        self.scopes = {}
+        self.scopes = SideTable()
         self.globalScope = None
-        self.contextInfo = {}
-        self.closureInfo = {}
-        self.defnInfo = {}
-        self.useInfo = {}
-        self.classInfo = {}
-        self.typeInfo = {}
-        self.callInfo = {}
-
-    def _get(self, key, dictionary):
-        return dictionary[self._key(key)]
-
-    def _set(self, key, value, dictionary):
-        dictionary[self._key(key)] = value
-
-    def _has(self, key, dictionary):
-        return self._key(key) in dictionary
-
-    def _key(self, k):
-        if isinstance(k, int):
-            return k
-        elif isinstance(k, ast.AstNode):
-            return k.id
-        elif hasattr(k, "astDefn") and k.astDefn is not None:
-            return k.astDefn.id
-        elif builtins.isBuiltinId(k.id) and isinstance(k, ir.Function):
-            # TODO: fix this hack. We add an offset to builtin function ids to disambiguate
-            # them from class ids.
-            return k.id - 100
+        self.contextInfo = SideTable()
+        self.closureInfo = SideTable()
+        self.defnInfo = SideTable()
+        self.useInfo = SideTable()
+        self.classInfo = SideTable()
+        self.typeInfo = SideTable()
+        self.callInfo = SideTable()
+
+        # A count for each name of the times a scope has added a new binding for it. Scopes
+        # cache the results of name lookups, and this tells them when a result may be stale.
+        self.bindingVersions = {}
+
+        # Counts of method calls compiled as virtual calls, and of those which were compiled
+        # as direct calls instead, since class hierarchy analysis showed they could only
+        # reach one method.
+        self.virtualCallCount = 0
+        self.devirtualizedCallCount = 0
+
+        # Accessors like getScope and setType are called for nearly every node in every pass,
+        # so they're bound directly to the tables' methods.
+        for elemName, tableName in _tableNames:
+            table = getattr(self, tableName)
+            setattr(self, "get" + elemName, table.get)
+            setattr(self, "set" + elemName, table.set)
+            setattr(self, "has" + elemName, table.has)
+
+
+_tableNames = [("Scope", "scopes"),
+               ("ContextInfo", "contextInfo"),
+               ("ClosureInfo", "closureInfo"),
+               ("DefnInfo", "defnInfo"),
+               ("UseInfo", "useInfo"),
+               ("ClassInfo", "classInfo"),
+               ("Type", "typeInfo"),
+               ("CallInfo", "callInfo")]
+
+
+class SideTable(object):
+    """Maps AST nodes and the definitions created from them to information about them.
+
+    Keys may be AST nodes, AST ids, or IR definitions. Definitions created from AST nodes
+    share an entry with their node. Builtin classes and functions have no AST nodes; they
+    are identified by negative ids instead, and since class and function ids overlap, they
+    are kept in separate spaces. A negative integer key is a builtin class id.
+
+    AST ids are assigned densely by addNodeIds, so values are stored in lists indexed by id
+    rather than in dicts. Builtin ids are dense, too, counting down from -1."""
+
+    def __init__(self):
+        self.astValues = []
+        self.builtinClassValues = []
+        self.builtinFunctionValues = []
+
+    def get(self, key):
+        if isinstance(key, ast.AstNode):
+            values, index = self.astValues, key.id
         else:
-            return k.id
-
-
-_dictNames = [("Scope", "scopes"),
-              ("ContextInfo", "contextInfo"),
-              ("ClosureInfo", "closureInfo"),
-              ("DefnInfo", "defnInfo"),
-              ("UseInfo", "useInfo"),
-              ("ClassInfo", "classInfo"),
-              ("Type", "typeInfo"),
-              ("CallInfo", "callInfo")]
-def _addDictMethods(elemName, dictName):
-    setattr(CompileInfo, "get" + elemName,
-            lambda self, key: self._get(key, getattr(self, dictName)))
-    setattr(CompileInfo, "set" + elemName,
-            lambda self, key, value: self._set(key, value, getattr(self, dictName)))
-    setattr(CompileInfo, "has" + elemName,
-            lambda self, key: self._has(key, getattr(self, dictName)))
-for _elemName, _dictName in _dictNames:
-    _addDictMethods(_elemName, _dictName)
+            values, index = self._locate(key)
+        if index < len(values):
+            value = values[index]
+            if value is not _MISSING:
+                return value
+        raise KeyError(key)
+
+    def set(self, key, value):
+        if isinstance(key, ast.AstNode):
+            values, index = self.astValues, key.id
+        else:
+            values, index = self._locate(key)
+        if index >= len(values):
+            # Grow geometrically, since ids are usually assigned in increasing order.
+            values.extend([_MISSING] * max(index + 1 - len(values), len(values)))
+        values[index] = value
+
+    def has(self, key):
+        if isinstance(key, ast.AstNode):
+            values, index = self.astValues, key.id
+        else:
+            values, index = self._locate(key)
+        return index < len(values) and values[index] is not _MISSING
+
+    def keys(self):
+        """Returns AST ids, then builtin class ids, then builtin function ids with entries."""
+        return [id for id, _ in self.iteritems()]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def itervalues(self):
+        return (value for _, value in self.iteritems())
+
+    def iteritems(self):
+        for id, value in enumerate(self.astValues):
+            if value is not _MISSING:
+                yield id, value
+        for builtinValues in (self.builtinClassValues, self.builtinFunctionValues):
+            for index, value in enumerate(builtinValues):
+                if value is not _MISSING:
+                    yield -index - 1, value
+
+    def _locate(self, key):
+        # Returns the list containing the value for a key and its index in that list. AST
+        # nodes are handled by the callers.
+        if isinstance(key, int):
+            id = key
+        else:
+            astDefn = getattr(key, "astDefn", None)
+            if astDefn is not None:
+                id = astDefn.id
+            else:
+                id = key.id
+                if builtins.isBuiltinId(id) and isinstance(key, ir.Function):
+                    return self.builtinFunctionValues, -id - 1
+        if id >= 0:
+            return self.astValues, id
+        else:
+            return self.builtinClassValues, -id - 1
+
+
+_MISSING = object()
 
 
 class ContextInfo(data.Data):
@@ -128,19 +200,28 @@ class ClosureInfo(data.Data):
         # Variable | None: for functions converted to closures defined inside other functions,
         # a Variable in the parent function containing an instance of the closure class.
         "irClosureVar",
+
+        # {id(Variable) -> (Variable, Field)}: immutable variables from outer functions whose
+        # values are copied into a Field in irClosureClass when the closure is created,
+        # instead of being stored in a context.
+        "irClosureValues",
     ]
 
-    def __init__(self, irClosureClass=None, irClosureContexts=None, irClosureVar=None):
+    def __init__(self, irClosureClass=None, irClosureContexts=None, irClosureVar=None,
+                 irClosureValues=None):
         self.irClosureClass = irClosureClass
         self.irClosureContexts = irClosureContexts if irClosureContexts else {}
         self.irClosureVar = irClosureVar
+        self.irClosureValues = irClosureValues if irClosureValues else {}
 
     def __repr__(self):
         irClosureClassStr = self.irClosureClass.name if self.irClosureClass else "None"
         irClosureContextsStr = ", ".join("%d: %s" % kv
                                          for kv in self.irClosureContexts.iteritems())
-        return "ClosureInfo(%s, {%s}, %s)" % \
-            (irClosureClassStr, irClosureContextsStr, repr(self.irClosureVar))
+        irClosureValuesStr = ", ".join(var.name for var, _ in self.irClosureValues.values())
+        return "ClosureInfo(%s, {%s}, %s, [%s])" % \
+            (irClosureClassStr, irClosureContextsStr, repr(self.irClosureVar),
+             irClosureValuesStr)
 
     def capturedScopeIds(self):
         return sorted(self.irClosureContexts.keys())
@@ -228,6 +309,27 @@ class UseInfo(data.Data):
                defnScope.scopeId != BUILTIN_SCOPE_ID and \
                not useScope.isLocalWithin(defnScope)
 
+    def mayCaptureByValue(self, info):
+        """Returns whether the captured definition may be copied into closures for this use,
+        rather than stored in a context. This is only true for immutable parameters of
+        functions, since closures are created when the block that declares them is entered,
+        and parameters are the only immutable definitions guaranteed to be initialized
+        then. Every scope between the use and the definition must be a function scope.
+
+        This should only be called if `shouldCapture` is true."""
+        irDefn = self.defnInfo.irDefn
+        if not isinstance(irDefn, ir.Variable) or \
+           irDefn.kind is not ir.PARAMETER or \
+           LET not in irDefn.flags:
+            return False
+        defnScope = info.getScope(self.defnInfo.scopeId)
+        scope = info.getScope(self.useScopeId)
+        while scope is not defnScope:
+            if not scope.isLocal() and not isinstance(scope.ast, ast.AstFunctionDefinition):
+                return False
+            scope = scope.parent
+        return isinstance(defnScope.ast, ast.AstFunctionDefinition)
+
 
 class ClassInfo(data.Data):
     """Defined for each class. Keeps track of superclass."""
@@ -331,7 +433,7 @@ class InfoPrinter(ast.AstPrinter):
             self.out.write("%s- %s\n" % (indent, s))
 
 
-__all__ = [ "CompileInfo", "ContextInfo", "ClosureInfo", "DefnInfo",
+__all__ = [ "CompileInfo", "SideTable", "ContextInfo", "ClosureInfo", "DefnInfo",
             "ClassInfo", "UseInfo", "getAllArgumentTypes",
             "GLOBAL_SCOPE_ID", "BUILTIN_SCOPE_ID",
             "USE_AS_VALUE", "USE_AS_TYPE", "USE_AS_PROPERTY", "USE_AS_CONSTRUCTOR",
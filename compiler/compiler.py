@@ -9,7 +9,7 @@ from functools import partial
 import ast
 from bytecode import W8, W16, W32, W64, BUILTIN_TYPE_CLASS_ID, BUILTIN_TYPE_CTOR_ID, instInfoByCode
 from ir import Global, Variable, Field, Function, Class, LOCAL
-from ir_types import UnitType, ClassType, VariableType, NULLABLE_TYPE_FLAG, getExceptionClassType
+from ir_types import UnitType, ClassType, VariableType, NULLABLE_TYPE_FLAG, getExceptionClassType, clearTypeRelationCaches
 import ir_instructions
 from compile_info import CONTEXT_CONSTRUCTOR_HINT, CLOSURE_CONSTRUCTOR_HINT, PACKAGE_INITIALIZER_HINT, DefnInfo
 from flags import ABSTRACT, STATIC, LET
@@ -26,6 +26,8 @@ def compile(info):
     for function in info.package.functions:
         compiler = CompileVisitor(function, info)
         compiler.compile()
+    # Code generation may check type relations again, so drop anything it cached.
+    clearTypeRelationCaches()
 
 
 def assignFieldIndices(clas, info):
@@ -47,6 +49,14 @@ class CompileVisitor(ast.AstNodeVisitor):
         self.setCurrentBlock(self.newBlock())
         assert self.astDefn is not None or self.compileHint is not None
 
+        # Immutable variables from outer functions, copied into this function's closure.
+        # These are loaded from fields of `this` instead of local variables.
+        if self.astDefn is not None and self.info.hasClosureInfo(self.getScopeAstDefn()):
+            closureInfo = self.info.getClosureInfo(self.getScopeAstDefn())
+            self.capturedValues = closureInfo.irClosureValues
+        else:
+            self.capturedValues = {}
+
     def compile(self):
         # Handle special implicit functions.
         if self.compileHint:
@@ -639,7 +649,12 @@ class CompileVisitor(ast.AstNodeVisitor):
     def loadVariable(self, varOrDefnInfo):
         if isinstance(varOrDefnInfo, Variable):
             var = varOrDefnInfo
-            self.ldlocal(var.index)
+            capturedValue = self.capturedValues.get(id(var))
+            if capturedValue is not None:
+                self.loadThis()
+                self.loadField(capturedValue[1])
+            else:
+                self.ldlocal(var.index)
         else:
             assert isinstance(varOrDefnInfo, DefnInfo)
             defnInfo = varOrDefnInfo
@@ -743,13 +758,22 @@ class CompileVisitor(ast.AstNodeVisitor):
                 assert len(closureClass.constructors) == 1
                 closureCtor = closureClass.constructors[0]
                 assert closureClass.typeParameters == closureCtor.typeParameters
-                capturedScopeIds = closureInfo.capturedScopeIds()
-                assert len(closureCtor.parameterTypes) == len(capturedScopeIds) + 1
+                assert len(closureCtor.parameterTypes) == len(closureClass.fields) + 1
                 self.buildImplicitStaticTypeArguments(closureClass.typeParameters)
                 self.allocobj(closureClass.id)
                 self.dup()
-                for id in capturedScopeIds:
-                    self.loadContext(id)
+
+                # The constructor stores each argument in the corresponding field, so
+                # contexts and copied values are passed in field order.
+                contextScopeIds = dict((id(field), scopeId) for scopeId, field
+                                       in closureInfo.irClosureContexts.iteritems())
+                capturedVars = dict((id(field), var) for var, field
+                                    in closureInfo.irClosureValues.itervalues())
+                for field in closureClass.fields:
+                    if id(field) in contextScopeIds:
+                        self.loadContext(contextScopeIds[id(field)])
+                    else:
+                        self.loadVariable(capturedVars[id(field)])
                 self.buildImplicitStaticTypeArguments(closureCtor.typeParameters)
                 self.callg(closureCtor.id)
                 self.drop()
@@ -843,8 +867,14 @@ class CompileVisitor(ast.AstNodeVisitor):
                 # primitive methods which can't be called virtually.
                 self.callg(irDefn.id)
             else:
-                index = irDefn.clas.getMethodIndex(irDefn)
-                self.callv(argCount + 1, index)
+                self.info.virtualCallCount += 1
+                if hasattr(irDefn, "isNotOverridden") and self.isReceiverNonNullable(receiver):
+                    # No derived class overrides this method, so it can be called directly.
+                    self.info.devirtualizedCallCount += 1
+                    self.callg(irDefn.id)
+                else:
+                    index = irDefn.clas.getMethodIndex(irDefn)
+                    self.callv(argCount + 1, index)
 
             if isinstance(receiver, LValue):
                 self.buildAssignment(receiver, mode)
@@ -853,6 +883,19 @@ class CompileVisitor(ast.AstNodeVisitor):
         if shouldDropForEffect:
             self.drop()
 
+    def isReceiverNonNullable(self, receiver):
+        # callv checks that the receiver is not null, but callg does not, so a call is only
+        # devirtualized when the receiver's type is not nullable, like calls to final methods.
+        if receiver is None:
+            # Implicit receivers are `this` or closures, which are never null.
+            return True
+        elif isinstance(receiver, (ast.AstThisExpression, ast.AstSuperExpression)):
+            return True
+        elif isinstance(receiver, LValue):
+            return False
+        else:
+            return not self.info.getType(receiver).isNullable()
+
     def buildAssignment(self, lvalue, mode):
         if mode is COMPILE_FOR_VALUE:
             self.dup()
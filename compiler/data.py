@@ -6,18 +6,103 @@
 
 import utils
 
+
+def _inheritsHandwritten(bases, methodName):
+    # Returns True if the method would be inherited from a Data subclass which defines it
+    # by hand, rather than generated from the base's propertyNames.
+    for base in bases:
+        for cls in base.__mro__:
+            if methodName in cls.__dict__:
+                method = cls.__dict__[methodName]
+                if getattr(method, "generated", False) or not isinstance(cls, DataMeta):
+                    break
+                return True
+    return False
+
+
+def _compile(className, methodName, source, env=None):
+    # Compiles a method from source. The file name shows where the method came from in
+    # tracebacks.
+    namespace = dict(env) if env is not None else {}
+    code = compile(source, "<generated %s.%s>" % (className, methodName), "exec")
+    exec code in namespace
+    return namespace[methodName]
+
+
+def _generateInit(className, propertyNames, comparedNames):
+    lines = ["def __init__(self%s):" % "".join(", " + name for name in propertyNames)]
+    lines += ["    self.%s = %s" % (name, name) for name in propertyNames]
+    if len(propertyNames) == 0:
+        lines.append("    pass")
+    return _compile(className, "__init__", "\n".join(lines))
+
+
+def _generateEq(className, propertyNames, comparedNames):
+    conditions = ["self.__class__ is other.__class__"]
+    conditions += ["self.%s == other.%s" % (name, name) for name in comparedNames]
+    source = "def __eq__(self, other):\n    return %s" % " and \\\n        ".join(conditions)
+    return _compile(className, "__eq__", source)
+
+
+def _generateHash(className, propertyNames, comparedNames):
+    # The result is the same as utils.hashList over the compared properties, so objects
+    # which are equal have the same hash.
+    lines = ["def __hash__(self):",
+             "    h = 0"]
+    lines += ["    h = hashMix(h ^ hash(self.%s))" % name for name in comparedNames]
+    lines.append("    return h")
+    return _compile(className, "__hash__", "\n".join(lines), {"hashMix": utils.hashMix})
+
+
+class DataMeta(type):
+    # Data objects (IR definitions, types, values, tokens, locations) are created and compared
+    # constantly, so instead of looping over propertyNames at run time, each Data class gets
+    # its own __init__, __eq__, and __hash__, generated from propertyNames when the class is
+    # created. Methods written by hand, in the class or in a base class, are kept.
+    #
+    # Classes whose instances are interned may set interned = True. __eq__ and __hash__ are
+    # not generated for them, so they're compared by identity, which is much faster.
+    #
+    # Properties are stored in slots. A class may list other attributes it needs in
+    # __slots__; properties inherited from base classes are not slotted again. Classes
+    # which need arbitrary attributes should include "__dict__".
+    def __new__(meta, name, bases, members):
+        if not any(isinstance(base, DataMeta) for base in bases):
+            # Data itself has no properties; it only provides __repr__ and __ne__.
+            return super(DataMeta, meta).__new__(meta, name, bases, members)
+
+        propertyNames = tuple(members.get("propertyNames",
+                                          getattr(bases[0], "propertyNames", ())))
+        inheritedSlots = set(slot for base in bases for cls in base.__mro__
+                             for slot in cls.__dict__.get("__slots__", ()))
+        members["__slots__"] = tuple(list(members.get("__slots__", ())) +
+                                     [propertyName for propertyName in propertyNames
+                                      if propertyName not in inheritedSlots])
+        skipCompareNames = members.get("skipCompareNames",
+                                       getattr(bases[0], "skipCompareNames", ()))
+        comparedNames = [propertyName for propertyName in propertyNames
+                         if propertyName not in skipCompareNames]
+
+        generators = [("__init__", _generateInit)]
+        if not members.get("interned", getattr(bases[0], "interned", False)):
+            generators += [("__eq__", _generateEq), ("__hash__", _generateHash)]
+        for methodName, generate in generators:
+            if methodName not in members and not _inheritsHandwritten(bases, methodName):
+                method = generate(name, propertyNames, comparedNames)
+                method.generated = True
+                members[methodName] = method
+        return super(DataMeta, meta).__new__(meta, name, bases, members)
+
+
 class Data(object):
+    __metaclass__ = DataMeta
+    __slots__ = ()
+
+    propertyNames = ()
+
     @staticmethod
     def makeClass(name, propertyNames):
-        return type(name, (Data,), {"propertyNames": propertyNames})
-
-    def __init__(self, *args, **extra):
-        assert len(args) + len(extra) == len(self.propertyNames)
-        assert set(self.propertyNames[len(args):]) == set(extra.keys())
-        for key, value in zip(self.propertyNames, args):
-            setattr(self, key, value)
-        for key, value in extra.iteritems():
-            setattr(self, key, value)
+        return DataMeta(name, (Data,), {"propertyNames": propertyNames})
 
     def __repr__(self):
         if len(self.propertyNames) == 0:
@@ -29,17 +114,8 @@ class Data(object):
     def __str__(self):
         return repr(self)
 
-    def __eq__(self, other):
-        return self.__class__ is other.__class__ and \
-               all(getattr(self, name) == getattr(other, name)
-                   for name in self.propertyNames
-                   if not hasattr(self, "skipCompareNames") or
-                      name not in self.skipCompareNames)
-
     def __ne__(self, other):
         return not (self == other)
 
-    def __hash__(self):
-        return utils.hashList(getattr(self, name) for name in self.propertyNames)
 
 __all__ = ["Data"]
@@ -25,6 +25,16 @@ class Package(object):
         self.entryFunction = -1
         self.initFunction = -1
 
+        # Maps each string in `strings` to its first index. Only the first
+        # `indexedStringCount` strings have been indexed.
+        self.stringIndices = {}
+        self.indexedStringCount = 0
+
+        # Indexes of `globals`, `functions`, `classes`, and `typeParameters` by name and by
+        # flag, used by `find`. Each is built the first time a list is searched, then updated
+        # as definitions are added.
+        self.definitionIndices = {}
+
     def __str__(self):
         buf = StringIO.StringIO()
         for g in self.globals:
@@ -42,34 +52,48 @@ class Package(object):
     def addGlobal(self, name, astDefn, *args):
         id = len(self.globals)
         g = Global(name, astDefn, id, *args)
-        self.globals.append(g)
+        self.addDefinition(self.globals, g)
         return g
 
     def addFunction(self, name, astDefn, *args):
         id = len(self.functions)
         f = Function(name, astDefn, id, *args)
-        self.functions.append(f)
+        self.addDefinition(self.functions, f)
         return f
 
     def addClass(self, name, astDefn, *args):
         id = len(self.classes)
         c = Class(name, astDefn, id, *args)
-        self.classes.append(c)
+        self.addDefinition(self.classes, c)
         return c
 
     def addTypeParameter(self, name, astDefn, *args):
         id = len(self.typeParameters)
         p = TypeParameter(name, astDefn, id, *args)
-        self.typeParameters.append(p)
+        self.addDefinition(self.typeParameters, p)
         return p
 
+    def addDefinition(self, defns, defn):
+        index = self.definitionIndices.get(id(defns))
+        if index is not None and index.isValidFor(defns):
+            index.add(defn)
+        defns.append(defn)
+
     def findOrAddString(self, s):
         assert type(s) == unicode
-        for i in xrange(0, len(self.strings)):
-            if self.strings[i] == s:
-                return i
-        self.strings.append(s)
-        return len(self.strings) - 1
+        if self.indexedStringCount != len(self.strings):
+            # Strings were added to the list directly. They may repeat earlier strings, so
+            # they don't replace earlier indices.
+            for i in xrange(self.indexedStringCount, len(self.strings)):
+                self.stringIndices.setdefault(self.strings[i], i)
+            self.indexedStringCount = len(self.strings)
+        index = self.stringIndices.get(s)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(s)
+            self.stringIndices[s] = index
+            self.indexedStringCount += 1
+        return index
 
     def findFunction(self, **kwargs):
         return next(self.find(self.functions, kwargs))
@@ -84,6 +108,7 @@ class Package(object):
         return next(self.find(self.typeParameters, kwargs))
 
     def find(self, defns, kwargs):
+        candidates = self.findCandidates(defns, kwargs)
         def matchItem(defn, key, value):
             if key == "clas":
                 return isinstance(defn, Function) and \
@@ -97,11 +122,66 @@ class Package(object):
                 return getattr(defn, key) == value
         def matchAll(defn):
             return all(matchItem(defn, k, v) for k, v in kwargs.iteritems())
-        return (d for d in defns if matchAll(d))
+        return (d for d in candidates if matchAll(d))
+
+    def findCandidates(self, defns, kwargs):
+        # Returns the definitions in `defns` which may match the given criteria, in order.
+        # Only the package's own lists are indexed; other lists are searched in full.
+        if not any(defns is ownDefns for ownDefns in
+                   (self.globals, self.functions, self.classes, self.typeParameters)):
+            return defns
+        if "name" in kwargs:
+            return self.getDefinitionIndex(defns).byName.get(kwargs["name"], ())
+        if "clas" in kwargs and defns is self.functions:
+            # Classes already list their methods and constructors, but methods become part of
+            # a class after they're added to the package, so this is not indexed separately.
+            clas = kwargs["clas"]
+            if not isinstance(clas, Class):
+                return ()
+            members = (clas.constructors or []) + (clas.methods or [])
+            if clas.initializer is not None:
+                members.append(clas.initializer)
+            ownMembers = dict((id(m), m) for m in members
+                              if 0 <= m.id < len(defns) and defns[m.id] is m)
+            return sorted(ownMembers.itervalues(), key=lambda m: m.id)
+        if "flag" in kwargs:
+            return self.getDefinitionIndex(defns).byFlag.get(kwargs["flag"], ())
+        return defns
+
+    def getDefinitionIndex(self, defns):
+        index = self.definitionIndices.get(id(defns))
+        if index is None or not index.isValidFor(defns):
+            index = DefinitionIndex(defns)
+            self.definitionIndices[id(defns)] = index
+        return index
+
+
+class DefinitionIndex(object):
+    """Maps names and flags to the definitions in a list with those names and flags, in
+    order."""
+
+    def __init__(self, defns):
+        self.defns = defns
+        self.count = 0
+        self.byName = {}
+        self.byFlag = {}
+        for defn in defns:
+            self.add(defn)
+
+    def add(self, defn):
+        self.count += 1
+        self.byName.setdefault(defn.name, []).append(defn)
+        for flag in defn.flags:
+            self.byFlag.setdefault(flag, []).append(defn)
+
+    def isValidFor(self, defns):
+        return self.defns is defns and self.count == len(defns)
 
 
 class IrDefinition(data.Data):
     propertyNames = ("name", "astDefn")
+    # Passes attach extra information to definitions (e.g., overrides, builtin instructions).
+    __slots__ = ["__dict__"]
     skipCompareNames = ("astDefn",)
 
     def isTypeDefn(self):
@@ -232,11 +312,43 @@ class Class(IrTopDefn):
     def superclasses(self):
         """Returns a generator of superclasses in depth-first order, including this class."""
         assert self.id is not bytecode.BUILTIN_NOTHING_CLASS_ID
-        yield self
+        return reversed(self.getHierarchy()[0])
+
+    def getHierarchy(self):
+        """Returns a pair of tuples describing the ancestry of this class. The first contains
+        the superclasses of this class, starting with the root class and ending with this
+        class, so each class's depth is its index. The second contains the supertypes which
+        link them: the supertype at index i refers to the class at index i and is the
+        supertype of the class at index i + 1.
+
+        These are computed from the superclass's tuples and cached until the class hierarchy
+        is invalidated, so subclass tests only need a comparison, and paths to base classes
+        are slices."""
+        hierarchy = self.__dict__.get("hierarchy_")
+        if hierarchy is not None and hierarchy[0] == _hierarchyVersion:
+            return hierarchy[1:]
+
+        # Find the nearest ancestor with a valid hierarchy, then build hierarchies down to
+        # this class. This is done iteratively, since hierarchies may be deep.
+        pending = []
         clas = self
-        while len(clas.supertypes) > 0:
+        while True:
+            hierarchy = clas.__dict__.get("hierarchy_")
+            if hierarchy is not None and hierarchy[0] == _hierarchyVersion:
+                _, classes, supertypes = hierarchy
+                break
+            pending.append(clas)
+            if len(clas.supertypes) == 0:
+                classes, supertypes = (), ()
+                break
             clas = clas.supertypes[0].clas
-            yield clas
+        while len(pending) > 0:
+            clas = pending.pop()
+            if len(classes) > 0:
+                supertypes += (clas.supertypes[0],)
+            classes += (clas,)
+            clas.hierarchy_ = (_hierarchyVersion, classes, supertypes)
+        return classes, supertypes
 
     def findTypePathToBaseClass(self, base):
         """Returns a list of supertypes (ClassTypes), which represent a path through the class
@@ -245,28 +357,45 @@ class Class(IrTopDefn):
         base, returns None. This class must not but Nothing, since there is no well-defined
         class in that case."""
         assert self is not builtins.getNothingClass()
-        path = []
-        indexStack = [0]
-        assert self.id is not None
-        visited = set([self.id])
-
-        while len(indexStack) > 0:
-            index = indexStack[-1]
-            indexStack[-1] += 1
-            clas = path[-1].clas if len(path) > 0 else self
-            if clas is base:
-                return path
-            elif index == len(clas.supertypes):
-                if len(path) > 0:
-                    path.pop()
-                indexStack.pop()
-            elif clas.supertypes[index].clas.id not in visited:
-                supertype = clas.supertypes[index]
-                assert supertype.clas.id is not None
-                visited.add(supertype.clas.id)
-                path.append(supertype)
-                indexStack.append(0)
-        return None
+        classes, supertypes = self.getHierarchy()
+        baseDepth = len(base.getHierarchy()[0]) - 1
+        depth = len(classes) - 1
+        if baseDepth > depth or classes[baseDepth] is not base:
+            return None
+        return list(reversed(supertypes[baseDepth:]))
+
+    def getBaseClassTypeArguments(self, base):
+        """Returns a tuple of type arguments for the given base class, expressed in terms of
+        this class's type parameters. For example, if we have class A[T] and
+        class B[U] <: A[C[U]], B.getBaseClassTypeArguments(A) returns (C[U],). This is the
+        substitution along the whole path to the base class, composed. Returns None if the
+        given class is not a base.
+
+        Results are cached until the class hierarchy is invalidated, so types can be
+        substituted for inheritance in one step instead of one step per class on the path."""
+        cache = self.__dict__.get("baseClassTypeArguments_")
+        if cache is None or cache[0] != _hierarchyVersion:
+            cache = (_hierarchyVersion, {})
+            self.baseClassTypeArguments_ = cache
+
+        # Entries are keyed by identity, since classes are mutable. Entries hold a reference
+        # to the base, so its id won't be reused while the entry exists.
+        entry = cache[1].get(id(base))
+        if entry is not None:
+            return entry[1]
+
+        path = self.findTypePathToBaseClass(base)
+        if path is None:
+            typeArgs = None
+        else:
+            typeParams = self.typeParameters
+            typeArgs = tuple(ir_types.VariableType(param) for param in typeParams)
+            for sty in path:
+                typeArgs = tuple(arg.substitute(typeParams, typeArgs)
+                                 for arg in sty.typeArguments)
+                typeParams = sty.clas.typeParameters
+        cache[1][id(base)] = (base, typeArgs)
+        return typeArgs
 
     def findClassPathToBaseClass(self, base):
         path = self.findTypePathToBaseClass(base)
@@ -276,7 +405,8 @@ class Class(IrTopDefn):
             return [sty.clas for sty in path]
 
     def findDistanceToBaseClass(self, base):
-        return len(self.findClassPathToBaseClass(base))
+        assert self.isSubclassOf(base)
+        return len(self.getHierarchy()[0]) - len(base.getHierarchy()[0])
 
     def isSubclassOf(self, other):
         nothingClassId = -2   # avoid circular import dependency with builtins
@@ -285,7 +415,9 @@ class Class(IrTopDefn):
         elif other.id == nothingClassId:
             return False
         else:
-            return other in self.superclasses()
+            classes = self.getHierarchy()[0]
+            otherDepth = len(other.getHierarchy()[0]) - 1
+            return otherDepth < len(classes) and classes[otherDepth] is other
 
     def findCommonBaseClass(self, other):
         """Returns a class which (a) is a superclass of both classes, and (b) has no subclasses
@@ -297,17 +429,22 @@ class Class(IrTopDefn):
         if other is builtins.getNothingClass():
             return self
 
-        selfBases = list(self.superclasses())
-        otherBases = list(other.superclasses())
-        if selfBases[-1] is not otherBases[-1]:
+        selfBases = self.getHierarchy()[0]
+        otherBases = other.getHierarchy()[0]
+        if selfBases[0] is not otherBases[0]:
             return None
 
-        selfLast = -len(selfBases) - 1
-        otherLast = -len(otherBases) - 1
-        i = -1
-        while i > selfLast and i > otherLast and selfBases[i] is otherBases[i]:
-            i -= 1
-        return selfBases[i + 1]
+        # Both classes share a prefix of their superclass tuples, so binary search for the
+        # end of the shared prefix.
+        low = 0
+        high = min(len(selfBases), len(otherBases))
+        while high - low > 1:
+            middle = (low + high) // 2
+            if selfBases[middle] is otherBases[middle]:
+                low = middle
+            else:
+                high = middle
+        return selfBases[low]
 
     def getConstructor(self, argTypes):
         # TODO: support constructor overloading
@@ -320,9 +457,8 @@ class Class(IrTopDefn):
     def getMethod(self, name, typeArgs=None, argTypes=None):
         assert (typeArgs is None) == (argTypes is None)
         candidate = None
-        for m in self.methods:
-            if m.name == name and \
-               (argTypes is None or m.canCallWith(type[ClassType(self)] + argTypes)):
+        for m in self.getMemberIndex().methodsByName.get(name, ()):
+            if argTypes is None or m.canCallWith(type[ClassType(self)] + argTypes):
                 assert candidate is None
                 candidate = m
         return candidate
@@ -336,31 +472,42 @@ class Class(IrTopDefn):
         return methodDict
 
     def getField(self, name):
-        for f in self.fields:
-            if f.name == name:
-                return f
-        return None
+        fields = self.getMemberIndex().fieldsByName.get(name)
+        return fields[0] if fields is not None else None
 
     def getMember(self, name):
-        for m in self.methods:
-            if m.name == name:
-                return m
-        for f in self.fields:
-            if f.name == name:
-                return f
-        return None
+        index = self.getMemberIndex()
+        members = index.methodsByName.get(name) or index.fieldsByName.get(name)
+        return members[0] if members is not None else None
 
     def getMethodIndex(self, method):
-        for i, m in enumerate(self.methods):
-            if m is method:
-                return i
-        raise KeyError("method does not belong to this class")
+        index = self.getMemberIndex().methodIndices.get(id(method))
+        if index is None:
+            raise KeyError("method does not belong to this class")
+        return index
 
     def getFieldIndex(self, field):
-        for i, f in enumerate(self.fields):
-            if f is field:
-                return i
-        raise KeyError("field does not belong to this class")
+        index = self.getMemberIndex().fieldIndices.get(id(field))
+        if index is None:
+            raise KeyError("field does not belong to this class")
+        return index
+
+    def getMemberIndex(self):
+        """Returns a MemberIndex for this class's methods and fields.
+
+        The index is built by flattenClasses once inherited members have been copied in, so
+        vtable slots and field indices can be found without scanning. If the member lists
+        have been replaced or have changed length since the index was built (for example,
+        before flattening), a new index is built. Code which replaces members in place must
+        call buildMemberIndex itself."""
+        index = self.__dict__.get("memberIndex_")
+        if index is None or not index.isValidFor(self):
+            index = self.buildMemberIndex()
+        return index
+
+    def buildMemberIndex(self):
+        self.memberIndex_ = MemberIndex(self.methods, self.fields)
+        return self.memberIndex_
 
     def isTypeDefn(self):
         return True
@@ -386,11 +533,50 @@ class Class(IrTopDefn):
         return buf.getvalue()
 
 
+class MemberIndex(object):
+    """Maps a class's methods and fields to their vtable slots and field indices, and maps
+    names to the members with those names, in order."""
+
+    def __init__(self, methods, fields):
+        self.methods = methods
+        self.methodCount = len(methods)
+        self.fields = fields
+        self.fieldCount = len(fields)
+        self.methodIndices = {}
+        self.methodsByName = {}
+        for i, method in enumerate(methods):
+            self.methodIndices.setdefault(id(method), i)
+            self.methodsByName.setdefault(method.name, []).append(method)
+        self.fieldIndices = {}
+        self.fieldsByName = {}
+        for i, field in enumerate(fields):
+            self.fieldIndices.setdefault(id(field), i)
+            self.fieldsByName.setdefault(field.name, []).append(field)
+
+    def isValidFor(self, clas):
+        return self.methods is clas.methods and \
+               self.methodCount == len(clas.methods) and \
+               self.fields is clas.fields and \
+               self.fieldCount == len(clas.fields)
+
+
+def invalidateClassHierarchy():
+    """Discards hierarchies cached by Class.getHierarchy. This must be called whenever the
+    supertypes of a class change."""
+    global _hierarchyVersion
+    _hierarchyVersion += 1
+
+_hierarchyVersion = 0
+
+
 class TypeParameter(IrTopDefn):
     propertyNames = IrTopDefn.propertyNames + ("upperBound", "lowerBound", "flags")
 
     def __init__(self, name, astDefn, id, upperBound, lowerBound, flags):
-        super(TypeParameter, self).__init__(name, astDefn, id, upperBound, lowerBound, flags)
+        super(TypeParameter, self).__init__(name, astDefn, id)
+        self.upperBound = upperBound
+        self.lowerBound = lowerBound
+        self.flags = flags
         self.clas = None
 
     def isEquivalent(self, other):
@@ -466,4 +652,4 @@ class Field(IrDefinition):
     propertyNames = IrDefinition.propertyNames + ("type", "flags")
 
 __all__ = ["Package", "Global", "Function", "Class", "TypeParameter",
-           "Variable", "Field", "LOCAL", "PARAMETER"]
+           "Variable", "Field", "invalidateClassHierarchy", "LOCAL", "PARAMETER"]
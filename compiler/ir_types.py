@@ -4,8 +4,6 @@
 # the GPL license that can be found in the LICENSE.txt file.
 
 
-import copy
-
 import builtins
 import bytecode
 import data
@@ -13,37 +11,63 @@ import errors
 import flags
 import ir_values
 import utils
+import weakref
+
+# Type flags are stored in a bitmask.
+NULLABLE_TYPE_FLAG = 1 << 0
+
+_FLAG_NAMES = [(NULLABLE_TYPE_FLAG, "nullable")]
+
+# Interned types, keyed by the identities of their components (type arguments are interned
+# too). Types are held weakly, so types (and through them, classes and ASTs) from packages
+# which are no longer used can be collected. Keys only contain ids, since a key holding a
+# type argument could keep its own entry alive. A type holds its components, so ids in its
+# key can't be reused while it's alive.
+_classTypes = weakref.WeakValueDictionary()
+_variableTypes = weakref.WeakValueDictionary()
+
+# Results of isSubtypeOf, lub, and glb for pairs of types. Recursive calls on type arguments
+# aren't cached, since their results may depend on the recursion stack.
+_TYPE_RELATION_CACHE_SIZE = 10000
+_subtypeCache = utils.LruCache(_TYPE_RELATION_CACHE_SIZE)
+_lubCache = utils.LruCache(_TYPE_RELATION_CACHE_SIZE)
+_glbCache = utils.LruCache(_TYPE_RELATION_CACHE_SIZE)
 
-NULLABLE_TYPE_FLAG = "nullable"
 
 class Type(data.Data):
+    # Types are interned: ClassType and VariableType return an existing instance when an
+    # equal type has already been created, and there is only one instance of each
+    # SimpleType. So types are compared by identity, and they must not be modified.
     propertyNames = ("flags",)
+    interned = True
+    __slots__ = ["__weakref__"]
 
     def __init__(self, flags=None):
         if flags is None:
-            flags = frozenset()
-        if isinstance(flags, str):
-            flags = frozenset([flags])
-        assert isinstance(flags, frozenset)
+            flags = 0
+        assert isinstance(flags, int)
         self.flags = flags
 
+    def __ne__(self, other):
+        return self is not other
+
     def withFlag(self, flag):
-        ty = copy.copy(self)
-        ty.flags |= frozenset((flag,))
-        return ty
+        return self.withFlags(self.flags | flag)
 
     def withoutFlag(self, flag):
-        ty = copy.copy(self)
-        ty.flags -= frozenset((flag,))
-        return ty
+        return self.withFlags(self.flags & ~flag)
 
     def withFlags(self, flags):
-        ty = copy.copy(self)
-        ty.flags = flags
-        return ty
+        assert flags == self.flags
+        return self
 
     def isSubtypeOf(self, other):
-        return self.lub(other) == other
+        key = (self, other)
+        result = _subtypeCache.get(key)
+        if result is None:
+            result = self._isSubtypeRec(other, [])
+            _subtypeCache.put(key, result)
+        return result
 
     def isPrimitive(self):
         raise NotImplementedError
@@ -61,7 +85,12 @@ class Type(data.Data):
         """Computes the least upper bound of two types on the type lattice. Note that since
         AnyType is not a valid type, this function returns AnyType to indicate that the
         two types couldn't be combined."""
-        return self._lubRec(other, [])
+        key = (self, other)
+        result = _lubCache.get(key)
+        if result is None:
+            result = self._lubRec(other, [])
+            _lubCache.put(key, result)
+        return result
 
     def _lubRec(self, other, stack):
         # We need to be able to detect infinite recursion in order to ensure termination.
@@ -93,10 +122,7 @@ class Type(data.Data):
         # Rules below apply only to object types.
         if self.isObject() and other.isObject():
             # If either side is nullable, the result is nullable.
-            if self.isNullable() or other.isNullable():
-                combinedFlags = frozenset([NULLABLE_TYPE_FLAG])
-            else:
-                combinedFlags = frozenset()
+            combinedFlags = (self.flags | other.flags) & NULLABLE_TYPE_FLAG
 
             # If both types are variables with a common variable bound, return that.
             if isinstance(self, VariableType) and isinstance(other, VariableType):
@@ -165,11 +191,77 @@ class Type(data.Data):
 
         return AnyType
 
+    def _isSubtypeRec(self, other, stack):
+        # Returns the same result as self._lubRec(other, stack) is other, without building
+        # the least upper bound. Each case corresponds to a case in _lubRec.
+        if (self, other) in stack:
+            if self.isObject() and other.isObject():
+                return other is getRootClassType()
+            else:
+                return other is AnyType
+
+        if self is other:
+            return True
+        if self is AnyType or other is AnyType:
+            return False
+        if self is NoType:
+            return True
+        if other is NoType:
+            return False
+        if not (self.isObject() and other.isObject()):
+            return False
+
+        combinedFlags = (self.flags | other.flags) & NULLABLE_TYPE_FLAG
+        if isinstance(self, VariableType) and isinstance(other, VariableType):
+            sharedBound = self.typeParameter.findCommonUpperBound(other.typeParameter)
+            if sharedBound is not None:
+                return sharedBound is other.typeParameter and combinedFlags == other.flags
+        if isinstance(self, ClassType) and self.clas is builtins.getNothingClass():
+            return combinedFlags == other.flags
+        if isinstance(other, ClassType) and other.clas is builtins.getNothingClass():
+            return False
+
+        # The least upper bound will be a class type, and it will be other only if other's
+        # class is the first common base class whose type arguments can be combined.
+        if not isinstance(other, ClassType) or combinedFlags != other.flags:
+            return False
+        left = self
+        while isinstance(left, VariableType):
+            left = left.typeParameter.upperBound
+        baseClass = left.clas.findCommonBaseClass(other.clas)
+        if baseClass is not other.clas:
+            return False
+        left = left.substituteForBaseClass(baseClass)
+        for param, leftArg, rightArg in zip(baseClass.typeParameters,
+                                            left.typeArguments, other.typeArguments):
+            if rightArg is AnyType:
+                return False
+            variance = param.variance()
+            if variance is INVARIANT:
+                if leftArg is not rightArg:
+                    return False
+            else:
+                stack.append((self, other))
+                if variance is flags.COVARIANT:
+                    isSubtype = leftArg._isSubtypeRec(rightArg, stack)
+                else:
+                    assert variance is flags.CONTRAVARIANT
+                    isSubtype = leftArg._glbRec(rightArg, stack) is rightArg
+                stack.pop()
+                if not isSubtype:
+                    return False
+        return True
+
     def glb(self, ty):
         """Computes the greatest lower bound of two types on the type lattice. Note that since
         this is not a true lattice with a bottom, there may be no shared lower bound (e.g.,
         for i64 and String). This function returns None in that case."""
-        return self._glbRec(ty, [])
+        key = (self, ty)
+        result = _glbCache.get(key)
+        if result is None:
+            result = self._glbRec(ty, [])
+            _glbCache.put(key, result)
+        return result
 
     def _glbRec(self, ty, stack):
         if (self, ty) in stack:
@@ -191,10 +283,7 @@ class Type(data.Data):
         elif self.isObject() and ty.isObject():
             # Ok, this is kind of a cop-out. Don't judge me.
             # TODO: once there are intersection types, use them instead.
-            if self.isNullable() and ty.isNullable():
-                flags = frozenset([NULLABLE_TYPE_FLAG])
-            else:
-                flags = frozenset()
+            flags = self.flags & ty.flags & NULLABLE_TYPE_FLAG
             return ClassType(builtins.getNothingClass(), (), flags)
         else:
             return NoType
@@ -204,11 +293,9 @@ class Type(data.Data):
 
     def substituteForInheritance(self, clas, base):
         assert clas.isSubclassOf(base)
-        supertypePath = clas.findTypePathToBaseClass(base)
-        ty = self
-        for sty in reversed(supertypePath):
-            ty = ty.substitute(sty.clas.typeParameters, sty.typeArguments)
-        return ty
+        if clas is base:
+            return self
+        return self.substitute(base.typeParameters, clas.getBaseClassTypeArguments(base))
 
     def getTypeArguments(self):
         raise NotImplementedError
@@ -223,14 +310,15 @@ class Type(data.Data):
         return None
 
     def isNullable(self):
-        return NULLABLE_TYPE_FLAG in self.flags
+        return (self.flags & NULLABLE_TYPE_FLAG) != 0
 
 
 class SimpleType(Type):
     propertyNames = Type.propertyNames + ("name", "width")
+    __slots__ = ["defaultValue_"]
 
     def __init__(self, name, width, defaultValue=None):
-        super(SimpleType, self).__init__(frozenset())
+        super(SimpleType, self).__init__(0)
         self.name = name
         self.width = width
         self.defaultValue_ = defaultValue
@@ -261,7 +349,7 @@ class SimpleType(Type):
         return ()
 
     def isNullable(self):
-        assert NULLABLE_TYPE_FLAG not in self.flags
+        assert self.flags == 0
         return False
 
 
@@ -310,10 +398,23 @@ class ClassType(ObjectType):
     propertyNames = Type.propertyNames + ("clas", "typeArguments")
     width = bytecode.WORD
 
+    def __new__(cls, clas, typeArguments=(), flags=None):
+        if flags is None:
+            flags = 0
+        typeArguments = tuple(typeArguments)
+        key = (id(clas), tuple(id(arg) for arg in typeArguments), flags)
+        ty = _classTypes.get(key)
+        if ty is None:
+            ty = super(ClassType, cls).__new__(cls)
+            super(ClassType, ty).__init__(flags)
+            ty.clas = clas
+            ty.typeArguments = typeArguments
+            _classTypes[key] = ty
+        return ty
+
     def __init__(self, clas, typeArguments=(), flags=None):
-        super(ClassType, self).__init__(flags)
-        self.clas = clas
-        self.typeArguments = typeArguments
+        # Interned types are initialized by __new__.
+        pass
 
     @staticmethod
     def forReceiver(clas):
@@ -333,18 +434,12 @@ class ClassType(ObjectType):
         typeArgsStr = (", (" + ", ".join(map(repr, self.typeArguments)) + ")") \
                       if len(self.typeArguments) > 0 \
                       else ""
-        flagsStr = (", " + ", ".join(self.flags)) if len(self.flags) > 0 else ""
+        flagNames = getFlagNames(self.flags)
+        flagsStr = (", " + ", ".join(flagNames)) if len(flagNames) > 0 else ""
         return "ClassType(%s%s%s)" % (self.clas.name, typeArgsStr, flagsStr)
 
-    def __hash__(self):
-        return utils.hashList([getattr(self, name) for name in Type.propertyNames] + \
-                        [self.clas.name, self.typeArguments])
-
-    def __eq__(self, other):
-        return self.__class__ is other.__class__ and \
-               self.flags == other.flags and \
-               self.clas is other.clas and \
-               self.typeArguments == other.typeArguments
+    def withFlags(self, flags):
+        return ClassType(self.clas, self.typeArguments, flags)
 
     def substitute(self, parameters, replacements):
         return ClassType(self.clas,
@@ -355,11 +450,15 @@ class ClassType(ObjectType):
     def substituteForBaseClass(self, base):
         assert base is not builtins.getNothingClass()
         assert self.clas is not builtins.getNothingClass()
-        supertypePath = self.clas.findTypePathToBaseClass(base)
-        ty = self
-        for sty in supertypePath:
-            ty = sty.substitute(ty.clas.typeParameters, ty.typeArguments)
-        return ty
+        if self.clas is base:
+            return self
+        typeArgs = self.clas.getBaseClassTypeArguments(base)
+        assert typeArgs is not None
+        typeParams = self.clas.typeParameters
+        if len(typeParams) > 0:
+            typeArgs = tuple(arg.substitute(typeParams, self.typeArguments)
+                             for arg in typeArgs)
+        return ClassType(base, typeArgs)
 
     def getTypeArguments(self):
         return self.typeArguments
@@ -369,9 +468,21 @@ class VariableType(ObjectType):
     propertyNames = Type.propertyNames + ("typeParameter",)
     width = bytecode.WORD
 
-    def __init__(self, typeParameter, flags=frozenset()):
-        super(VariableType, self).__init__(flags)
-        self.typeParameter = typeParameter
+    def __new__(cls, typeParameter, flags=None):
+        if flags is None:
+            flags = 0
+        key = (id(typeParameter), flags)
+        ty = _variableTypes.get(key)
+        if ty is None:
+            ty = super(VariableType, cls).__new__(cls)
+            super(VariableType, ty).__init__(flags)
+            ty.typeParameter = typeParameter
+            _variableTypes[key] = ty
+        return ty
+
+    def __init__(self, typeParameter, flags=None):
+        # Interned types are initialized by __new__.
+        pass
 
     def __str__(self):
         return self.typeParameter.name
@@ -379,12 +490,8 @@ class VariableType(ObjectType):
     def __repr__(self):
         return "VariableType(%s)" % self.typeParameter.name
 
-    def __hash__(self):
-        return utils.hashList([self.typeParameter.name])
-
-    def __eq__(self, other):
-        return self.__class__ is other.__class__ and \
-               self.typeParameter is other.typeParameter
+    def withFlags(self, flags):
+        return VariableType(self.typeParameter, flags)
 
     def substitute(self, parameters, replacements):
         assert len(parameters) == len(replacements)
@@ -403,6 +510,27 @@ class VariableType(ObjectType):
         return self.typeParameter.upperBound.substituteForBaseClass(base)
 
 
+def clearTypeRelationCaches():
+    """Clears cached results of isSubtypeOf, lub, and glb. This must be called whenever the
+    supertypes of a class or the bounds of a type parameter change, and when a compilation
+    finishes, since the caches keep the types they contain alive."""
+    _subtypeCache.clear()
+    _lubCache.clear()
+    _glbCache.clear()
+
+
+def getTypeRelationCacheStats():
+    """Returns a list of (name, hits, misses, hit rate) tuples for the type relation caches."""
+    return [(name, cache.hits, cache.misses, cache.hitRate())
+            for name, cache in (("isSubtypeOf", _subtypeCache),
+                                ("lub", _lubCache),
+                                ("glb", _glbCache))]
+
+
+def getFlagNames(flags):
+    return [name for flag, name in _FLAG_NAMES if flags & flag]
+
+
 def getClassFromType(ty):
     if isinstance(ty, ClassType):
         return ty.clas
@@ -426,7 +554,7 @@ def getExceptionClassType():
 
 
 def getNullType():
-    return ClassType(builtins.getNothingClass(), (), frozenset([NULLABLE_TYPE_FLAG]))
+    return ClassType(builtins.getNothingClass(), (), NULLABLE_TYPE_FLAG)
 
 
 def getStringType():
@@ -462,5 +590,6 @@ __all__ = ["BIVARIANT","INVARIANT", "UnitType", "BooleanType", "I8Type",
            "I16Type", "I32Type", "I64Type", "F32Type", "F64Type",
            "VariableType", "ClassType",  "NoType",
            "getRootClassType", "getStringType", "getNullType",
-           "getClassFromType", "NULLABLE_TYPE_FLAG", "changeVariance",
+           "getClassFromType", "NULLABLE_TYPE_FLAG", "getFlagNames", "changeVariance",
+           "clearTypeRelationCaches", "getTypeRelationCacheStats",
            "getNothingClassType"]
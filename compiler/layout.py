@@ -27,90 +27,130 @@
 # block on top of the stack, the stack is popped and a closing brace (}) is inserted. Unless
 # the next token is the keyword "else" or "catch", a semicolon is also inserted.
 
+import bisect
 import re
+from array import array
 
-from tok import Token, SYMBOL, OPERATOR, NEWLINE, SPACE, COMMENT, INTERNAL
+from errors import LayoutException
+from tok import Token, TokenTable, SYMBOL, OPERATOR, NEWLINE, SPACE, COMMENT, INTERNAL
 
 def layout(tokensIn, skipAnalysis=False):
-    if skipAnalysis:
-        tokensOut = filter(lambda t: t.isPrintable(), tokensIn)
-        return tokensOut
-
-    tokensOut = []
-    indentStack = [IndentLevel(0, 0)]
-    patterns = PatternManager([
-      ["var", ANY_PATTERN, "="],
-      ["def", ANY_PATTERN, "="],
-      ["class", ANY_PATTERN],
-      ["if", "(", ANY_PATTERN, ")"],
-      ["else"],
-      ["else", "if", "(", ANY_PATTERN, ")"],
-      ["while", "(", ANY_PATTERN, ")"],
-      ["match", "(", ANY_PATTERN, ")"],
-      ["case", ANY_PATTERN, "=>"],
-      ["try"],
-      ["catch"],
-      ["catch", "(", ANY_PATTERN, ")"],
-      ["finally"],
-      ["lambda", "(", ANY_PATTERN, ")"]
-    ])
+    if isinstance(tokensIn, TokenTable):
+        fileName, source = tokensIn.fileName, tokensIn.source
+    else:
+        fileName, source = None, None
+    return TokenTable.fromTokens(iterLayout(tokensIn, skipAnalysis), fileName, source)
+
 
+# Like layout, but consumes tokens from any iterable (for example, the lexer's iterLex)
+# and yields tokens as soon as they are decided. Only the most recently emitted token is
+# remembered, so memory use doesn't grow with the length of the file.
+def iterLayout(tokensIn, skipAnalysis=False):
+    if skipAnalysis:
+        return (t for t in tokensIn if t.isPrintable())
+    else:
+        return __iterLayoutAnalysis(tokensIn)
+
+
+def __iterLayoutAnalysis(tokensIn):
+    analysis = LayoutAnalysis()
+    for token in tokensIn:
+        analysis.next(token)
+        for outToken in analysis.output.flush():
+            yield outToken
+    analysis.finish()
+    for outToken in analysis.output.flush():
+        yield outToken
+
+
+class LayoutAnalysis(object):
+    # Layout analysis as a state machine which is fed one token at a time. Output tokens
+    # are collected in self.output. The state at the start of a line can be saved with
+    # snapshot and restored later, which lets IncrementalLayout restart analysis in the
+    # middle of a file.
     BEGIN = "begin"
     PRENORMAL = "pre-normal"
     NORMAL = "normal"
-    state = BEGIN
-    indent = None
 
-    def dedent(indent, text, loc):
-        while indent < indentStack[-1]:
-            indentStack.pop()
-            patterns.pop()
-            if tokensOut[-1].text != ";":
-                tokensOut.append(Token(";", INTERNAL, loc))
-            if indent < indentStack[-1] or text != "}":
-                tokensOut.append(Token("}", INTERNAL, loc))
+    def __init__(self):
+        self.output = LayoutOutput()
+        self.indentStack = [IndentLevel(0, 0)]
+        self.patterns = PatternManager(LAYOUT_AUTOMATON)
+        self.state = LayoutAnalysis.BEGIN
+        self.indent = None
+
+    def isLineStart(self, token):
+        # Returns True if token is the first printable token on a line. Snapshots are only
+        # taken before these tokens.
+        return self.state is not LayoutAnalysis.NORMAL and token.isPrintable()
+
+    def snapshot(self):
+        # Returns a hashable summary of the analysis state. Everything that affects how the
+        # rest of the file is analyzed is included, except the last output token itself,
+        # which must be passed back to restore.
+        assert self.state is not LayoutAnalysis.NORMAL
+        indent = self.indent if self.state is LayoutAnalysis.PRENORMAL else IndentLevel(0, 0)
+        lastText = self.output.last().text if len(self.output) > 0 else None
+        return ((indent.tabs, indent.spaces),
+                tuple((level.tabs, level.spaces) for level in self.indentStack),
+                self.patterns.snapshot(),
+                lastText,
+                min(len(self.output), 2))
+
+    def restore(self, snapshot, lastToken, count):
+        indent, indentStack, patterns, lastText, _ = snapshot
+        assert lastText == (lastToken.text if lastToken is not None else None)
+        self.output = LayoutOutput(lastToken, count)
+        self.indentStack = [IndentLevel(*level) for level in indentStack]
+        self.patterns.restore(patterns)
+        self.state = LayoutAnalysis.PRENORMAL
+        self.indent = IndentLevel(*indent)
 
-    for pos in range(0, len(tokensIn)):
-        token = tokensIn[pos]
-        if state is BEGIN:
+    def next(self, token):
+        tokensOut = self.output
+        indentStack = self.indentStack
+        patterns = self.patterns
+
+        if self.state is LayoutAnalysis.BEGIN:
             if token.tag is SPACE:
                 m = re.match("^(\t*)( *)$", token.text)
                 if m:
-                    indent = IndentLevel(len(m.group(1)), len(m.group(2)))
-                    state = PRENORMAL
-                    continue
+                    self.indent = IndentLevel(len(m.group(1)), len(m.group(2)))
+                    self.state = LayoutAnalysis.PRENORMAL
+                    return
                 else:
                     raise LayoutException(token.location, "mixed tabs and spaces used for indentation")
             elif token.tag in [NEWLINE, COMMENT]:
-                continue   # Blank line
+                return   # Blank line
             elif token.isPrintable():
-                indent = IndentLevel(0, 0)
-                state = PRENORMAL
+                self.indent = IndentLevel(0, 0)
+                self.state = LayoutAnalysis.PRENORMAL
                 # fall through
 
-        if state is PRENORMAL:
+        if self.state is LayoutAnalysis.PRENORMAL:
             assert token.tag is not SPACE
+            indent = self.indent
             if token.tag is COMMENT:
-                continue   # next should be newline
+                return   # next should be newline
             elif token.tag is NEWLINE:
-                state = BEGIN   # turned out to be a blank line
-                continue
+                self.state = LayoutAnalysis.BEGIN   # turned out to be a blank line
+                return
             else:
                 assert token.isPrintable()
                 if indent < indentStack[-1]:
-                    dedent(indent, token.text, token.location)
-                    if tokensOut[-1].text != ";" and token.text not in ["else", "catch", "finally"]:
+                    self.dedent(indent, token.text, token.location)
+                    if tokensOut.last().text != ";" and token.text not in ["else", "catch", "finally"]:
                         tokensOut.append(Token(";", INTERNAL, token.location))
                 elif indent == indentStack[-1]:
                     if len(tokensOut) > 1 and \
-                       tokensOut[-1].text != ";" and \
+                       tokensOut.last().text != ";" and \
                        (token.text != "{" or not patterns.match()):
                         tokensOut.append(Token(";", INTERNAL, token.location))
                         patterns.reset()
                 else:
                     assert indent > indentStack[-1]
-                    if patterns.match() or (len(tokensOut) > 0 and tokensOut[-1].text == "{"):
-                        if tokensOut[-1].text != "{":
+                    if patterns.match() or (len(tokensOut) > 0 and tokensOut.last().text == "{"):
+                        if tokensOut.last().text != "{":
                             tokensOut.append(Token("{", INTERNAL, token.location))
                             patterns.reset()
                         patterns.push()
@@ -119,12 +159,12 @@ def layout(tokensIn, skipAnalysis=False):
                         # this is a continuation of a previous line
                         pass
 
-                state = NORMAL
+                self.state = LayoutAnalysis.NORMAL
                 # fall through
 
-        if state is NORMAL:
+        if self.state is LayoutAnalysis.NORMAL:
             if token.tag is NEWLINE:
-                state = BEGIN
+                self.state = LayoutAnalysis.BEGIN
             elif not token.isPrintable():
                 # discard stuff that doesn't matter
                 pass
@@ -133,14 +173,151 @@ def layout(tokensIn, skipAnalysis=False):
                 patterns.next(token)
                 tokensOut.append(token)
 
-    if len(tokensOut) > 0 and tokensOut[-1].text != ";":
-        tokensOut.append(Token(";", INTERNAL, tokensOut[-1].location))
-    if len(indentStack) > 1:
-        dedent(indentStack[0], None, tokensOut[-1].location)
-    if len(tokensOut) > 0 and tokensOut[-1].text != ";":
-        tokensOut.append(Token(";", INTERNAL, tokensOut[-1].location))
+    def finish(self):
+        # Called at the end of the file to close any open blocks.
+        tokensOut = self.output
+        if len(tokensOut) > 0 and tokensOut.last().text != ";":
+            tokensOut.append(Token(";", INTERNAL, tokensOut.last().location))
+        if len(self.indentStack) > 1:
+            self.dedent(self.indentStack[0], None, tokensOut.last().location)
+        if len(tokensOut) > 0 and tokensOut.last().text != ";":
+            tokensOut.append(Token(";", INTERNAL, tokensOut.last().location))
+
+    def dedent(self, indent, text, loc):
+        tokensOut = self.output
+        indentStack = self.indentStack
+        while indent < indentStack[-1]:
+            indentStack.pop()
+            self.patterns.pop()
+            if tokensOut.last().text != ";":
+                tokensOut.append(Token(";", INTERNAL, loc))
+            if indent < indentStack[-1] or text != "}":
+                tokensOut.append(Token("}", INTERNAL, loc))
+
 
-    return tokensOut
+class IncrementalLayout(object):
+    # Keeps the output of layout analysis for a table of raw tokens up to date as the
+    # source is edited. A snapshot of the analysis state is saved at the start of each
+    # line. After an edit (see lexer.relex), analysis is restarted from the last line
+    # before the damaged tokens and runs until it reaches a line after them where the
+    # state matches the state saved for the old tokens. The rest of the old output is then
+    # reused with shifted positions.
+    def __init__(self, rawTokens):
+        self.rawTokens = rawTokens
+        self.tokens = TokenTable(rawTokens.fileName, rawTokens.source)
+        self.lineIndices = array("i")   # index of the first printable raw token on a line
+        self.lineOutCounts = array("i")   # number of output tokens before that token
+        self.lineSnapshots = []
+        self.snapshotCache = {}
+        analysis = LayoutAnalysis()
+        self.__run(analysis, 0)
+
+    def update(self, rawTokens, begin, oldEnd, newEnd):
+        # Patches the output after raw tokens [begin, oldEnd) were replaced by tokens
+        # [begin, newEnd) in rawTokens. The arguments are what lexer.relex returns.
+        # Returns the new output table.
+        oldRawTokens = self.rawTokens
+        oldTokens = self.tokens
+        oldLineIndices = self.lineIndices
+        oldLineOutCounts = self.lineOutCounts
+        oldLineSnapshots = self.lineSnapshots
+
+        # Find the last saved line before any damaged token.
+        line = bisect.bisect_left(oldLineIndices, begin) - 1
+        self.rawTokens = rawTokens
+        self.tokens = TokenTable(rawTokens.fileName, rawTokens.source, texts=oldTokens.texts)
+        self.lineIndices = oldLineIndices[:max(line, 0)]
+        self.lineOutCounts = oldLineOutCounts[:max(line, 0)]
+        self.lineSnapshots = oldLineSnapshots[:max(line, 0)]
+        analysis = LayoutAnalysis()
+        if line < 0:
+            start = 0
+        else:
+            start = oldLineIndices[line]
+            outCount = oldLineOutCounts[line]
+            self.tokens.appendRange(oldTokens, 0, outCount)
+            lastToken = oldTokens[outCount - 1] if outCount > 0 else None
+            analysis.restore(oldLineSnapshots[line], lastToken, outCount)
+
+        def resync(index, snapshot):
+            # Called at the start of each line after the damaged tokens. If the same line
+            # in the old tokens was saved with the same state, the rest of the old output
+            # is copied and True is returned.
+            oldIndex = index - newEnd + oldEnd
+            oldLine = bisect.bisect_left(oldLineIndices, oldIndex)
+            if oldLine == len(oldLineIndices) or \
+               oldLineIndices[oldLine] != oldIndex or \
+               oldLineSnapshots[oldLine] is not snapshot:
+                return False
+            oldOutCount = oldLineOutCounts[oldLine]
+            indexDelta = newEnd - oldEnd
+            outDelta = len(self.tokens) - oldOutCount
+            oldRow = oldRawTokens.beginRows[oldIndex]
+            self.tokens.appendRange(oldTokens, oldOutCount, len(oldTokens),
+                offsetDelta=rawTokens.offsets[index] - oldRawTokens.offsets[oldIndex],
+                rowDelta=rawTokens.beginRows[index] - oldRow,
+                columnRow=oldRow,
+                columnDelta=rawTokens.beginColumns[index] - oldRawTokens.beginColumns[oldIndex])
+            self.lineIndices.extend(i + indexDelta for i in oldLineIndices[oldLine:])
+            self.lineOutCounts.extend(c + outDelta for c in oldLineOutCounts[oldLine:])
+            self.lineSnapshots.extend(oldLineSnapshots[oldLine:])
+            return True
+
+        try:
+            self.__run(analysis, start, newEnd, resync)
+        except LayoutException:
+            self.rawTokens = oldRawTokens
+            self.tokens = oldTokens
+            self.lineIndices = oldLineIndices
+            self.lineOutCounts = oldLineOutCounts
+            self.lineSnapshots = oldLineSnapshots
+            raise
+        return self.tokens
+
+    def __run(self, analysis, start, resyncIndex=None, resync=None):
+        rawTokens = self.rawTokens
+        tokens = self.tokens
+        for index in xrange(start, len(rawTokens)):
+            token = rawTokens[index]
+            if analysis.isLineStart(token):
+                snapshot = analysis.snapshot()
+                snapshot = self.snapshotCache.setdefault(snapshot, snapshot)
+                if resync is not None and index >= resyncIndex and resync(index, snapshot):
+                    return
+                self.lineIndices.append(index)
+                self.lineOutCounts.append(len(analysis.output))
+                self.lineSnapshots.append(snapshot)
+            analysis.next(token)
+            tokens.extend(analysis.output.flush())
+        analysis.finish()
+        tokens.extend(analysis.output.flush())
+
+
+class LayoutOutput(object):
+    # Collects tokens emitted by layout analysis until they are flushed. Layout only needs
+    # to look back at the last token it emitted and at how many tokens it has emitted, so
+    # that's all that's kept after a flush.
+    def __init__(self, lastToken=None, count=0):
+        self.pending = []
+        self.lastToken = lastToken
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def append(self, token):
+        self.pending.append(token)
+        self.lastToken = token
+        self.count += 1
+
+    def last(self):
+        assert self.lastToken is not None
+        return self.lastToken
+
+    def flush(self):
+        pending = self.pending
+        self.pending = []
+        return pending
 
 
 class IndentLevel(object):
@@ -158,80 +335,158 @@ class IndentLevel(object):
 
 ID_PATTERN = "id"
 ANY_PATTERN = "..."
-class PatternMatcher(object):
-    def __init__(self, pattern):
-        self.pattern = pattern
-        self.pos = 0
-        self.delimiters = []
-
-    def isMatch(self):
-        return self.pos == len(self.pattern) or \
-               (len(self.pattern) > 0 and \
-                self.pos == len(self.pattern) - 1 and \
-                self.pattern[-1] is ANY_PATTERN and \
-                len(self.delimiters) == 0)
-
-    def __nonzero__(self):
-        return self.isMatch()
 
-    def reset(self):
-        self.pos = 0
-        self.delimiters = []
-
-    def next(self, token):
-        if self.pos == len(self.pattern):
-            self.pos = 0
-
-        def retry():
-            if self.pos > 0:
-                self.pos = 0
-                self.next(token)
-
-        if self.pattern[self.pos] is ANY_PATTERN:
-            if self.pos + 1 < len(self.pattern) and \
-               len(self.delimiters) == 0 and \
-               token.text == self.pattern[self.pos + 1]:
-                self.pos += 2
-            else:
-                delimiterMap = { "}": "{", "]": "[", ")": "(" }
-                if token.text in delimiterMap.values():
-                    self.delimiters.append(token.text)
-                elif len(self.delimiters) > 0 and \
-                     delimiterMap.get(token.text) == self.delimiters[-1]:
-                    self.delimiters.pop()
-        elif self.pattern[self.pos] is ID_PATTERN:
-            if token.tag in [SYMBOL, OPERATOR]:
-                self.pos += 1
-            else:
-                retry()
+LAYOUT_PATTERNS = [
+  ["var", ANY_PATTERN, "="],
+  ["def", ANY_PATTERN, "="],
+  ["class", ANY_PATTERN],
+  ["if", "(", ANY_PATTERN, ")"],
+  ["else"],
+  ["else", "if", "(", ANY_PATTERN, ")"],
+  ["while", "(", ANY_PATTERN, ")"],
+  ["match", "(", ANY_PATTERN, ")"],
+  ["case", ANY_PATTERN, "=>"],
+  ["try"],
+  ["catch"],
+  ["catch", "(", ANY_PATTERN, ")"],
+  ["finally"],
+  ["lambda", "(", ANY_PATTERN, ")"]
+]
+
+
+# The layout patterns are compiled into a single deterministic automaton instead of being
+# matched one at a time. Each pattern on its own is matched by a position in the pattern
+# and, while the position is at ANY_PATTERN, a stack of open delimiters ((, [, {) that
+# haven't been closed yet. A pattern's delimiter stack is always the top of the stack of
+# all delimiters opened at its level (closing delimiters are ignored unless they match the
+# top), so only its depth needs to be remembered. An automaton state is the tuple of
+# (position, depth) pairs for all the patterns, and a PatternManager level just keeps a
+# state and a stack of open delimiters.
+#
+# States and transitions are created when they are first needed and are shared by every
+# PatternManager using the same patterns, so after the first few lines of a file, each
+# token costs a single table lookup.
+OPEN_DELIMITERS = frozenset(["(", "[", "{"])
+CLOSE_DELIMITERS = { ")": "(", "]": "[", "}": "{" }
+OPEN = "open"
+CLOSE = "close"
+
+class PatternAutomaton(object):
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.texts = frozenset(element for pattern in patterns for element in pattern
+                               if element is not ANY_PATTERN and element is not ID_PATTERN)
+        self.usesId = any(element is ID_PATTERN for pattern in patterns for element in pattern)
+        self.states = []
+        self.stateIds = {}
+        self.accepting = []
+        self.transitions = {}
+        self.initialState = self.getState(tuple((0, 0) for _ in patterns))
+
+    def getState(self, positions):
+        state = self.stateIds.get(positions)
+        if state is None:
+            state = len(self.states)
+            self.states.append(positions)
+            self.stateIds[positions] = state
+            self.accepting.append(any(self.isMatch(pattern, pos, depth)
+                                      for pattern, (pos, depth) in zip(self.patterns, positions)))
+        return state
+
+    def next(self, state, token, delimiters):
+        # Returns the state after token. delimiters is the stack of open delimiters for the
+        # current level, and it is updated.
+        text = token.text
+        if text in OPEN_DELIMITERS:
+            delimiters.append(text)
+            effect = OPEN
+        elif len(delimiters) > 0 and CLOSE_DELIMITERS.get(text) == delimiters[-1]:
+            delimiters.pop()
+            effect = CLOSE
         else:
-            if token.text == self.pattern[self.pos]:
-                self.pos += 1
+            effect = None
+        key = (state,
+               text if text in self.texts else None,
+               self.usesId and token.tag in [SYMBOL, OPERATOR],
+               effect)
+        nextState = self.transitions.get(key)
+        if nextState is None:
+            nextState = self.getState(tuple(self.step(pattern, pos, depth, key[1], key[2], effect)
+                                            for pattern, (pos, depth)
+                                            in zip(self.patterns, self.states[state])))
+            self.transitions[key] = nextState
+        return nextState
+
+    @staticmethod
+    def isMatch(pattern, pos, depth):
+        return pos == len(pattern) or \
+               (len(pattern) > 0 and \
+                pos == len(pattern) - 1 and \
+                pattern[-1] is ANY_PATTERN and \
+                depth == 0)
+
+    @staticmethod
+    def step(pattern, pos, depth, text, isId, effect):
+        # Advances a single pattern by one token. text is None if the token's text doesn't
+        # appear in any pattern.
+        if pos == len(pattern):
+            pos = 0
+
+        if pattern[pos] is ANY_PATTERN:
+            if pos + 1 < len(pattern) and \
+               depth == 0 and \
+               text is not None and text == pattern[pos + 1]:
+                return pos + 2, 0
+            elif effect is OPEN:
+                return pos, depth + 1
+            elif effect is CLOSE and depth > 0:
+                return pos, depth - 1
             else:
-                retry()
+                return pos, depth
+        elif pattern[pos] is ID_PATTERN:
+            matched = isId
+        else:
+            matched = text is not None and text == pattern[pos]
+
+        if matched:
+            return pos + 1, depth
+        elif pos > 0:
+            return PatternAutomaton.step(pattern, 0, depth, text, isId, effect)
+        else:
+            return pos, depth
 
 
 class PatternManager(object):
-    def __init__(self, patterns):
-        self.patterns = patterns
+    # Tracks which layout patterns have matched the tokens on the current line. A separate
+    # automaton state and delimiter stack is kept for each level of indentation.
+    def __init__(self, automaton):
+        self.automaton = automaton
         self.stack = []
         self.push()
 
     def push(self):
-        self.stack.append([PatternMatcher(pattern) for pattern in self.patterns])
+        self.stack.append((self.automaton.initialState, []))
 
     def pop(self):
         self.stack.pop()
 
     def next(self, token):
-        for matcher in self.stack[-1]:
-            matcher.next(token)
+        state, delimiters = self.stack[-1]
+        self.stack[-1] = (self.automaton.next(state, token, delimiters), delimiters)
 
     def reset(self):
-        for matcher in self.stack[-1]:
-            matcher.reset()
+        self.stack[-1] = (self.automaton.initialState, [])
 
     def match(self):
-        return any(self.stack[-1])
+        return self.automaton.accepting[self.stack[-1][0]]
+
+    def snapshot(self):
+        return tuple((state, tuple(delimiters)) for state, delimiters in self.stack)
+
+    def restore(self, snapshot):
+        self.stack = [(state, list(delimiters)) for state, delimiters in snapshot]
+
+
+LAYOUT_AUTOMATON = PatternAutomaton(LAYOUT_PATTERNS)
 
-__all__ = ["layout"]
+__all__ = ["layout", "iterLayout", "IncrementalLayout"]
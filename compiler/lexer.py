@@ -4,15 +4,17 @@
 # the GPL license that can be found in the LICENSE.txt file.
 
 
+import bisect
 import re
 
 from errors import LexException
 from location import Location
 from tok import *
+from tok import TAG_CODES
 
 __opchars = r"[!#%&*+\-/:<=>?@\\^|~]"
 
-__expressions = [
+__rawExpressions = [
   (r"\r?\n", NEWLINE),
   (r"[\t ]+", SPACE),
   (r"//[^\r\n]*", COMMENT),
@@ -85,38 +87,197 @@ __expressions = [
   (r"[!#%&*+\-/:<=>?@\\^|~]+", OPERATOR),
   (r"[A-Za-z_][A-Za-z0-9_-]*", SYMBOL),
 ]
-__expressions = [(re.compile(expr[0]), expr[1]) for expr in __expressions]
+__expressions = [(re.compile(expr[0]), expr[1]) for expr in __rawExpressions]
 
 
-def lex(filename, source):
-    tokens = []
-    pos = 0
+# The master expression recognizes each kind of token with a single regular expression
+# match. Python's alternation picks the first alternative that matches rather than the
+# longest one, so the alternatives are arranged so that the first match is always the
+# longest match the individual expressions above would produce (comments before operators,
+# floats before integers, numbers before operators and "."). Words, operators, and
+# punctuation are then classified by looking their text up in a table of the literal
+# expressions above, so keywords and reserved operators win ties with SYMBOL and OPERATOR
+# just as they do in the exhaustive search.
+__masterExpression = re.compile(r"""
+    (?P<newline>\r?\n)
+  | (?P<space>[\t\ ]+)
+  | (?P<comment>//[^\r\n]*)
+  | (?P<float>[+-]?[0-9]+(?:\.[0-9]*(?:[Ee][+-]?[0-9]+)?(?:f[0-9]+)?
+                          |[Ee][+-]?[0-9]+(?:f[0-9]+)?
+                          |f[0-9]+)
+             |[+-]?\.[0-9]+(?:[Ee][+-]?[0-9]+)?(?:f[0-9]+)?)
+  | (?P<integer>[+-]?0[xX][0-9A-Fa-f]+(?:i[0-9]+)?
+               |[+-]?0[bB][01]+(?:i[0-9]+)?
+               |[+-]?[0-9]+(?:i[0-9]+)?)
+  | (?P<string>"(?:\\"|[^"])*")
+  | (?P<operator>[!\#%&*+\-/:<=>?@\\^|~]+)
+  | (?P<punctuation>[\[\](){}.,;])
+  | (?P<symbol>[A-Za-z_][A-Za-z0-9_-]*)
+""", re.VERBOSE)
+
+__masterTags = {
+  "newline": NEWLINE,
+  "space": SPACE,
+  "comment": COMMENT,
+  "float": FLOAT,
+  "integer": INTEGER,
+  "string": STRING,
+  "operator": OPERATOR,
+  "punctuation": RESERVED,
+  "symbol": SYMBOL,
+}
+
+__literalTags = {re.sub(r"\\(.)", r"\1", expr): tag
+                 for expr, tag in __rawExpressions
+                 if re.match(r"(?:\\.|[^\\.\[\](){}*+?|^$])+\Z", expr)}
+
+
+def lex(filename, source, exhaustive=False):
+    tokens = TokenTable(filename, source)
+    for tag, pos, length, line, column in __scan(filename, source, exhaustive):
+        tokens.appendSource(tag, pos, length, line, column, line, column + length)
+    return tokens
+
+
+# Updates a table of tokens produced by lex after an edit to the source: removedLength
+# characters at offset are replaced with insertedText. Only the damaged part of the source
+# is lexed again. Once the lexer reaches the start of an old token past the edit, the rest
+# of the old tokens are reused (with shifted positions), since lexing from there will
+# produce the same tokens. Returns a tuple (newTokens, begin, oldEnd, newEnd): tokens
+# [begin, oldEnd) in the old table were replaced by tokens [begin, newEnd) in the new table.
+def relex(tokens, offset, removedLength, insertedText, exhaustive=False):
+    oldSource = tokens.source
+    assert 0 <= offset and offset + removedLength <= len(oldSource)
+    source = oldSource[:offset] + insertedText + oldSource[offset + removedLength:]
+    delta = len(insertedText) - removedLength
+    editEnd = offset + len(insertedText)
+
+    # Tokens cover the whole source, so the token where lexing restarts only lies past the
+    # end of the table if the table is empty.
+    begin = __findRelexStart(tokens, offset)
+    if begin < len(tokens):
+        pos = tokens.offsets[begin]
+        line = tokens.beginRows[begin]
+        column = tokens.beginColumns[begin]
+    else:
+        assert begin == 0
+        pos, line, column = 0, 1, 1
+
+    newTokens = TokenTable(tokens.fileName, source, texts=tokens.texts)
+    newTokens.appendRange(tokens, 0, begin)
+    oldIndex = begin
+    for tag, pos, length, line, column in __scan(tokens.fileName, source, exhaustive,
+                                                 pos, line, column):
+        if pos >= editEnd:
+            oldPos = pos - delta
+            while oldIndex < len(tokens) and tokens.offsets[oldIndex] < oldPos:
+                oldIndex += 1
+            if oldIndex < len(tokens) and tokens.offsets[oldIndex] == oldPos:
+                newEnd = len(newTokens)
+                oldRow = tokens.beginRows[oldIndex]
+                newTokens.appendRange(tokens, oldIndex, len(tokens),
+                                      offsetDelta=delta,
+                                      rowDelta=line - oldRow,
+                                      columnRow=oldRow,
+                                      columnDelta=column - tokens.beginColumns[oldIndex])
+                return newTokens, begin, oldIndex, newEnd
+        newTokens.appendSource(tag, pos, length, line, column, line, column + length)
+    return newTokens, begin, len(tokens), len(newTokens)
+
+
+# The lexer may look a few characters past the end of a token before deciding where it
+# ends (for example, "1e+" is lexed as "1" followed by "e" and "+"). This is the most it
+# looks ahead for any kind of token except strings.
+__RELEX_LOOKAHEAD = 3
+
+def __findRelexStart(tokens, offset):
+    # Finds the index of the first token which could be changed by an edit at offset.
+    # Tokens which end well before the edit are not affected, with one exception: a string
+    # which ends with an escaped quote may have been cut short because no closing quote
+    # was found later in the source, so it might be extended by any edit after it.
+    begin = bisect.bisect_left(_TokenEnds(tokens), offset - __RELEX_LOOKAHEAD)
+    if tokens.source.find('\\"', 0, offset) != -1:
+        stringCode = TAG_CODES[STRING]
+        for index in xrange(begin):
+            if tokens.tags[index] == stringCode and tokens.text(index).endswith('\\"'):
+                return index
+    return begin
+
+
+class _TokenEnds(object):
+    # A read-only sequence of the source offsets where tokens in a table end, for bisect.
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, index):
+        return self.tokens.offsets[index] + self.tokens.lengths[index]
+
+
+# Like lex, but yields Token objects one at a time as they are recognized instead of
+# building a table, so tokens can be streamed to the next phase.
+def iterLex(filename, source, exhaustive=False):
+    for tag, pos, length, line, column in __scan(filename, source, exhaustive):
+        location = Location(filename, line, column, line, column + length)
+        yield Token(source[pos:pos + length], tag, location)
+
+
+# Recognizes tokens in the source. For each token, yields a tuple of the tag, the position
+# and length of the text in the source, and the line and column where the token starts.
+def __scan(filename, source, exhaustive, pos=0, line=1, column=1):
+    if exhaustive:
+        return __scanExhaustive(filename, source, pos, line, column)
+    else:
+        return __scanMaster(filename, source, pos, line, column)
+
+
+def __scanMaster(filename, source, pos, line, column):
     end = len(source)
-    line = 1
-    column = 1
+    match = __masterExpression.match
+    masterTags = __masterTags
+    literalTags = __literalTags
     while pos < end:
-        token = None
-        for expr in __expressions:
-            (rx, tag) = expr
-            m = rx.match(source, pos)
-            if m:
-                text = m.group(0)
-                if token and len(text) <= len(token.text):
-                    continue
-
-                location = Location(filename, line, column, line, column + len(text))
-                token = Token(m.group(0), tag, location)
-        if not token:
+        m = match(source, pos)
+        if not m:
             location = Location(filename, line, column, line, column + 1)
             raise LexException(location, "illegal character: %s" % source[pos:pos+1])
-        tokens.append(token)
-        if token.tag is NEWLINE:
+        tag = masterTags[m.lastgroup]
+        if tag is SYMBOL or tag is OPERATOR or tag is RESERVED:
+            tag = literalTags.get(m.group(), tag)
+        length = m.end() - pos
+        yield tag, pos, length, line, column
+        if tag is NEWLINE:
             line += 1
             column = 1
         else:
-            column += len(token.text)
-        pos += len(token.text)
+            column += length
+        pos += length
 
-    return tokens
 
-__all__ = ["lex"]
+# This is the original lexer, which tries every expression at every position and keeps the
+# longest match. It's much slower than the master expression, but it's kept so the two can
+# be checked against each other.
+def __scanExhaustive(filename, source, pos, line, column):
+    end = len(source)
+    while pos < end:
+        length = 0
+        tag = None
+        for rx, exprTag in __expressions:
+            m = rx.match(source, pos)
+            if m and m.end() - pos > length:
+                length = m.end() - pos
+                tag = exprTag
+        if tag is None:
+            location = Location(filename, line, column, line, column + 1)
+            raise LexException(location, "illegal character: %s" % source[pos:pos+1])
+        yield tag, pos, length, line, column
+        if tag is NEWLINE:
+            line += 1
+            column = 1
+        else:
+            column += length
+        pos += length
+
+__all__ = ["lex", "iterLex", "relex"]
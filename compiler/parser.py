@@ -14,8 +14,11 @@ from utils import tryDecodeString
 
 
 # Main function
-def parse(filename, tokens):
-    reader = ct.Reader(filename, tokens)
+def parse(filename, tokens, memo=None):
+    # If memo is a ct.MemoTable, results of memoized rules are cached during the parse
+    # (packrat parsing), and memo counts cache hits for each rule.
+    reader = ct.Reader(filename, ct.TokenStream(tokens, memo, filename))
+    # Grammar rules are built on first use and shared, so this is only expensive once.
     parser = module()
     result = parser(reader)
     if not result:
@@ -26,25 +29,32 @@ def parse(filename, tokens):
 
 
 # Top level
+@ct.rule
 def module():
     def process(parsed, loc):
         return ast.AstModule(parsed, loc)
-    return ct.Phrase(ct.Rep(definition())) ^ process
+    return ct.Phrase(ct.CommittedRep(definition())) ^ process
 
 
 # Definitions
+@ct.rule
 def definition():
     return varDefn() | functionDefn() | classDefn()
 
 
+@ct.rule
 def attribs():
-    return ct.Rep(attrib())
+    # Each kind of definition parses attributes before its keyword, so when a definition
+    # is parsed, attributes are parsed again for each kind that doesn't match.
+    return ct.Memo(ct.Rep(attrib()), "attribs")
 
 
+@ct.rule
 def attrib():
     return ct.Tag(ATTRIB) ^ (lambda name, loc: ast.AstAttribute(name, loc))
 
 
+@ct.rule
 def varDefn():
     def process(parsed, loc):
         [ats, kw, pat, expr, _] = ct.untangle(parsed)
@@ -54,6 +64,7 @@ def varDefn():
     return attribs() + kw + ct.Commit(pattern() + exprOpt + semi) ^ process
 
 
+@ct.rule
 def functionDefn():
     def process(parsed, loc):
         [ats, _, name, tps, ps, rty, body, _] = ct.untangle(parsed)
@@ -64,6 +75,7 @@ def functionDefn():
         tyOpt() + bodyOpt + semi) ^ process
 
 
+@ct.rule
 def classDefn():
     def process(parsed, loc):
         [ats, _, name, tps, ctor, sty, sargs, ms, _] = ct.untangle(parsed)
@@ -74,6 +86,7 @@ def classDefn():
            constructor() + superclass() + classBodyOpt + semi) ^ process
 
 
+@ct.rule
 def constructor():
     def process(parsed, loc):
         [ats, _, params, _] = ct.untangle(parsed)
@@ -82,6 +95,7 @@ def constructor():
                ct.Commit(ct.RepSep(parameter(), keyword(",")) + keyword(")")) ^ process)
 
 
+@ct.rule
 def superclass():
     def processArgs(parsed, loc):
         return ct.untangle(parsed)[1] if parsed is not None else []
@@ -95,18 +109,21 @@ def superclass():
     return ct.Opt(keyword("<:") + classType() + args) ^ process
 
 
+@ct.rule
 def supertypes():
     def process(parsed, _):
         return ct.untangle(parsed)[1] if parsed else []
     return ct.Opt(keyword("<:") + ct.Rep1Sep(classType(), keyword(","))) ^ process
 
 
+@ct.rule
 def typeParameters():
     def process(parsed, _):
         return ct.untangle(parsed)[1] if parsed else []
     return ct.Opt(keyword("[") + ct.Rep1Sep(typeParameter(), keyword(",")) + keyword("]")) ^ process
 
 
+@ct.rule
 def typeParameter():
     def process(parsed, loc):
         [ats, var, name, upper, lower] = ct.untangle(parsed)
@@ -117,12 +134,14 @@ def typeParameter():
     return attribs() + variance + symbol + upperBound + lowerBound ^ process
 
 
+@ct.rule
 def parameters():
     def process(parsed, _):
         return ct.untangle(parsed)[1] if parsed else []
     return ct.Opt(keyword("(") + ct.Rep1Sep(parameter(), keyword(",")) + keyword(")")) ^ process
 
 
+@ct.rule
 def parameter():
     def process(parsed, loc):
         [ats, var, pat] = ct.untangle(parsed)
@@ -131,10 +150,12 @@ def parameter():
 
 
 # Patterns
+@ct.rule
 def pattern():
     return varPattern()
 
 
+@ct.rule
 def varPattern():
     def process(parsed, loc):
         (name, parsedTy) = parsed
@@ -144,14 +165,17 @@ def varPattern():
 
 
 # Types
+@ct.rule
 def ty():
     return simpleType() | classType()
 
 
+@ct.rule
 def tyOpt():
     return ct.Opt(keyword(":") + ty() ^ (lambda p, _: p[1]))
 
 
+@ct.rule
 def simpleType():
     return (keyword("unit") ^ (lambda _, loc: ast.AstUnitType(loc))) | \
            (keyword("i8") ^ (lambda _, loc: ast.AstI8Type(loc))) | \
@@ -163,6 +187,7 @@ def simpleType():
            (keyword("boolean") ^ (lambda _, loc: ast.AstBooleanType(loc)))
 
 
+@ct.rule
 def classType():
     def process(parsed, loc):
         name, typeArgs, nullFlag = ct.untangle(parsed)
@@ -172,13 +197,17 @@ def classType():
     return symbol + typeArguments() + ct.Opt(ct.Reserved(OPERATOR, "?")) ^ process
 
 
+@ct.rule
 def typeArguments():
     def process(parsed, _):
         return ct.untangle(parsed)[1] if parsed else None
-    return ct.Opt(keyword("[") + ct.Rep1Sep(ct.Lazy(ty), keyword(",")) + keyword("]")) ^ process
+    return ct.Memo(ct.Opt(keyword("[") + ct.Rep1Sep(ct.Lazy(ty), keyword(",")) + keyword("]")) ^
+                   process,
+                   "typeArguments")
 
 
 # Expressions
+@ct.rule
 def expression():
     def combine(left, right, loc):
         return ast.AstAssignExpression(left, right, loc)
@@ -186,6 +215,7 @@ def expression():
     return ct.LeftRec(maybeBinopExpr(), rhs, combine)
 
 
+@ct.rule
 def maybeBinopExpr():
     binopLevels = [[],   # other
                    ["*", "/", "%"],
@@ -200,7 +230,6 @@ def maybeBinopExpr():
     BINOP_LOGIC_AND_LEVEL = len(binopLevels)
     BINOP_LOGIC_OR_LEVEL = BINOP_LOGIC_AND_LEVEL + 1
     BINOP_ASSIGN_LEVEL = BINOP_LOGIC_OR_LEVEL + 1
-    NUM_BINOP_LEVELS = BINOP_ASSIGN_LEVEL + 1
     def precedenceOf(op):
         if op[-1] == "=" and \
            not (len(op) > 1 and op[0] == "=") and \
@@ -221,18 +250,6 @@ def maybeBinopExpr():
     def associativityOf(op):
         return RIGHT if op[-1] == ":" else LEFT
 
-    def buildBinaryParser(term, level):
-        return ct.LeftRec(term, binarySuffix(term, level), processBinary) ^ postProcessBinary
-
-    def binarySuffix(term, level):
-        return ct.If(operator, lambda op: precedenceOf(op) == level) + ct.Commit(term)
-
-    def processBinary(left, parsed, _):
-        (op, right) = parsed
-        if not isinstance(left, list):
-            left = [(None, left)]
-        return left + [(op, right)]
-
     def postProcessBinary(expr, loc):
         if not isinstance(expr, list):
             return expr
@@ -259,21 +276,20 @@ def maybeBinopExpr():
                     result = ast.AstBinaryExpression(op, subexpr, result, loc)
                 return result
 
-    parser = maybeCallExpr()
-    for i in xrange(0, NUM_BINOP_LEVELS):
-        parser = buildBinaryParser(parser, i)
-    return parser
+    return ct.Precedence(maybeCallExpr(), OPERATOR, precedenceOf, postProcessBinary)
 
 
+@ct.rule
 def maybeCallExpr():
     return ct.LeftRec(receiverExpr(), callSuffix(), processCall)
 
+@ct.rule
 def callSuffix():
     methodNameOpt = ct.Opt(keyword(".") + symbol ^ (lambda p, _: p[1]))
     argumentsOpt = ct.Opt(keyword("(") + ct.RepSep(ct.Lazy(expression), keyword(",")) + keyword(")")) ^ \
         (lambda p, _: ct.untangle(p)[1] if p else None)
     getMethodOpt = ct.Opt(keyword("_")) ^ (lambda p, _: bool(p))
-    return methodNameOpt + typeArguments() + argumentsOpt + getMethodOpt
+    return ct.Memo(methodNameOpt + typeArguments() + argumentsOpt + getMethodOpt, "callSuffix")
 
 def processCall(receiver, parsed, loc):
     [methodName, typeArguments, arguments, isGetMethod] = ct.untangle(parsed)
@@ -301,6 +317,7 @@ def processCall(receiver, parsed, loc):
         return ct.FailValue("not a call")
 
 
+@ct.rule
 def receiverExpr():
     return unaryExpr() | \
            literalExpr() | \
@@ -321,22 +338,27 @@ def receiverExpr():
            returnExpr()
 
 
+@ct.rule
 def literalExpr():
     return literal() ^ (lambda lit, loc: ast.AstLiteralExpression(lit, loc))
 
 
+@ct.rule
 def varExpr():
     return symbol ^ (lambda name, loc: ast.AstVariableExpression(name, loc))
 
 
+@ct.rule
 def thisExpr():
     return keyword("this") ^ (lambda _, loc: ast.AstThisExpression(loc))
 
 
+@ct.rule
 def superExpr():
     return keyword("super") ^ (lambda _, loc: ast.AstSuperExpression(loc))
 
 
+@ct.rule
 def groupExpr():
     def process(parsed, _):
         [_, e, _] = ct.untangle(parsed)
@@ -344,12 +366,14 @@ def groupExpr():
     return keyword("(") + ct.Lazy(expression) + keyword(")") ^ process
 
 
+@ct.rule
 def blockExpr():
     def process(stmts, loc):
         return ast.AstBlockExpression(stmts, loc)
     return layoutBlock(ct.Rep(ct.Lazy(statement)) ^ process)
 
 
+@ct.rule
 def unaryExpr():
     def process(parsed, loc):
         (op, e) = parsed
@@ -358,6 +382,7 @@ def unaryExpr():
     return op + ct.Commit(ct.Lazy(expression)) ^ process
 
 
+@ct.rule
 def ifExpr():
     def process(parsed, loc):
         [_, _, c, _, t, f] = ct.untangle(parsed)
@@ -368,6 +393,7 @@ def ifExpr():
         ct.Lazy(expression) + elseClause) ^ process
 
 
+@ct.rule
 def whileExpr():
     def process(parsed, loc):
         [_, _, c, _, b] = ct.untangle(parsed)
@@ -376,20 +402,24 @@ def whileExpr():
         ct.Lazy(expression)) ^ process
 
 
+@ct.rule
 def breakExpr():
     return keyword("break") ^ (lambda _, loc: ast.AstBreakExpression(loc))
 
 
+@ct.rule
 def continueExpr():
     return keyword("continue") ^ (lambda _, loc: ast.AstContinueExpression(loc))
 
 
+@ct.rule
 def partialFnExpr():
     def process(cases, loc):
         return ast.AstPartialFunctionExpression(cases, loc)
     return layoutBlock(ct.Rep1(partialFunctionCase()) ^ process)
 
 
+@ct.rule
 def partialFunctionCase():
     def process(parsed, loc):
         [_, p, c, _, e, _] = ct.untangle(parsed)
@@ -399,6 +429,7 @@ def partialFunctionCase():
         ct.Lazy(expression) + semi) ^ process
 
 
+@ct.rule
 def matchExpr():
     def process(parsed, loc):
         [_, _, e, _, m] = ct.untangle(parsed)
@@ -407,6 +438,7 @@ def matchExpr():
         partialFnExpr()) ^ process
 
 
+@ct.rule
 def throwExpr():
     def process(parsed, loc):
         (_, x) = parsed
@@ -414,6 +446,7 @@ def throwExpr():
     return keyword("throw") + ct.Commit(ct.Lazy(expression)) ^ process
 
 
+@ct.rule
 def tryCatchExpr():
     def process(parsed, loc):
         [_, e, c, f] = ct.untangle(parsed)
@@ -426,6 +459,7 @@ def tryCatchExpr():
     return keyword("try") + ct.Commit(ct.Lazy(expression) + catchHandler() + finallyOpt) ^ process
 
 
+@ct.rule
 def catchHandler():
     def processSimple(parsed, loc):
         [_, p, _, e] = ct.untangle(parsed)
@@ -440,6 +474,7 @@ def catchHandler():
     return ct.Opt(keyword("catch") + ct.Commit(simpleHandler | matchHandler) ^ process)
 
 
+@ct.rule
 def lambdaExpr():
     def process(parsed, loc):
         [_, n, tps, _, ps, _, b] = ct.untangle(parsed)
@@ -448,6 +483,7 @@ def lambdaExpr():
         ct.RepSep(pattern(), keyword(",")) + keyword(")") + ct.Lazy(expression)) ^ process
 
 
+@ct.rule
 def returnExpr():
     def process(parsed, loc):
         (_, e) = parsed
@@ -455,15 +491,18 @@ def returnExpr():
     return keyword("return") + ct.Opt(ct.Lazy(expression)) ^ process
 
 
+@ct.rule
 def statement():
     return definition() | ((expression() + semi) ^ (lambda p, _: p[0]))
 
 
 # Literals
+@ct.rule
 def literal():
     return intLiteral() | floatLiteral() | booleanLiteral() | nullLiteral() | stringLiteral()
 
 
+@ct.rule
 def intLiteral():
     def process(text, loc):
         m = re.match("([+-]?)(0[BbXx])?([0-9A-Fa-f]+)(?:i([0-9]+))?", text)
@@ -490,6 +529,7 @@ def intLiteral():
     return ct.Tag(INTEGER) ^ process
 
 
+@ct.rule
 def floatLiteral():
     def process(text, loc):
         m = re.match("([^f]*)(?:f([0-9]+))?", text)
@@ -500,15 +540,18 @@ def floatLiteral():
     return ct.Tag(FLOAT) ^ process
 
 
+@ct.rule
 def booleanLiteral():
     return (keyword("true") ^ (lambda _, loc: ast.AstBooleanLiteral(True, loc))) | \
            (keyword("false") ^ (lambda _, loc: ast.AstBooleanLiteral(False, loc)))
 
 
+@ct.rule
 def nullLiteral():
     return keyword("null") ^ (lambda _, loc: ast.AstNullLiteral(loc))
 
 
+@ct.rule
 def stringLiteral():
     def process(text, loc):
         value = tryDecodeString(text)
@@ -519,9 +562,11 @@ def stringLiteral():
 
 
 # Basic parsers
+@ct.rule
 def keyword(kw):
     return ct.Reserved(RESERVED, kw)
 
+@ct.rule
 def layoutBlock(contents):
     def process(parsed, loc):
         [_, ast, _] = ct.untangle(parsed)
@@ -18,9 +18,10 @@
 # (performed after type analysis)
 # - convertClosures
 # - flattenClasses
+# - analyzeClassHierarchy
 
 import ast
-from compile_info import ContextInfo, ClosureInfo, DefnInfo, ClassInfo, UseInfo, getAllArgumentTypes, GLOBAL_SCOPE_ID, BUILTIN_SCOPE_ID, USE_AS_VALUE, USE_AS_TYPE, USE_AS_PROPERTY, USE_AS_CONSTRUCTOR, CONTEXT_CONSTRUCTOR_HINT, CLOSURE_CONSTRUCTOR_HINT, NOT_HERITABLE
+from compile_info import ContextInfo, ClosureInfo, DefnInfo, ClassInfo, UseInfo, getAllArgumentTypes, getExplicitTypeParameters, GLOBAL_SCOPE_ID, BUILTIN_SCOPE_ID, USE_AS_VALUE, USE_AS_TYPE, USE_AS_PROPERTY, USE_AS_CONSTRUCTOR, CONTEXT_CONSTRUCTOR_HINT, CLOSURE_CONSTRUCTOR_HINT, NOT_HERITABLE
 from data import Data
 from errors import TypeException, ScopeException
 from flags import *
@@ -204,12 +205,28 @@ def convertClosures(info):
           context.x = x
           var closure-g = Closure-g(context)
           closure-g.apply()
+
+    Immutable parameters (like `x` above) are an exception. Their values can't change, and
+    they are initialized before any closure in their function is created, so instead of
+    moving them into a context, their values are copied into a field of each closure class
+    between the context scope and the closure scope (see `UseInfo.mayCaptureByValue`). No
+    context is created for a scope if all its captured definitions are copied. A definition
+    is only copied if every use which captures it allows it.
     """
-    # Do the actual closure conversion.
+    # Find captured definitions, and decide which ones can be copied by value.
+    captures = []
+    capturedByContext = set()
     for useInfo in info.useInfo.itervalues():
         if useInfo.shouldCapture(info):
-            useScope = info.getScope(useInfo.useScopeId)
-            useScope.capture(useInfo)
+            captures.append(useInfo)
+            if not useInfo.mayCaptureByValue(info):
+                capturedByContext.add(id(useInfo.defnInfo))
+
+    # Do the actual closure conversion.
+    for useInfo in captures:
+        useScope = info.getScope(useInfo.useScopeId)
+        byValue = id(useInfo.defnInfo) not in capturedByContext
+        useScope.capture(useInfo, byValue)
 
     # We are done modifying scopes, and we made a mess. Call finish on scopes in no
     # particular order.
@@ -248,16 +265,13 @@ def flattenClasses(info):
         methods = list(irSuperclass.methods)
         for ownMethod in irClass.methods:
             if hasattr(ownMethod, "override"):
-                foundOverride = False
-                for i, inheritedMethod in enumerate(irSuperclass.methods):
-                    if ownMethod.override is inheritedMethod:
-                        foundOverride = True
-                        methods[i] = ownMethod
-                        break
-                assert foundOverride
+                # The superclass was flattened first, so its member index has the slot of
+                # every method it inherited or defined.
+                methods[irSuperclass.getMethodIndex(ownMethod.override)] = ownMethod
             else:
                 methods.append(ownMethod)
         irClass.methods = methods
+        irClass.buildMemberIndex()
         if ABSTRACT not in irClass.flags:
             for m in methods:
                 if ABSTRACT in m.flags:
@@ -266,6 +280,33 @@ def flattenClasses(info):
                                          (m.name, irClass.name))
 
 
+def analyzeClassHierarchy(info):
+    """Finds methods which are not overridden in any class derived from the class which
+    defines them.
+
+    Every class which can inherit from a class in the package is defined in the package, so
+    once classes have been flattened, we can see all implementations of each method. If a
+    method is not overridden, a call to it can only reach that method, so the compiler can
+    call it directly instead of looking it up in the receiver's vtable. These methods are
+    marked with the `isNotOverridden` attribute."""
+
+    overriddenMethodIds = set()
+    for irClass in info.package.classes:
+        # Classes are flattened, so each class's vtable begins with its superclass's vtable.
+        # A method is overridden if a slot holding it is replaced in any derived class.
+        irSuperclass = irClass.supertypes[0].clas
+        for superMethod, method in zip(irSuperclass.methods, irClass.methods):
+            if method is not superMethod:
+                overriddenMethodIds.add(id(superMethod))
+
+    for irFunction in info.package.functions:
+        if irFunction.isMethod() and \
+           not irFunction.isFinal() and \
+           ABSTRACT not in irFunction.flags and \
+           id(irFunction) not in overriddenMethodIds:
+            irFunction.isNotOverridden = True
+
+
 def isHeritable(irDefn):
     """Returns true if the given irDefn can be inherited from a base class by a
     deriving class."""
@@ -292,8 +333,20 @@ class NameInfo(object):
         # Only defined after `resolveOverrides` is called and only if `isOverloaded` is true.
         self.overrides = None
 
+        # Overloads which may be called (not overriden), grouped for `findDefnInfoWithArgTypes`.
+        # This is a (list(DefnInfo), dict(int, list((DefnInfo, tuple)))) pair containing
+        # non-function definitions and functions keyed by number of parameters. Each function
+        # is paired with the erased types of its parameters (see `getErasedType`). Built
+        # lazily after overrides are resolved.
+        self.overloadIndex = None
+
+        # Results of `findDefnInfoWithArgTypes`, keyed by call signature.
+        self.resolvedCalls = {}
+
     def addOverload(self, defnInfo):
         self.overloads.append(defnInfo)
+        self.overloadIndex = None
+        self.resolvedCalls = {}
 
     def isOverloadable(self, otherDefnInfo):
         return isinstance(otherDefnInfo.irDefn, ir.Function) and \
@@ -345,9 +398,22 @@ class NameInfo(object):
         if not self.isOverloaded():
             return
 
+        # A function can only override another function with the same number of parameters
+        # and explicit type parameters, so only functions within the same group are compared.
+        overloadGroups = {}
+        for defnInfo in self.overloads:
+            irDefn = defnInfo.irDefn
+            assert isinstance(irDefn, ir.Function)
+            key = (len(irDefn.parameterTypes), len(getExplicitTypeParameters(irDefn)))
+            overloadGroups.setdefault(key, []).append(defnInfo)
+        for overloads in overloadGroups.itervalues():
+            if len(overloads) > 1:
+                self.resolveOverridesInGroup(overloads)
+
+    def resolveOverridesInGroup(self, overloads):
         # Sort overloads by depth to simplify the loop and avoid the last condition
         # mentioned above.
-        overloadsByDepth = sorted(self.overloads,
+        overloadsByDepth = sorted(overloads,
                                   key=lambda defnInfo: defnInfo.inheritanceDepth)
 
         # Compare each function with each other function with greater depth.
@@ -397,44 +463,109 @@ class NameInfo(object):
         This is safe to call on any NameInfo, even if it doesn't refer to a function. If there
         is exactly one match, returns (DefnInfo, list(Type), list(Type)) containing the matched
         definition, the full list of type arguments, and the full list of argument types. If
-        there are zero or multiple matches, raises ScopeException."""
+        there are zero or multiple matches, raises ScopeException.
+
+        Overloads are indexed by number of parameters and erased parameter types, so most
+        overloads are rejected without checking subtypes. Results are memoized by call
+        signature."""
         self.resolveOverrides()
-        candidate = None
-        for defnInfo in self.overloads:
-            irDefn = defnInfo.irDefn
-            if isinstance(irDefn, ir.Function) and irDefn.id in self.overrides:
-                continue
+        key = (receiverType, receiverIsExplicit, tuple(typeArgs), tuple(argTypes))
+        candidate = self.resolvedCalls.get(key)
+        if candidate is None:
+            candidate = self.findCandidateWithArgTypes(receiverType, receiverIsExplicit,
+                                                       typeArgs, argTypes, loc)
+            self.resolvedCalls[key] = candidate
+        defnInfo, allTypeArgs, allArgTypes = candidate
+        if allTypeArgs is not None:
+            allTypeArgs = list(allTypeArgs)
+            allArgTypes = list(allArgTypes)
+        return (defnInfo, allTypeArgs, allArgTypes)
+
+    def findCandidateWithArgTypes(self, receiverType, receiverIsExplicit,
+                                  typeArgs, argTypes, loc):
+        if self.overloadIndex is None:
+            self.indexOverloads()
+        nonFunctions, functionsByArity = self.overloadIndex
 
-            if not isinstance(irDefn, ir.Function) and \
-               len(typeArgs) == 0 and len(argTypes) == 0:
-                # Non-function
-                typesAndArgs = (None, None)
-                match = True
-            elif not receiverIsExplicit and \
-                 isinstance(irDefn, ir.Function) and \
-                 not irDefn.isMethod():
-                # Regular function
-                typesAndArgs = getAllArgumentTypes(irDefn, None, typeArgs, argTypes)
-                match = typesAndArgs is not None
-            elif isinstance(irDefn, ir.Function) and \
-                 irDefn.isMethod():
-                # Method call
-                typesAndArgs = getAllArgumentTypes(irDefn, receiverType, typeArgs, argTypes)
-                match = typesAndArgs is not None
-            else:
-                match = False
+        candidate = None
+        if len(typeArgs) == 0 and len(argTypes) == 0 and len(nonFunctions) > 0:
+            if len(nonFunctions) > 1:
+                raise TypeException(loc, "ambiguous call to overloaded function: %s" % \
+                                    self.name)
+            candidate = (nonFunctions[0], None, None)
+
+        # Methods have an extra parameter for the receiver if there is one, so they may be
+        # in either bucket.
+        for arity in (len(argTypes), len(argTypes) + 1):
+            for defnInfo, erasedTypes in functionsByArity.get(arity, ()):
+                irDefn = defnInfo.irDefn
+                if irDefn.isMethod():
+                    # Method call. The receiver is checked when its type is substituted for
+                    # the method's class.
+                    if receiverType is not None:
+                        erasedTypes = erasedTypes[1:]
+                    functionReceiverType = receiverType
+                elif not receiverIsExplicit:
+                    # Regular function
+                    functionReceiverType = None
+                else:
+                    continue
+                if len(erasedTypes) != len(argTypes) or \
+                   not all(mayBeSubtypeOfErasedType(argType, erasedType)
+                           for argType, erasedType in zip(argTypes, erasedTypes)):
+                    continue
 
-            if match:
-                if candidate is not None:
-                    raise TypeException(loc, "ambiguous call to overloaded function: %s" % \
-                                        self.name)
-                allTypeArgs, allArgTypes = typesAndArgs
-                candidate = (defnInfo, allTypeArgs, allArgTypes)
+                typesAndArgs = getAllArgumentTypes(irDefn, functionReceiverType,
+                                                   typeArgs, argTypes)
+                if typesAndArgs is not None:
+                    if candidate is not None:
+                        raise TypeException(loc, "ambiguous call to overloaded function: %s" % \
+                                            self.name)
+                    allTypeArgs, allArgTypes = typesAndArgs
+                    candidate = (defnInfo, allTypeArgs, allArgTypes)
 
         if candidate is None:
             raise TypeException(loc, "could not find compatible definition: %s" % self.name)
         return candidate
 
+    def indexOverloads(self):
+        nonFunctions = []
+        functionsByArity = {}
+        for defnInfo in self.overloads:
+            irDefn = defnInfo.irDefn
+            if not isinstance(irDefn, ir.Function):
+                nonFunctions.append(defnInfo)
+            elif irDefn.id not in self.overrides:
+                erasedTypes = tuple(map(getErasedType, irDefn.parameterTypes))
+                functionsByArity.setdefault(len(erasedTypes), []).append((defnInfo, erasedTypes))
+        self.overloadIndex = (nonFunctions, functionsByArity)
+
+
+def getErasedType(ty):
+    """Returns a class or primitive type which the type of any argument passed for a
+    parameter of the given type must be a subclass of or equal to, regardless of type
+    arguments or flags. Returns None if there is no such class or type, e.g., for type
+    parameters."""
+    if isinstance(ty, ClassType):
+        return ty.clas
+    elif ty.isPrimitive() and ty.width is not None:
+        return ty
+    else:
+        return None
+
+
+def mayBeSubtypeOfErasedType(ty, erasedType):
+    """Returns False if the given type can't be a subtype of a type with the given erasure.
+    This is a quick test which lets most overloads be rejected before calling canCallWith."""
+    if erasedType is None:
+        return True
+    elif isinstance(ty, ClassType):
+        return isinstance(erasedType, ir.Class) and ty.clas.isSubclassOf(erasedType)
+    elif ty.isPrimitive() and ty.width is not None:
+        return ty is erasedType
+    else:
+        return True
+
 
 class Scope(ast.AstNodeVisitor):
     def __init__(self, ast, scopeId, parent, info):
@@ -445,6 +576,12 @@ class Scope(ast.AstNodeVisitor):
         self.bindings = {}
         self.defined = set()
         self.childScopes = {}
+
+        # Results of `lookup`, keyed by (name, localOnly). Values are (version, defnScope,
+        # isLocal) tuples, where version is the name's binding version when the lookup was
+        # done, defnScope is the scope the name is bound in (or None if it wasn't found),
+        # and isLocal indicates whether this scope is local within defnScope.
+        self.resolvedNames = {}
         info.setScope(self.scopeId, self)
         info.setContextInfo(scopeId, ContextInfo(self.scopeId))
         if not self.isLocal() and \
@@ -509,6 +646,9 @@ class Scope(ast.AstNodeVisitor):
         OverloadInfo."""
         if name not in self.bindings:
             self.bindings[name] = NameInfo(name)
+            # Lookups of this name in this scope or its descendants may now resolve here.
+            versions = self.info.bindingVersions
+            versions[name] = versions.get(name, 0) + 1
         self.bindings[name].addOverload(defnInfo)
 
     def getBindings(self):
@@ -577,24 +717,45 @@ class Scope(ast.AstNodeVisitor):
     def lookup(self, name, loc, localOnly=False, mayBeAssignment=False, ignoreDefnOrder=False):
         """Resolves a reference to a symbol, possibly in a parent scope.
 
-        Returns NameInfo. For overloaded symbols, there may be several functions in there."""
-        defnScope = self
-        while defnScope is not None and \
-              not defnScope.isBound(name) and \
-              (not localOnly or self.isLocalWithin(defnScope)):
-            defnScope = defnScope.parent
-        if defnScope is None or (localOnly and not self.isLocalWithin(defnScope)):
+        Returns NameInfo. For overloaded symbols, there may be several functions in there.
+
+        The scope a name resolves to is cached until a new binding for the name is added
+        anywhere. Whether the name has been defined yet is checked on every lookup."""
+        key = (name, localOnly)
+        version = self.info.bindingVersions.get(name, 0)
+        resolved = self.resolvedNames.get(key)
+        if resolved is None or resolved[0] != version:
+            defnScope = self.findDefiningScope(name, localOnly)
+            isLocal = defnScope is not None and self.isLocalWithin(defnScope)
+            resolved = (version, defnScope, isLocal)
+            self.resolvedNames[key] = resolved
+        _, defnScope, isLocal = resolved
+
+        if defnScope is None:
             if mayBeAssignment and name.endswith("=") and name != "==":
                 return self.lookup(name[:-1], loc, localOnly=localOnly,
                                    mayBeAssignment=False, ignoreDefnOrder=ignoreDefnOrder)
             else:
                 raise ScopeException(loc, "%s: not found" % name)
         if not ignoreDefnOrder and \
-           not defnScope.isDefined(name) and \
-           self.isLocalWithin(defnScope):
+           isLocal and \
+           not defnScope.isDefined(name):
             raise ScopeException(loc, "%s: used before being defined" % name)
         return defnScope.bindings[name]
 
+    def findDefiningScope(self, name, localOnly):
+        """Returns the nearest enclosing scope where a symbol is bound, or None if there is no
+        such scope. If localOnly is true, only scopes this scope is local within are
+        searched."""
+        defnScope = self
+        while defnScope is not None and \
+              not defnScope.isBound(name) and \
+              (not localOnly or self.isLocalWithin(defnScope)):
+            defnScope = defnScope.parent
+        if defnScope is None or (localOnly and not self.isLocalWithin(defnScope)):
+            return None
+        return defnScope
+
     def isBound(self, name):
         """Returns true if a symbol is defined in this scope."""
         return self.getDefinition(name) is not None
@@ -627,7 +788,7 @@ class Scope(ast.AstNodeVisitor):
                                  defnInfo.irDefn.clas.name)
 
         useInfo = UseInfo(defnInfo, self.scopeId, useKind)
-        self.info.useInfo[useAstId] = useInfo
+        self.info.setUseInfo(useAstId, useInfo)
         return useInfo
 
     def resolveOverrides(self):
@@ -672,25 +833,32 @@ class Scope(ast.AstNodeVisitor):
         this will return the class itself."""
         raise NotImplementedError
 
-    def capture(self, useInfo):
+    def capture(self, useInfo, byValue=False):
         """Makes the named non-local value defined in defnScope accessible in this scope.
 
         If the value is defined in a scope without a context, a context is created for that
-        scope. The context is made available in this scope and all top scopes in between."""
+        scope. The context is made available in this scope and all top scopes in between.
+        If byValue is true, the value is copied into the closures of this scope and all
+        top scopes in between instead, and no context is needed."""
         defnInfo = useInfo.defnInfo
         defnScope = self.info.getScope(defnInfo.scopeId)
         useScope = self.topLocalScope(defnScope)
         if defnScope is useScope:
-            # Base case: need to capture the definition in a context.
-            defnScope.captureScopeContext()
-            irCtxClass = self.info.getContextInfo(defnScope.scopeId).irContextClass
-            defnScope.captureInContext(defnInfo, irCtxClass)
+            # Base case: need to capture the definition in a context. Values copied into
+            # closures stay where they are.
+            if not byValue:
+                defnScope.captureScopeContext()
+                irCtxClass = self.info.getContextInfo(defnScope.scopeId).irContextClass
+                defnScope.captureInContext(defnInfo, irCtxClass)
         else:
             # Recursive case: make sure the variable is captured and context is accessible in
             # parent scope. Then make it accessible in this scope.
-            useScope.parent.capture(useInfo)
+            useScope.parent.capture(useInfo, byValue)
             useScope.makeClosure()
-            useScope.closureCaptureContext(defnScope.scopeId)
+            if byValue:
+                useScope.closureCaptureValue(defnInfo.irDefn)
+            else:
+                useScope.closureCaptureContext(defnScope.scopeId)
 
     def captureScopeContext(self):
         """Makes this scope available for capturing.
@@ -725,6 +893,20 @@ class Scope(ast.AstNodeVisitor):
             irClosureClass.constructors[0].parameterTypes.append(irContextType)
             closureInfo.irClosureContexts[scopeId] = irContextField
 
+    def closureCaptureValue(self, irDefn):
+        """Ensures a closure class stores a copy of an immutable variable from a parent scope.
+
+        Returns the field containing the copy."""
+        assert not self.isLocal()
+        closureInfo = self.info.getClosureInfo(self.scopeId)
+        if id(irDefn) not in closureInfo.irClosureValues:
+            irClosureClass = closureInfo.irClosureClass
+            irValueField = ir.Field(irDefn.name, None, irDefn.type, irDefn.flags)
+            irClosureClass.fields.append(irValueField)
+            irClosureClass.constructors[0].parameterTypes.append(irDefn.type)
+            closureInfo.irClosureValues[id(irDefn)] = (irDefn, irValueField)
+        return closureInfo.irClosureValues[id(irDefn)][1]
+
     def localScope(self, ast):
         return self.getOrCreateScope(ast, self.newLocalScope)
 
@@ -947,7 +1129,7 @@ class FunctionScope(Scope):
     def makeClosure(self):
         # Check if the function is already a closure.
         assert not self.isLocal()
-        closureInfo = self.info.closureInfo[self.scopeId]
+        closureInfo = self.info.getClosureInfo(self.scopeId)
         if closureInfo.irClosureClass:
             return
 
@@ -1339,4 +1521,4 @@ def isInternalName(name):
     return name.startswith("$")
 
 __all__ = ["analyzeDeclarations","analyzeInheritance", "convertClosures",
-           "flattenClasses"]
+           "flattenClasses", "analyzeClassHierarchy"]
@@ -161,7 +161,7 @@ class Serializer(object):
             form = 9
             id = type.typeParameter.id
         flags = 0
-        if ir_types.NULLABLE_TYPE_FLAG in type.flags:
+        if type.isNullable():
             flags = flags | 1
         bits = form | flags << 4
         self.writeVbn(bits)
@@ -0,0 +1,40 @@
+# Copyright 2014, Jay Conrod. All rights reserved.
+#
+# This file is part of Gypsum. Use of this source code is governed by
+# the GPL license that can be found in the LICENSE.txt file.
+
+
+import unittest
+
+from ast import *
+from location import Location, NoLoc
+
+
+class TestAst(unittest.TestCase):
+    def testLocation(self):
+        loc = Location("foo.gy", 12, 3, 14, 100000)
+        node = AstVariableExpression("x", loc)
+        self.assertEqual(loc, node.location)
+        self.assertEqual("foo.gy", AstThisExpression(loc).location.fileName)
+
+    def testSpecialLocations(self):
+        self.assertIs(NoLoc, AstThisExpression(NoLoc).location)
+        self.assertIsNone(AstThisExpression(None).location)
+
+    def testSlots(self):
+        node = AstVariableExpression("x", NoLoc)
+        self.assertFalse(hasattr(node, "__dict__"))
+        self.assertFalse(hasattr(node, "id"))
+        node.id = 12
+        self.assertEqual(12, node.id)
+
+    def testEqualityIgnoresLocation(self):
+        a = AstBinaryExpression("+", AstVariableExpression("x", NoLoc),
+                                AstVariableExpression("y", NoLoc),
+                                Location("a", 1, 1, 1, 5))
+        b = AstBinaryExpression("+", AstVariableExpression("x", NoLoc),
+                                AstVariableExpression("y", NoLoc),
+                                Location("b", 2, 1, 2, 5))
+        self.assertEqual(a, b)
+        b.right.name = "z"
+        self.assertNotEqual(a, b)
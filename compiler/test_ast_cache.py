@@ -0,0 +1,87 @@
+# Copyright 2014, Jay Conrod. All rights reserved.
+#
+# This file is part of Gypsum. Use of this source code is governed by
+# the GPL license that can be found in the LICENSE.txt file.
+
+
+import shutil
+import tempfile
+import unittest
+
+from ast import *
+import ast_cache
+from ast_cache import AstCache
+from layout import layout
+from lexer import lex
+from location import NoLoc
+from parser import parse
+
+
+class TestAstCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = AstCache(self.directory, "test")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def parseSource(self, source):
+        return parse("foo.gy", layout(lex("foo.gy", source)))
+
+    def checkSame(self, expected, actual):
+        self.assertEqual(expected, actual)
+        self.assertEqual(expected.location, actual.location)
+        self.assertEqual(expected.id, actual.id)
+        for expectedChild, actualChild in zip(expected.children(), actual.children()):
+            if expectedChild is not None:
+                self.checkSame(expectedChild, actualChild)
+
+    def testEncodeDecode(self):
+        module = self.parseSource("class C[static T] <: B[T]\n" +
+                                  "  var x = 12.5\n" +
+                                  "def f(s: String) = if (true) \"foo\" else s")
+        self.checkSame(module, decodeAst(encodeAst(module)))
+
+    def testEncodeDecodeSpecialLocations(self):
+        node = AstBinaryExpression("+", AstVariableExpression("x", NoLoc),
+                                   AstVariableExpression("y", None), NoLoc)
+        decoded = decodeAst(encodeAst(node))
+        self.assertIs(NoLoc, decoded.location)
+        self.assertIsNone(decoded.right.location)
+        self.assertFalse(hasattr(decoded, "id"))
+
+    def testStoreLoad(self):
+        source = "def f(x: i64) = x + 1"
+        module = self.parseSource(source)
+        self.assertIsNone(self.cache.load("foo.gy", source))
+        self.cache.store("foo.gy", source, module)
+        self.checkSame(module, self.cache.load("foo.gy", source))
+
+    def testKeys(self):
+        source = "def f = 12"
+        self.cache.store("foo.gy", source, self.parseSource(source))
+        self.assertIsNone(self.cache.load("foo.gy", source + "\n"))
+        self.assertIsNone(self.cache.load("bar.gy", source))
+        self.assertIsNone(AstCache(self.directory, "other").load("foo.gy", source))
+
+    def testCorruptEntry(self):
+        source = "def f = 12"
+        self.cache.store("foo.gy", source, self.parseSource(source))
+        with open(self.cache.entryPath("foo.gy", source), "wb") as entryFile:
+            entryFile.write("garbage")
+        self.assertIsNone(self.cache.load("foo.gy", source))
+
+    def testFrontEndVersionCoversModules(self):
+        savedModules = ast_cache._FRONT_END_MODULES
+        savedVersion = ast_cache._frontEndVersion
+        try:
+            ast_cache._frontEndVersion = None
+            fullVersion = ast_cache.frontEndVersion()
+            ast_cache._FRONT_END_MODULES = [name for name in savedModules if name != "utils"]
+            ast_cache._frontEndVersion = None
+            self.assertNotEqual(fullVersion, ast_cache.frontEndVersion())
+        finally:
+            ast_cache._FRONT_END_MODULES = savedModules
+            ast_cache._frontEndVersion = savedVersion
+        for name in ("data", "utils"):
+            self.assertIn(name, ast_cache._FRONT_END_MODULES)
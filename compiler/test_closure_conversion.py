@@ -93,21 +93,49 @@ class TestClosureConversion(TestCaseWithDefinitions):
         C = info.package.findClass(name="C")
         CType = ClassType(C)
         fContextInfo = info.getContextInfo(cAst.members[0])
-        fContextClass = info.package.findClass(name="$context")
+        self.assertIsNone(fContextInfo.irContextClass)
         f = info.package.findFunction(name="f")
-        self.assertIs(fContextClass, fContextInfo.irContextClass)
-        self.assertEquals(1, len(fContextClass.constructors))
-        self.assertEquals([self.makeField("$this", type=CType, flags=frozenset([LET]))],
-                          fContextClass.fields)
+        fThis = f.variables[0]
+        self.assertEquals("$this", fThis.name)
         gClosureInfo = info.getClosureInfo(cAst.members[0].body.statements[0])
         gClosureClass = info.package.findClass(name="$closure")
         self.assertIs(gClosureClass, gClosureInfo.irClosureClass)
-        self.assertEquals({cAst.members[0].id: gClosureClass.fields[0]},
-                          gClosureInfo.irClosureContexts)
-        g = info.package.findFunction(name="g")
+        self.assertEquals({}, gClosureInfo.irClosureContexts)
+        self.assertEquals({id(fThis): (fThis, gClosureClass.fields[0])},
+                          gClosureInfo.irClosureValues)
         self.assertTrue(gClosureInfo.irClosureVar in f.variables)
         self.assertEquals(1, len(gClosureClass.constructors))
-        self.assertEquals([ClassType(gClosureClass), ClassType(fContextClass)],
+        self.assertEquals([ClassType(gClosureClass), CType],
                           gClosureClass.constructors[0].parameterTypes)
-        self.assertEquals([self.makeField("$context", type=ClassType(fContextClass))],
+        self.assertEquals([self.makeField("$this", type=CType, flags=frozenset([LET]))],
                           gClosureClass.fields)
+
+    def testCaptureVarParameter(self):
+        source = "def f(var x: i64) =\n" + \
+                 "  def g = x"
+        info = self.analyzeFromSource(source)
+        fAst = info.ast.definitions[0]
+        fContextClass = info.package.findClass(name="$context")
+        self.assertIs(fContextClass, info.getContextInfo(fAst).irContextClass)
+        self.assertEquals([self.makeField("x", type=I64Type)], fContextClass.fields)
+        gClosureInfo = info.getClosureInfo(fAst.body.statements[0])
+        gClosureClass = gClosureInfo.irClosureClass
+        self.assertEquals({fAst.id: gClosureClass.fields[0]}, gClosureInfo.irClosureContexts)
+        self.assertEquals({}, gClosureInfo.irClosureValues)
+
+    def testCaptureParameterByValueThroughClosures(self):
+        source = "def f(x: i64) =\n" + \
+                 "  def g =\n" + \
+                 "    def h = x"
+        info = self.analyzeFromSource(source)
+        fAst = info.ast.definitions[0]
+        self.assertIsNone(info.getContextInfo(fAst).irContextClass)
+        x = info.package.findFunction(name="f").variables[0]
+        gAst = fAst.body.statements[0]
+        hAst = gAst.body.statements[0]
+        for closureAst in (gAst, hAst):
+            closureInfo = info.getClosureInfo(closureAst)
+            self.assertEquals({}, closureInfo.irClosureContexts)
+            field = closureInfo.irClosureClass.fields[0]
+            self.assertEquals({id(x): (x, field)}, closureInfo.irClosureValues)
+            self.assertEquals(self.makeField("x", type=I64Type, flags=frozenset([LET])), field)
@@ -9,6 +9,7 @@ import unittest
 execfile("combinators.py")
 
 from tok import *
+from tok import TAG_CODES
 from lexer import *
 
 symbol = Tag(SYMBOL)
@@ -32,6 +33,18 @@ class TestCombinators(unittest.TestCase):
         value = result.value
         self.assertEqual(expected, value)
 
+    def testStreamReader(self):
+        tokens = (t for t in lex("test", "a b c") if tokenIsPrintable(t))
+        reader = Reader("test", tokens)
+        self.assertEqual(0, len(reader.tokens.buffer))
+        result = (symbol + symbol)(reader)
+        self.assertEqual(("a", "b"), result.value)
+        self.assertEqual(2, len(reader.tokens.buffer))
+        next = Reader("test", reader.tokens, result.next)
+        self.assertFalse(next.isEmpty())
+        self.assertTrue(next.next().isEmpty())
+        self.assertEqual(Location("test", 1, 5, 1, 6), next.next().location())
+
     def testReserved(self):
         parser = Reserved(RESERVED, "var")
         self.checkParse("var", parser, "var")
@@ -43,6 +56,27 @@ class TestCombinators(unittest.TestCase):
         result = parser(reader)
         self.assertFalse(result)
 
+    def testReservedFailure(self):
+        parser = symbol + Reserved(RESERVED, "var")
+        reader = makeReader("a def")
+        self.assertIs(FAIL, parser.parse(reader.tokens, reader.pos))
+        result = parser(reader)
+        self.assertEqual("expected var but found def", result.message)
+        self.assertEqual(Location("test", 1, 3, 1, 6), result.location)
+
+    def testEndOfFileFailure(self):
+        result = (symbol + symbol)(makeReader("a"))
+        self.assertEqual("unexpected end of file", result.message)
+        self.assertEqual(Location("test", 1, 1, 1, 2), result.location)
+
+    def testSuccessSpan(self):
+        parser = symbol + Opt(Reserved(RESERVED, "var"))
+        reader = makeReader("a b")
+        result = parser(reader)
+        self.assertEqual((0, 1, 1), (result.begin, result.end, result.next))
+        self.assertEqual(Location("test", 1, 1, 1, 4),
+                         reader.tokens.location(result.begin, result.end))
+
     def testTag(self):
         parser = symbol
         self.checkParse("xyz", parser, "xyz")
@@ -108,6 +142,42 @@ class TestCombinators(unittest.TestCase):
         self.assertFalse(result)
         self.assertEquals(False, result.retry)
 
+    def testChoiceFlattened(self):
+        a, b, c = Tag(SYMBOL), Reserved(RESERVED, "var"), Reserved(RESERVED, "def")
+        self.assertEqual([a, b, c], (a | (b | c)).parsers)
+
+    def testFirst(self):
+        var = Reserved(RESERVED, "var")
+        first = (Opt(var) + symbol).first()
+        self.assertEqual(frozenset([(TAG_CODES[RESERVED], "var")]), first.texts)
+        self.assertEqual(frozenset([TAG_CODES[SYMBOL]]), first.tags)
+        self.assertFalse(first.nullable)
+        self.assertTrue(Rep(symbol).first().nullable)
+        self.assertTrue((Opt(symbol) + Commit(var)).first().unknown)
+        self.assertFalse((var + Commit(symbol)).first().unknown)
+
+    def testChoiceSkipsBranches(self):
+        # Memo counts a miss each time a branch is tried.
+        parser = Memo(Reserved(RESERVED, "var") + symbol, "var") | \
+                 Memo(Reserved(RESERVED, "def") + symbol, "def") | \
+                 Memo(symbol, "symbol")
+        memo = MemoTable()
+        tokens = filter(tokenIsPrintable, lex("test", "def x"))
+        result = parser(Reader("test", TokenStream(tokens, memo)))
+        self.assertEqual(("def", "x"), result.value)
+        self.assertEqual({"def": 1}, memo.misses)
+
+    def testChoiceFailureFromLast(self):
+        parser = (Reserved(RESERVED, "var") + symbol) | Reserved(RESERVED, "def")
+        result = parser(makeReader("class"))
+        self.assertEqual("expected def but found class", result.message)
+
+    def testChoiceCommitTried(self):
+        parser = Commit(Reserved(RESERVED, "var")) | symbol
+        result = parser(makeReader("a"))
+        self.assertFalse(result)
+        self.assertEqual(False, result.retry)
+
     def testRepEmpty(self):
         parser = Rep(symbol)
         self.checkParse([], parser, "var")
@@ -123,6 +193,31 @@ class TestCombinators(unittest.TestCase):
         self.assertFalse(result)
         self.assertEqual(False, result.retry)
 
+    def testCommittedRepReleasesTokens(self):
+        text = " ".join("a%d" % i for i in xrange(2000))
+        bufferSizes = []
+        def readTokens():
+            for token in lex("test", text):
+                if tokenIsPrintable(token):
+                    bufferSizes.append(len(stream.buffer))
+                    yield token
+        stream = TokenStream(readTokens())
+        parser = Phrase(CommittedRep(symbol)) ^ (lambda p, loc: (p, loc))
+        result = parser(Reader("test", stream))
+        names, loc = result.value
+        self.assertEqual(2000, len(names))
+        self.assertEqual("a1999", names[-1])
+        self.assertEqual(Location("test", 1, 1, 1, len(text) + 1), loc)
+        self.assertTrue(max(bufferSizes) < 1000)
+
+    def testCommittedRepKeepsListTokens(self):
+        tokens = filter(tokenIsPrintable, lex("test", " ".join(["a"] * 1000)))
+        stream = TokenStream(tokens)
+        result = CommittedRep(symbol)(Reader("test", stream))
+        self.assertEqual(1000, len(result.value))
+        self.assertEqual(0, stream.base)
+        self.assertEqual(1000, len(stream.buffer))
+
     def testRep1Empty(self):
         parser = Rep1(symbol)
         reader = makeReader("")
@@ -156,6 +251,92 @@ class TestCombinators(unittest.TestCase):
         parser = LeftRec(symbol, Opt(Reserved(RESERVED, ",") + symbol), combine)
         self.checkParse("abc", parser, "a,b,c")
 
+    def testRule(self):
+        calls = []
+        @rule
+        def kw(text):
+            calls.append(text)
+            return Reserved(RESERVED, text)
+        self.assertIs(kw("var"), kw("var"))
+        self.assertIsNot(kw("var"), kw("def"))
+        self.assertEqual(["var", "def"], calls)
+        self.checkParse("var", kw("var"), "var")
+
+    def testLazyRuleShared(self):
+        @rule
+        def sym():
+            return Tag(SYMBOL)
+        first = Lazy(sym)
+        second = Lazy(sym)
+        self.checkParse("a", first, "a")
+        self.checkParse("b", second, "b")
+        self.assertIs(first.parser, second.parser)
+
+    def testMemoWithoutTable(self):
+        parser = Memo(symbol, "symbol")
+        self.checkParse("a", parser, "a")
+
+    def testMemo(self):
+        sym = Memo(symbol, "symbol")
+        parser = (sym + Reserved(RESERVED, "var")) | (sym + symbol)
+        memo = MemoTable()
+        tokens = filter(tokenIsPrintable, lex("test", "a b"))
+        result = parser(Reader("test", TokenStream(tokens, memo)))
+        self.assertEqual(("a", "b"), result.value)
+        self.assertEqual(1, memo.hits["symbol"])
+        self.assertEqual(1, memo.misses["symbol"])
+        self.assertEqual(0.5, memo.hitRate("symbol"))
+        self.assertEqual([("symbol", 1, 1, 0.5)], memo.stats())
+
+    def testMemoEvictAtCommit(self):
+        sym = Memo(symbol, "symbol")
+        parser = Rep(sym + Commit(sym))
+        memo = MemoTable()
+        tokens = filter(tokenIsPrintable, lex("test", "a b c d"))
+        result = parser(Reader("test", TokenStream(tokens, memo)))
+        self.assertEqual([("a", "b"), ("c", "d")], result.value)
+        self.assertEqual(3, memo.low)
+        self.assertEqual([3, 4], sorted(memo.entries.keys()))
+
+    def testMemoLeftRec(self):
+        def combine(sym, next, loc):
+            return sym + next[1]
+        suffix = Memo(Reserved(RESERVED, ",") + symbol, "suffix")
+        parser = LeftRec(symbol, suffix, combine) + Reserved(RESERVED, ";") | \
+                 LeftRec(symbol, suffix, combine)
+        memo = MemoTable()
+        tokens = filter(tokenIsPrintable, lex("test", "a,bb,cc"))
+        result = parser(Reader("test", TokenStream(tokens, memo)))
+        self.assertEqual("abbcc", result.value)
+        self.assertEqual(3, memo.hits["suffix"])
+
+    def checkPrecedence(self, expected, text):
+        def precedenceOf(op):
+            return {"*": 0, "+": 1, "::": 2}[op]
+        def process(chain, _):
+            if chain[1][0] == "::":
+                result = chain[-1][1]
+                for i in range(len(chain) - 1, 0, -1):
+                    result = (chain[i - 1][1], chain[i][0], result)
+            else:
+                result = chain[0][1]
+                for op, term in chain[1:]:
+                    result = (result, op, term)
+            return result
+        parser = Precedence(symbol, OPERATOR, precedenceOf, process)
+        tokens = [t for t in lex("test", text) if t.tag in [SYMBOL, OPERATOR]]
+        result = parser(Reader("test", tokens))
+        self.assertEqual(expected, (result.value, result.next))
+
+    def testPrecedence(self):
+        self.checkPrecedence(("a", 1), "a")
+        self.checkPrecedence(((("a", "+", ("b", "*", "c")), "+", "d"), 7), "a + b * c + d")
+        self.checkPrecedence((("a", "::", ("b", "::", ("c", "+", "d"))), 7), "a :: b :: c + d")
+
+    def testPrecedenceMissingOperand(self):
+        self.checkPrecedence((("a", "+", "b"), 3), "a + b *")
+        self.checkPrecedence(("a", 1), "a +")
+
     def testUntangle(self):
         tangled = (1, (2, (3, 4), 5))
         self.assertEqual([1, 2, 3, 4, 5], untangle(tangled))
@@ -0,0 +1,72 @@
+# Copyright 2014, Jay Conrod. All rights reserved.
+#
+# This file is part of Gypsum. Use of this source code is governed by
+# the GPL license that can be found in the LICENSE.txt file.
+
+
+import unittest
+
+from ast import AstVariableExpression
+from builtins import getRootClass
+from bytecode import BUILTIN_ROOT_CLASS_ID, BUILTIN_ROOT_CLASS_CTOR_ID
+from compile_info import *
+from ir import Function
+from ir_types import UnitType
+from location import NoLoc
+
+
+class TestSideTable(unittest.TestCase):
+    def makeNode(self, id):
+        node = AstVariableExpression("x", NoLoc)
+        node.id = id
+        return node
+
+    def testNodesAndIds(self):
+        table = SideTable()
+        node = self.makeNode(12)
+        self.assertFalse(table.has(node))
+        table.set(node, "foo")
+        self.assertTrue(table.has(node))
+        self.assertTrue(table.has(12))
+        self.assertEqual("foo", table.get(12))
+        self.assertFalse(table.has(11))
+        self.assertFalse(table.has(100))
+        self.assertRaises(KeyError, table.get, 11)
+        self.assertRaises(KeyError, table.get, 100)
+
+    def testDefinitionsShareNodeEntries(self):
+        table = SideTable()
+        node = self.makeNode(3)
+        function = Function("f", node, None, UnitType, [], [], [], None, frozenset())
+        table.set(function, "foo")
+        self.assertEqual("foo", table.get(node))
+
+    def testBuiltinIdSpaces(self):
+        table = SideTable()
+        rootClass = getRootClass()
+        ctor = rootClass.constructors[0]
+        self.assertEqual(BUILTIN_ROOT_CLASS_ID, BUILTIN_ROOT_CLASS_CTOR_ID)
+        table.set(rootClass, "class")
+        table.set(ctor, "ctor")
+        self.assertEqual("class", table.get(rootClass))
+        self.assertEqual("class", table.get(BUILTIN_ROOT_CLASS_ID))
+        self.assertEqual("ctor", table.get(ctor))
+        self.assertFalse(table.has(0))
+
+    def testIteration(self):
+        table = SideTable()
+        table.set(5, "b")
+        table.set(getRootClass(), "c")
+        table.set(1, "a")
+        self.assertEqual([1, 5, BUILTIN_ROOT_CLASS_ID], table.keys())
+        self.assertEqual(["a", "b", "c"], table.values())
+
+
+class TestCompileInfo(unittest.TestCase):
+    def testAccessors(self):
+        info = CompileInfo(None)
+        info.setType(4, UnitType)
+        self.assertTrue(info.hasType(4))
+        self.assertIs(UnitType, info.getType(4))
+        self.assertFalse(info.hasScope(4))
+        self.assertEqual([4], info.typeInfo.keys())
@@ -38,6 +38,7 @@ class TestCompiler(TestCaseWithDefinitions):
         analyzeTypes(info)
         convertClosures(info)
         flattenClasses(info)
+        analyzeClassHierarchy(info)
         compile(info)
         return info.package
 
@@ -1252,12 +1253,11 @@ class TestCompiler(TestCaseWithDefinitions):
         package = self.compileFromSource(source)
         clas = package.findClass(name="Foo")
         method = package.findFunction(name="get")
-        index = clas.getMethodIndex(method)
         objType = ClassType(clas, ())
         self.checkFunction(package,
                            self.makeSimpleFunction("f", I64Type, [[
                                ldlocal(0),
-                               callv(1, index),
+                               callg(method.id),
                                ret()
                              ]],
                              variables=[self.makeVariable("foo", type=objType,
@@ -1275,7 +1275,6 @@ class TestCompiler(TestCaseWithDefinitions):
                            self.makeSimpleFunction("g", I64Type, [[
                                ldlocal(0),
                                ldpc(0),
-                               ldpc(0),
                                ld64(0),
                                ret()
                              ]],
@@ -1288,6 +1287,39 @@ class TestCompiler(TestCaseWithDefinitions):
                  "  def bar = x\n" + \
                  "  bar"
         package = self.compileFromSource(source)
+        self.assertRaises(StopIteration, package.findClass, name="$context")
+        closureClass = package.findClass(name="$closure")
+        closureType = ClassType(closureClass)
+        self.checkFunction(package,
+                           self.makeSimpleFunction("foo", I64Type, [[
+                               allocobj(closureClass.id),
+                               dup(),
+                               ldlocal(0),
+                               callg(closureClass.constructors[0].id),
+                               drop(),
+                               stlocal(-1),
+                               ldlocal(-1),
+                               callg(package.findFunction(name="bar").id),
+                               ret()]],
+                             variables=[self.makeVariable("x", type=I64Type, kind=PARAMETER,
+                                                          flags=frozenset([LET])),
+                                        self.makeVariable("bar", type=closureType)],
+                             parameterTypes=[I64Type]))
+        self.checkFunction(package,
+                           self.makeSimpleFunction("bar", I64Type, [[
+                               ldlocal(0),
+                               ld64(0),
+                               ret()]],
+                             variables=[self.makeVariable("$this", type=closureType,
+                                                          kind=PARAMETER,
+                                                          flags=frozenset([LET]))],
+                             parameterTypes=[closureType]))
+
+    def testCallClosureWithContext(self):
+        source = "def foo(var x: i64) =\n" + \
+                 "  def bar = x\n" + \
+                 "  bar"
+        package = self.compileFromSource(source)
         contextClass = package.findClass(name="$context")
         contextType = ClassType(contextClass)
         closureClass = package.findClass(name="$closure")
@@ -1309,7 +1341,7 @@ class TestCompiler(TestCaseWithDefinitions):
                                drop(),
                                stlocal(-2),
                                ldlocal(-2),
-                               callv(1, len(closureClass.methods) - 1),
+                               callg(package.findFunction(name="bar").id),
                                ret()]],
                              variables=[self.makeVariable("$context", type=contextType),
                                         self.makeVariable("bar", type=closureType)],
@@ -1465,34 +1497,22 @@ class TestCompiler(TestCaseWithDefinitions):
         T = package.findTypeParameter(name="T")
         Tty = VariableType(T)
         idOuter = package.findFunction(name="id-outer")
-        contextClass = package.findClass(name="$context")
         closureClass = package.findClass(name="$closure")
         idInner = package.findFunction(name="id-inner")
-        idInnerMethodIndex = closureClass.getMethodIndex(idInner)
         expected = self.makeSimpleFunction("id-outer", Tty, [[
-            tyv(T.id),
-            allocobj(contextClass.id),
-            dup(),
-            tyv(T.id),
-            callg(contextClass.constructors[0].id),
-            drop(),
-            stlocal(-1),
-            ldlocal(0),
-            ldlocal(-1),
-            stp(0),
             tyv(T.id),
             allocobj(closureClass.id),
             dup(),
-            ldlocal(-1),
+            ldlocal(0),
             tyv(T.id),
             callg(closureClass.constructors[0].id),
             drop(),
-            stlocal(-2),
-            ldlocal(-2),
+            stlocal(-1),
+            ldlocal(-1),
             tyv(T.id),
-            callv(1, idInnerMethodIndex),
+            callg(idInner.id),
             ret()]],
-          variables=[self.makeVariable("$context", type=ClassType(contextClass)),
+          variables=[self.makeVariable("x", type=Tty, kind=PARAMETER, flags=frozenset([LET])),
                      self.makeVariable("id-inner", type=ClassType(closureClass))],
           typeParameters=[T],
           parameterTypes=[Tty])
@@ -1531,11 +1551,10 @@ class TestCompiler(TestCaseWithDefinitions):
         Foo = package.findClass(name="Foo")
         FooType = ClassType(Foo, (getRootClassType(),))
         toString = Foo.getMethod("to-string")
-        toStringIndex = Foo.getMethodIndex(toString)
         expected = self.makeSimpleFunction("f", UnitType, [[
             ldlocal(0),
             tyc(BUILTIN_ROOT_CLASS_ID),
-            callv(1, toStringIndex),
+            callg(toString.id),
             drop(),
             unit(),
             ret()]],
@@ -1566,6 +1585,92 @@ class TestCompiler(TestCaseWithDefinitions):
           parameterTypes=[Ctype])
         self.assertEquals(expectedCtor, C.constructors[0])
 
+    def testCallMethodsOnThis(self):
+        source = "class A\n" + \
+                 "  def f = 12\n" + \
+                 "  def g = 34\n" + \
+                 "  def callF = f\n" + \
+                 "  def callG = this.g\n" + \
+                 "class B <: A\n" + \
+                 "  def g = 56\n"
+        package = self.compileFromSource(source)
+        A = package.findClass(name="A")
+        AType = ClassType(A)
+        f = A.getMethod("f")
+        g = A.getMethod("g")
+        variables = [self.makeVariable("$this", type=AType,
+                                       kind=PARAMETER, flags=frozenset([LET]))]
+        self.checkFunction(package,
+                           self.makeSimpleFunction("callF", I64Type, [[
+                               ldlocal(0),
+                               callg(f.id),
+                               ret()
+                             ]],
+                             variables=variables,
+                             parameterTypes=[AType]))
+        self.checkFunction(package,
+                           self.makeSimpleFunction("callG", I64Type, [[
+                               ldlocal(0),
+                               callv(1, A.getMethodIndex(g)),
+                               ret()
+                             ]],
+                             variables=variables,
+                             parameterTypes=[AType]))
+
+    def testCallMethodsOnExplicitReceivers(self):
+        source = "class A\n" + \
+                 "  def f = 12\n" + \
+                 "  def g = 34\n" + \
+                 "class B <: A\n" + \
+                 "  def g = 56\n" + \
+                 "def callF(a: A) = a.f\n" + \
+                 "def callG(a: A) = a.g\n" + \
+                 "def callNullable(a: A?) = a.f\n" + \
+                 "def callNew = A().f"
+        package = self.compileFromSource(source)
+        A = package.findClass(name="A")
+        AType = ClassType(A)
+        ANullableType = ClassType(A, (), NULLABLE_TYPE_FLAG)
+        f = A.getMethod("f")
+        g = A.getMethod("g")
+        self.checkFunction(package,
+                           self.makeSimpleFunction("callF", I64Type, [[
+                               ldlocal(0),
+                               callg(f.id),
+                               ret()
+                             ]],
+                             variables=[self.makeVariable("a", type=AType, kind=PARAMETER,
+                                                          flags=frozenset([LET]))],
+                             parameterTypes=[AType]))
+        self.checkFunction(package,
+                           self.makeSimpleFunction("callG", I64Type, [[
+                               ldlocal(0),
+                               callv(1, A.getMethodIndex(g)),
+                               ret()
+                             ]],
+                             variables=[self.makeVariable("a", type=AType, kind=PARAMETER,
+                                                          flags=frozenset([LET]))],
+                             parameterTypes=[AType]))
+        self.checkFunction(package,
+                           self.makeSimpleFunction("callNullable", I64Type, [[
+                               ldlocal(0),
+                               callv(1, A.getMethodIndex(f)),
+                               ret()
+                             ]],
+                             variables=[self.makeVariable("a", type=ANullableType,
+                                                          kind=PARAMETER,
+                                                          flags=frozenset([LET]))],
+                             parameterTypes=[ANullableType]))
+        self.checkFunction(package,
+                           self.makeSimpleFunction("callNew", I64Type, [[
+                               allocobj(A.id),
+                               dup(),
+                               callg(A.constructors[0].id),
+                               drop(),
+                               callg(f.id),
+                               ret()
+                             ]]))
+
     def testCallClassMethodsWithStaticTypeArgs(self):
         source = "class C\n" + \
                  "class Box[static T](var val: T)\n" + \
@@ -1585,9 +1690,9 @@ class TestCompiler(TestCaseWithDefinitions):
             ldlocal(0),
             ldlocal(0),
             tyc(C.id),
-            callv(1, Box.getMethodIndex(get)),
+            callg(get.id),
             tyc(C.id),
-            callv(2, Box.getMethodIndex(set)),
+            callg(set.id),
             ret()]],
           variables=[self.makeVariable("box", type=boxType,
                                        kind=PARAMETER, flags=frozenset([LET]))],
@@ -0,0 +1,91 @@
+# Copyright 2014, Jay Conrod. All rights reserved.
+#
+# This file is part of Gypsum. Use of this source code is governed by
+# the GPL license that can be found in the LICENSE.txt file.
+
+
+import unittest
+
+from data import Data
+
+
+class Point(Data):
+    propertyNames = ("x", "y")
+
+
+class NamedPoint(Point):
+    propertyNames = Point.propertyNames + ("name", "note")
+    skipCompareNames = ("note",)
+
+
+class CustomPoint(Point):
+    def __init__(self, x):
+        super(CustomPoint, self).__init__(x, 0)
+
+    def __eq__(self, other):
+        return isinstance(other, Point) and self.x == other.x
+
+
+class CustomPointChild(CustomPoint):
+    propertyNames = Point.propertyNames + ("z",)
+
+
+class ExtraPoint(Point):
+    __slots__ = ["__dict__"]
+
+
+class InternedPoint(Data):
+    propertyNames = ("x", "y")
+    interned = True
+
+
+class TestData(unittest.TestCase):
+    def testInit(self):
+        p = Point(1, y=2)
+        self.assertEqual(1, p.x)
+        self.assertEqual(2, p.y)
+        self.assertRaises(TypeError, Point, 1)
+        self.assertRaises(TypeError, Point, 1, 2, 3)
+
+    def testEquality(self):
+        self.assertEqual(Point(1, 2), Point(1, 2))
+        self.assertNotEqual(Point(1, 2), Point(1, 3))
+        self.assertNotEqual(Point(1, 2), NamedPoint(1, 2, "p", None))
+        self.assertEqual(hash(Point(1, 2)), hash(Point(1, 2)))
+
+    def testSkipCompareNames(self):
+        a = NamedPoint(1, 2, "p", "a")
+        b = NamedPoint(1, 2, "p", "b")
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertNotEqual(a, NamedPoint(1, 2, "q", "a"))
+
+    def testSlots(self):
+        self.assertEqual(("x", "y"), Point.__slots__)
+        self.assertEqual(("name", "note"), NamedPoint.__slots__)
+        p = Point(1, 2)
+        self.assertFalse(hasattr(p, "__dict__"))
+        with self.assertRaises(AttributeError):
+            p.z = 3
+
+    def testExtraSlots(self):
+        p = ExtraPoint(1, 2)
+        p.z = 3
+        self.assertEqual(3, p.z)
+
+    def testHandwrittenMethodsKept(self):
+        self.assertEqual(CustomPoint(1), Point(1, 5))
+        self.assertEqual(CustomPointChild(1), Point(1, 5))
+        self.assertEqual(0, CustomPointChild(1).y)
+
+    def testInterned(self):
+        self.assertNotIn("__eq__", InternedPoint.__dict__)
+        p = InternedPoint(1, 2)
+        self.assertEqual(p, p)
+        self.assertNotEqual(p, InternedPoint(1, 2))
+
+    def testMakeClass(self):
+        Pair = Data.makeClass("Pair", ("first", "second"))
+        self.assertEqual("Pair", Pair.__name__)
+        self.assertEqual(Pair(1, 2), Pair(1, 2))
+        self.assertEqual("Pair(1, 2)", repr(Pair(1, 2)))
@@ -32,6 +32,7 @@ class TestFlattenClasses(unittest.TestCase):
         analyzeTypes(info)
         convertClosures(info)
         flattenClasses(info)
+        analyzeClassHierarchy(info)
         return info
 
     def testSimpleClass(self):
@@ -71,3 +72,22 @@ class TestFlattenClasses(unittest.TestCase):
                  "  abstract def f: i64\n" + \
                  "class B <: A"
         self.assertRaises(ScopeException, self.analyzeFromSource, source)
+
+    def testMethodsNotOverridden(self):
+        source = "class A\n" + \
+                 "  def f = 12\n" + \
+                 "  def g = 34\n" + \
+                 "class B <: A\n" + \
+                 "  def g = 56\n" + \
+                 "class C <: B\n" + \
+                 "abstract class D\n" + \
+                 "  abstract def h: i64\n"
+        info = self.analyzeFromSource(source)
+        A = info.package.findClass(name="A")
+        B = info.package.findClass(name="B")
+        D = info.package.findClass(name="D")
+        self.assertTrue(hasattr(A.getMethod("f"), "isNotOverridden"))
+        self.assertFalse(hasattr(A.getMethod("g"), "isNotOverridden"))
+        self.assertTrue(hasattr(B.getMethod("g"), "isNotOverridden"))
+        self.assertFalse(hasattr(D.getMethod("h"), "isNotOverridden"))
+        self.assertFalse(hasattr(A.constructors[0], "isNotOverridden"))
@@ -8,6 +8,8 @@ import unittest
 
 execfile("ir.py")
 
+import ir
+
 from builtins import registerBuiltins, getNothingClass
 from ir_types import *
 from utils_test import TestCaseWithDefinitions
@@ -110,3 +112,123 @@ class TestIr(TestCaseWithDefinitions):
         B = self.makeClass("B", supertypes=[ClassType(A)])
         C = self.makeClass("C", supertypes=[ClassType(B)])
         self.assertEquals([B, A], C.findClassPathToBaseClass(A))
+
+    def testFindPathToBaseClassDeep(self):
+        classes = [self.base]
+        for i in xrange(3000):
+            classes.append(self.makeClass("C%d" % i, supertypes=[ClassType(classes[-1])]))
+        leaf = classes[-1]
+        self.assertTrue(leaf.isSubclassOf(self.base))
+        self.assertFalse(leaf.isSubclassOf(self.A))
+        self.assertEquals(3000, leaf.findDistanceToBaseClass(self.base))
+        self.assertEquals(list(reversed(classes[:-1])),
+                          leaf.findClassPathToBaseClass(self.base))
+
+    def testIsSubclassOf(self):
+        C = self.makeClass("C", supertypes=[ClassType(self.A)])
+        self.assertTrue(C.isSubclassOf(C))
+        self.assertTrue(C.isSubclassOf(self.A))
+        self.assertTrue(C.isSubclassOf(self.base))
+        self.assertFalse(C.isSubclassOf(self.B))
+        self.assertFalse(self.A.isSubclassOf(C))
+        self.assertTrue(getNothingClass().isSubclassOf(C))
+        self.assertFalse(C.isSubclassOf(getNothingClass()))
+
+    def testFindCommonBaseClass(self):
+        C = self.makeClass("C", supertypes=[ClassType(self.A)])
+        D = self.makeClass("D", supertypes=[ClassType(C)])
+        self.assertIs(self.base, D.findCommonBaseClass(self.B))
+        self.assertIs(self.A, self.A.findCommonBaseClass(D))
+        self.assertIs(C, D.findCommonBaseClass(C))
+        self.assertIs(D, D.findCommonBaseClass(getNothingClass()))
+
+    def testInvalidateClassHierarchy(self):
+        C = self.makeClass("C", supertypes=[ClassType(self.A)])
+        self.assertTrue(C.isSubclassOf(self.A))
+        C.supertypes = [ClassType(self.B)]
+        ir.invalidateClassHierarchy()
+        self.assertFalse(C.isSubclassOf(self.A))
+        self.assertTrue(C.isSubclassOf(self.B))
+
+    def testMemberIndex(self):
+        f = self.makeFunction("f")
+        g = self.makeFunction("g")
+        x = self.makeField("x")
+        C = self.makeClass("C", supertypes=[ClassType(self.base)],
+                           methods=[f, g], fields=[x])
+        self.assertEquals(1, C.getMethodIndex(g))
+        self.assertEquals(0, C.getFieldIndex(x))
+        self.assertIs(f, C.getMethod("f"))
+        self.assertIs(x, C.getField("x"))
+        self.assertIs(g, C.getMember("g"))
+        self.assertIsNone(C.getMember("y"))
+        self.assertRaises(KeyError, C.getMethodIndex, self.makeFunction("f"))
+
+    def testMemberIndexUpdated(self):
+        f = self.makeFunction("f")
+        g = self.makeFunction("g")
+        C = self.makeClass("C", supertypes=[ClassType(self.base)], methods=[f])
+        self.assertEquals(0, C.getMethodIndex(f))
+        C.methods.append(g)
+        self.assertEquals(1, C.getMethodIndex(g))
+        C.methods = [g, f]
+        self.assertEquals(1, C.getMethodIndex(f))
+        h = self.makeFunction("h")
+        C.methods[0] = h
+        C.buildMemberIndex()
+        self.assertEquals(0, C.getMethodIndex(h))
+        self.assertIs(h, C.getMethod("h"))
+        self.assertRaises(KeyError, C.getMethodIndex, g)
+
+
+class TestPackage(unittest.TestCase):
+    def setUp(self):
+        self.package = Package()
+
+    def addFunction(self, name, flags=frozenset()):
+        return self.package.addFunction(name, None, UnitType, [], [], [], None, flags)
+
+    def testFindOrAddString(self):
+        self.assertEquals(0, self.package.findOrAddString(u"foo"))
+        self.assertEquals(1, self.package.findOrAddString(u"bar"))
+        self.assertEquals(0, self.package.findOrAddString(u"foo"))
+        self.package.strings.append(u"baz")
+        self.assertEquals(2, self.package.findOrAddString(u"baz"))
+        self.assertEquals([u"foo", u"bar", u"baz"], self.package.strings)
+
+    def testFindOrAddStringAfterDuplicateAppended(self):
+        self.package.strings.extend([u"foo", u"bar", u"foo"])
+        self.assertEquals(0, self.package.findOrAddString(u"foo"))
+        self.assertEquals(3, self.package.indexedStringCount)
+        self.assertEquals(3, self.package.findOrAddString(u"baz"))
+        self.assertEquals(1, self.package.findOrAddString(u"bar"))
+        self.assertEquals(4, self.package.indexedStringCount)
+        self.assertEquals([u"foo", u"bar", u"foo", u"baz"], self.package.strings)
+
+    def testFindByName(self):
+        f = self.addFunction("f")
+        g = self.addFunction("g")
+        self.assertIs(g, self.package.findFunction(name="g"))
+        f2 = self.addFunction("f", frozenset([flags.ABSTRACT]))
+        self.assertEquals([f, f2], list(self.package.find(self.package.functions,
+                                                          {"name": "f"})))
+        self.assertIs(f2, self.package.findFunction(name="f", flag=flags.ABSTRACT))
+        self.assertRaises(StopIteration, self.package.findFunction, name="h")
+
+    def testFindByFlag(self):
+        self.addFunction("f")
+        self.assertRaises(StopIteration, self.package.findFunction, flag=flags.ABSTRACT)
+        g = self.addFunction("g", frozenset([flags.ABSTRACT]))
+        self.assertIs(g, self.package.findFunction(flag=flags.ABSTRACT))
+
+    def testFindByClass(self):
+        C = self.package.addClass("C", None, [], [getRootClassType()], None, [], [], [],
+                                  frozenset())
+        f = self.addFunction("f")
+        g = self.addFunction("g")
+        self.assertRaises(StopIteration, self.package.findFunction, clas=C)
+        g.clas = C
+        f.clas = C
+        C.methods = [g, f]
+        self.assertEquals([f, g], list(self.package.find(self.package.functions,
+                                                         {"clas": C})))
@@ -4,7 +4,9 @@
 # the GPL license that can be found in the LICENSE.txt file.
 
 
+import gc
 import unittest
+import weakref
 
 from builtins import *
 from ir import *
@@ -14,6 +16,12 @@ from location import *
 from errors import * #For TypeException
 from utils import *
 from flags import * # For CONTRAVARIANT and COVARIANT
+from lexer import lex
+from layout import layout
+from parser import parse
+from compile_info import CompileInfo
+from scope_analysis import analyzeDeclarations, analyzeInheritance
+from type_analysis import analyzeTypes
 from utils_test import TestCaseWithDefinitions
 
 
@@ -29,6 +37,7 @@ class TestIrTypes(TestCaseWithDefinitions):
         self.Y = self.makeTypeParameter("Y")
         self.P = self.makeClass("P", typeParameters=[self.X, self.Y],
                                 supertypes=[getRootClassType()])
+        clearTypeRelationCaches()
 
     def tearDown(self):
         super(TestIrTypes, self).tearDown()
@@ -181,6 +190,25 @@ class TestIrTypes(TestCaseWithDefinitions):
         self.assertEquals(ClassType(A, (ClassType(C),)),
                           VariableType(V).substituteForBaseClass(A))
 
+    def testSubstituteForInheritance(self):
+        T = self.makeTypeParameter("T")
+        A = self.makeClass("A", typeParameters=[T], supertypes=[getRootClassType()])
+        U = self.makeTypeParameter("U")
+        B = self.makeClass("B", typeParameters=[U],
+                           supertypes=[ClassType(A, (ClassType(self.P, (VariableType(U),
+                                                                        ClassType(self.A))),))])
+        W = self.makeTypeParameter("W")
+        C = self.makeClass("C", typeParameters=[W],
+                           supertypes=[ClassType(B, (VariableType(W),))])
+        expected = ClassType(self.P, (VariableType(W), ClassType(self.A)))
+        self.assertEquals((expected,), C.getBaseClassTypeArguments(A))
+        self.assertIs(C.getBaseClassTypeArguments(A), C.getBaseClassTypeArguments(A))
+        self.assertIsNone(C.getBaseClassTypeArguments(self.A))
+        self.assertIs(expected, VariableType(T).substituteForInheritance(C, A))
+        self.assertIs(VariableType(T), VariableType(T).substituteForInheritance(A, A))
+        self.assertIs(ClassType(A, (ClassType(self.P, (ClassType(self.B), ClassType(self.A))),)),
+                      ClassType(C, (ClassType(self.B),)).substituteForBaseClass(A))
+
     def testCombineNothing(self):
         aTy = ClassType(self.A)
         nothingTy = getNothingClassType()
@@ -190,7 +218,7 @@ class TestIrTypes(TestCaseWithDefinitions):
     def testCombineNull(self):
         aTy = ClassType(self.A)
         nullTy = getNullType()
-        aNullTy = ClassType(self.A, (), frozenset([NULLABLE_TYPE_FLAG]))
+        aNullTy = ClassType(self.A, (), NULLABLE_TYPE_FLAG)
         self.assertEquals(aNullTy, aTy.combine(nullTy, NoLoc))
         self.assertEquals(aNullTy, nullTy.combine(aTy, NoLoc))
 
@@ -199,3 +227,86 @@ class TestIrTypes(TestCaseWithDefinitions):
         pyx = ClassType(self.P, (VariableType(self.Y), VariableType(self.X)))
         self.assertEquals(pxy, pxy.combine(pxy, NoLoc))
         self.assertEquals(self.P.supertypes[0], pxy.combine(pyx, NoLoc))
+
+    def testInterned(self):
+        self.assertIs(ClassType(self.A), ClassType(self.A, [], None))
+        self.assertIsNot(ClassType(self.A), ClassType(self.B))
+        pxy = ClassType(self.P, (VariableType(self.X), VariableType(self.Y)))
+        self.assertIs(pxy, ClassType(self.P, [VariableType(self.X), VariableType(self.Y)]))
+        self.assertIsNot(pxy, ClassType(self.P, (VariableType(self.Y), VariableType(self.X))))
+        self.assertIs(VariableType(self.X), VariableType(self.X, 0))
+
+    def testFlags(self):
+        aTy = ClassType(self.A)
+        aNullTy = aTy.withFlag(NULLABLE_TYPE_FLAG)
+        self.assertIs(ClassType(self.A, (), NULLABLE_TYPE_FLAG), aNullTy)
+        self.assertTrue(aNullTy.isNullable())
+        self.assertFalse(aTy.isNullable())
+        self.assertIs(aTy, aNullTy.withoutFlag(NULLABLE_TYPE_FLAG))
+        self.assertNotEqual(VariableType(self.X), VariableType(self.X, NULLABLE_TYPE_FLAG))
+        self.assertEqual(["nullable"], getFlagNames(aNullTy.flags))
+
+    def testSubtypeAgreesWithLub(self):
+        types = [ClassType(self.A), ClassType(self.B), ClassType(self.C),
+                 ClassType(self.B, (), NULLABLE_TYPE_FLAG),
+                 VariableType(self.X), VariableType(self.Y),
+                 ClassType(self.P, (ClassType(self.A), ClassType(self.B))),
+                 ClassType(self.P, (ClassType(self.B), ClassType(self.B))),
+                 getRootClassType(), getNothingClassType(), UnitType, I64Type,
+                 NoType]
+        for left in types:
+            for right in types:
+                self.assertEquals(left.lub(right) is right, left.isSubtypeOf(right),
+                                  "%s <: %s" % (left, right))
+
+    def testTypeRelationCacheStats(self):
+        aTy = ClassType(self.A)
+        cTy = ClassType(self.C)
+        hits, misses = [(h, m) for name, h, m, _ in getTypeRelationCacheStats()
+                         if name == "isSubtypeOf"][0]
+        self.assertTrue(cTy.isSubtypeOf(aTy))
+        self.assertTrue(cTy.isSubtypeOf(aTy))
+        self.assertFalse(aTy.isSubtypeOf(cTy))
+        stats = dict((name, (hits, misses)) for name, hits, misses, _
+                     in getTypeRelationCacheStats())
+        self.assertEquals((hits + 1, misses + 2), stats["isSubtypeOf"])
+        clearTypeRelationCaches()
+        self.assertTrue(cTy.isSubtypeOf(aTy))
+        stats = dict((name, (hits, misses)) for name, hits, misses, _
+                     in getTypeRelationCacheStats())
+        self.assertEquals((hits + 1, misses + 3), stats["isSubtypeOf"])
+
+    def testTypesFromDiscardedPackageCollected(self):
+        # A class and its type parameter refer to each other, and the class's methods refer
+        # to types of the class, so the interned types are part of a cycle.
+        package = Package()
+        T = package.addTypeParameter("T", None, getRootClassType(), getNothingClassType(),
+                                     frozenset())
+        clas = package.addClass("C", None, [T], [getRootClassType()], None, [], [], [],
+                                frozenset())
+        T.clas = clas
+        ty = ClassType(clas, (VariableType(T),))
+        method = package.addFunction("f", None, UnitType, [], [ty], [], None, frozenset())
+        method.clas = clas
+        clas.methods.append(method)
+        self.assertTrue(ty.isSubtypeOf(getRootClassType()))
+        tyRef = weakref.ref(ty)
+        del package, T, clas, ty, method
+        clearTypeRelationCaches()
+        gc.collect()
+        self.assertIsNone(tyRef())
+
+    def testTypesFromAnalyzedPackageCollected(self):
+        # Type analysis fills the type relation caches. It should clear them when it's done
+        # so they don't keep the package's types alive.
+        source = "class A\n" + \
+                 "class B <: A\n" + \
+                 "def g(b: B): A = if (true) b else A()"
+        info = CompileInfo(parse("(test)", layout(lex("(test)", source))))
+        analyzeDeclarations(info)
+        analyzeInheritance(info)
+        analyzeTypes(info)
+        tyRef = weakref.ref(ClassType(info.package.findClass(name="B")))
+        del info
+        gc.collect()
+        self.assertIsNone(tyRef())
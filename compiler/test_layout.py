@@ -6,8 +6,11 @@
 
 import unittest
 
+from errors import LayoutException
+
 from lexer import *
-from layout import layout
+from layout import *
+from layout import PatternAutomaton, PatternManager, ANY_PATTERN, LAYOUT_AUTOMATON
 
 class TestLayout(unittest.TestCase):
     def checkLayout(self, expectedTexts, text):
@@ -196,3 +199,121 @@ class TestLayout(unittest.TestCase):
                          "def f =\n" +
                          "  while (a)\n" +
                          "  {}")
+
+    def testStreaming(self):
+        text = "class C\n" + \
+               "  def f =\n" + \
+               "    if (a)\n" + \
+               "      b\n" + \
+               "    else\n" + \
+               "      c\n" + \
+               "var x = 1"
+        expected = layout(lex("(test)", text))
+        layoutTokens = iterLayout(iterLex("(test)", text))
+        self.assertFalse(isinstance(layoutTokens, list))
+        self.assertEquals(expected, list(layoutTokens))
+
+    def testStreamingSkipAnalysis(self):
+        text = "a // comment\n  b"
+        expected = layout(lex("(test)", text), skipAnalysis=True)
+        self.assertEquals(expected, list(iterLayout(iterLex("(test)", text), skipAnalysis=True)))
+
+    def checkIncremental(self, text, offset, removedLength, insertedText):
+        rawTokens = lex("(test)", text)
+        incremental = IncrementalLayout(rawTokens)
+        self.assertEquals(layout(rawTokens), incremental.tokens)
+        newText = text[:offset] + insertedText + text[offset + removedLength:]
+        edit = relex(rawTokens, offset, removedLength, insertedText)
+        layoutTokens = incremental.update(*edit)
+        self.assertEquals(layout(lex("(test)", newText)), layoutTokens)
+        self.assertEquals(list(IncrementalLayout(edit[0]).lineIndices),
+                          list(incremental.lineIndices))
+
+    def testIncrementalEditInBlock(self):
+        text = "def f =\n" + \
+               "  var x = 1\n" + \
+               "  x\n" + \
+               "def g =\n" + \
+               "  2\n"
+        self.checkIncremental(text, text.index("1"), 1, "12")
+
+    def testIncrementalAddLines(self):
+        text = "def f =\n" + \
+               "  if (a)\n" + \
+               "    b\n" + \
+               "  else\n" + \
+               "    c\n" + \
+               "def g = 2\n"
+        self.checkIncremental(text, text.index("    b") + 5, 0, "\n    d\n    e")
+
+    def testIncrementalChangeIndentation(self):
+        text = "def f =\n" + \
+               "  a\n" + \
+               "  b\n" + \
+               "def g =\n" + \
+               "  c\n"
+        self.checkIncremental(text, text.index("  b"), 2, "")
+        self.checkIncremental(text, text.index("def g"), 0, "  ")
+
+    def testIncrementalOpenBlock(self):
+        text = "var x = 1\n" + \
+               "  y\n" + \
+               "z\n"
+        self.checkIncremental(text, text.index(" = 1"), 4, " =")
+
+    def testIncrementalError(self):
+        text = "def f =\n" + \
+               "  a\n"
+        rawTokens = lex("(test)", text)
+        incremental = IncrementalLayout(rawTokens)
+        oldTokens = incremental.tokens
+        with self.assertRaises(LayoutException):
+            incremental.update(*relex(rawTokens, text.index("a"), 0, "\t"))
+        self.assertIs(oldTokens, incremental.tokens)
+
+    def checkPatterns(self, expected, patterns, text):
+        manager = PatternManager(PatternAutomaton(patterns))
+        for token in lex("(test)", text):
+            if token.isPrintable():
+                manager.next(token)
+        self.assertEquals(expected, manager.match())
+
+    def testPatternSimple(self):
+        patterns = [["if", "(", ANY_PATTERN, ")"]]
+        self.checkPatterns(True, patterns, "if (a)")
+        self.checkPatterns(False, patterns, "if (a) b")
+        self.checkPatterns(True, patterns, "if (a) if (b)")
+        self.checkPatterns(False, patterns, "if a")
+
+    def testPatternRetry(self):
+        self.checkPatterns(True, [["else", "if", "(", ANY_PATTERN, ")"]], "else else if (a)")
+
+    def testPatternDelimiters(self):
+        patterns = [["var", ANY_PATTERN, "="]]
+        self.checkPatterns(False, patterns, "var f(a = b")
+        self.checkPatterns(True, patterns, "var f(a = b) =")
+        self.checkPatterns(True, patterns, "var f(a[b = c], {d = e}) =")
+        self.checkPatterns(False, patterns, "var f(a] =")
+
+    def testPatternTrailingAny(self):
+        patterns = [["class", ANY_PATTERN]]
+        self.checkPatterns(True, patterns, "class C")
+        self.checkPatterns(False, patterns, "class C(")
+        self.checkPatterns(True, patterns, "class C(a)")
+
+    def testPatternManagerLevels(self):
+        manager = PatternManager(LAYOUT_AUTOMATON)
+        tokens = [t for t in lex("(test)", "def f = while (a)") if t.isPrintable()]
+        for token in tokens[:3]:
+            manager.next(token)
+        self.assertTrue(manager.match())
+        manager.push()
+        self.assertFalse(manager.match())
+        snapshot = manager.snapshot()
+        for token in tokens[3:]:
+            manager.next(token)
+        self.assertTrue(manager.match())
+        manager.restore(snapshot)
+        self.assertFalse(manager.match())
+        manager.pop()
+        self.assertTrue(manager.match())
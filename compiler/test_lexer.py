@@ -4,6 +4,8 @@
 # the GPL license that can be found in the LICENSE.txt file.
 
 
+import glob
+import os.path
 import unittest
 
 from lexer import *
@@ -94,3 +96,64 @@ class TestLexer(unittest.TestCase):
     def testError(self):
         with self.assertRaises(LexException):
             lex("test", "`")
+
+    def testExhaustiveMatchesMasterExpression(self):
+        texts = ["", "a\r\nb", "var varx _ _a a-b", "i32 i32x static", "x<:y >: => =>> :: : =",
+                 "+1 +-1 -.1 -. 1.2.3 1e 1e+ 1.e5 0x 0x1f 0b12 0b1i8 12i 1f 1f32 1i32",
+                 "a//b\n+//c", '"a\\"b" "x\\"', "[a](b){c}.d,e;f"]
+        examplesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+        for fileName in glob.glob(os.path.join(examplesDir, "*.gy")):
+            with open(fileName) as inFile:
+                texts.append(inFile.read())
+        for text in texts:
+            self.assertEqual(lex("test", text, exhaustive=True), lex("test", text))
+
+    def testExhaustiveError(self):
+        with self.assertRaises(LexException):
+            lex("test", "a `", exhaustive=True)
+
+    def testIterLexIsLazy(self):
+        tokens = iterLex("test", "a `")
+        self.assertEqual("a", next(tokens).text)
+        self.assertEqual(" ", next(tokens).text)
+        with self.assertRaises(LexException):
+            next(tokens)
+
+    def checkRelex(self, text, offset, removedLength, insertedText):
+        newText = text[:offset] + insertedText + text[offset + removedLength:]
+        oldTokens = lex("test", text)
+        newTokens, begin, oldEnd, newEnd = relex(oldTokens, offset, removedLength, insertedText)
+        expected = lex("test", newText)
+        self.assertEqual(newText, newTokens.source)
+        self.assertEqual(expected, newTokens)
+        self.assertEqual(list(oldTokens)[:begin], list(newTokens)[:begin])
+        self.assertEqual(len(oldTokens) - oldEnd, len(newTokens) - newEnd)
+        return begin, oldEnd, newEnd
+
+    def testRelexInsideToken(self):
+        begin, oldEnd, newEnd = self.checkRelex("var x = foo\nvar y = 1", 9, 0, "x")
+        self.assertEqual((3, 7, 7), (begin, oldEnd, newEnd))
+
+    def testRelexNewline(self):
+        self.checkRelex("a b\nc d\ne f", 2, 0, "\n  ")
+        self.checkRelex("a b\nc d\ne f", 3, 1, "")
+
+    def testRelexExtendsPreviousToken(self):
+        self.checkRelex("x = 1 + 2", 5, 0, "e5")
+        self.checkRelex("x = 1e5 + 2", 5, 2, "")
+
+    def testRelexComment(self):
+        self.checkRelex("a // b\nc\nd", 6, 1, "")
+        self.checkRelex("a b\nc", 2, 0, "//")
+
+    def testRelexString(self):
+        self.checkRelex('"a\\" b c', 8, 0, '"')
+        self.checkRelex('x "a" b', 4, 0, '\\"')
+
+    def testRelexEmpty(self):
+        self.checkRelex("", 0, 0, "var x")
+        self.checkRelex("var x", 0, 5, "")
+
+    def testRelexError(self):
+        with self.assertRaises(LexException):
+            relex(lex("test", "a b"), 1, 0, "`")
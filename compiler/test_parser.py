@@ -11,7 +11,7 @@ execfile("parser.py")
 
 import ast
 from errors import *
-from layout import layout
+from layout import layout, iterLayout
 from lexer import *
 from location import Location
 from combinators import *
@@ -30,11 +30,11 @@ for k, v in ast.__dict__.iteritems():
 
 
 class TestParser(unittest.TestCase):
-    def parseFromSource(self, parser, text):
+    def parseFromSource(self, parser, text, memo=None):
         filename = "test"
         rawTokens = lex(filename, text)
         layoutTokens = layout(rawTokens, skipAnalysis=True)
-        reader = Reader(filename, layoutTokens)
+        reader = Reader(filename, TokenStream(layoutTokens, memo))
         result = Phrase(parser)(reader)
         if not result:
             raise ParseException(result.location, result.message)
@@ -43,11 +43,42 @@ class TestParser(unittest.TestCase):
     def checkParse(self, expected, parser, text):
         value = self.parseFromSource(parser, text)
         self.assertEqual(expected, value)
+        packratValue = self.parseFromSource(parser, text, MemoTable())
+        self.assertEqual(expected, packratValue)
 
     # Module
     def testModuleEmpty(self):
         self.checkParse(astModule([]), module(), "")
 
+    def testModuleStreamed(self):
+        source = "".join("def g%d = %d\n" % (i, i) for i in xrange(500))
+        expected = parse("test", layout(lex("test", source)))
+        stream = TokenStream(iterLayout(iterLex("test", source)), filename="test")
+        result = module()(Reader("test", stream))
+        ast.addNodeIds(result.value)
+        self.assertEqual(expected, result.value)
+        self.assertEqual(expected.location, result.value.location)
+        self.assertEqual(expected.definitions[-1].location,
+                         result.value.definitions[-1].location)
+        self.assertTrue(stream.base > len(expected.definitions))
+
+    def testGrammarShared(self):
+        self.assertIs(module(), module())
+        self.assertIs(expression(), statement().parsers[-1].parser.left)
+        self.assertIs(keyword("("), keyword("("))
+        lazy = groupExpr().parser.left.right
+        self.parseFromSource(groupExpr(), "(x)")
+        self.assertIs(expression(), lazy.parser)
+
+    def testPackrat(self):
+        source = "private def f = 12\n" + \
+                 "class C\n"
+        memo = MemoTable()
+        expected = parse("test", layout(lex("test", source)))
+        self.assertEqual(expected, parse("test", layout(lex("test", source)), memo))
+        self.assertEqual(1, memo.hits["attribs"])
+        self.assertEqual(4, memo.misses["attribs"])
+
     # Definitions
     def testVarDefnEmpty(self):
         self.checkParse(astVariableDefinition([], "var", astVariablePattern("x", None), None),
@@ -446,6 +477,16 @@ class TestParser(unittest.TestCase):
                                                                 astVariableExpression("z"))),
                         expression(), "x :: y :: z")
 
+    def testMixedAssociativityBinaryExpr(self):
+        with self.assertRaises(ParseException):
+            self.parseFromSource(expression(), "x + y +: z")
+
+    def testBinaryExprMissingOperand(self):
+        self.checkParse(astBinaryExpression("+",
+                                            astVariableExpression("x"),
+                                            astVariableExpression("y")),
+                        expression() + Opt(operator) ^ (lambda p, _: p[0]), "x + y *")
+
     def testLogicExpr(self):
         self.checkParse(astBinaryExpression("||",
                                             astBinaryExpression("&&",
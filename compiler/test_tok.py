@@ -0,0 +1,77 @@
+# Copyright 2015, Jay Conrod. All rights reserved.
+#
+# This file is part of Gypsum. Use of this source code is governed by
+# the GPL license that can be found in the LICENSE.txt file.
+
+
+import unittest
+
+from location import Location
+from tok import *
+
+
+class TestTokenTable(unittest.TestCase):
+    def makeTable(self):
+        source = "var x\n"
+        table = TokenTable("test", source)
+        table.appendSource(RESERVED, 0, 3, 1, 1, 1, 4)
+        table.appendSource(SPACE, 3, 1, 1, 4, 1, 5)
+        table.appendSource(SYMBOL, 4, 1, 1, 5, 1, 6)
+        table.appendSource(NEWLINE, 5, 1, 1, 6, 1, 7)
+        return table
+
+    def testSourceTokens(self):
+        table = self.makeTable()
+        self.assertEqual(4, len(table))
+        self.assertEqual("x", table[2].text)
+        self.assertIs(SYMBOL, table[2].tag)
+        self.assertEqual(Location("test", 1, 5, 1, 6), table[2].location)
+        self.assertEqual("\n", table[-1].text)
+        self.assertEqual(["var", " ", "x", "\n"], [t.text for t in table])
+
+    def testIndexError(self):
+        table = self.makeTable()
+        with self.assertRaises(IndexError):
+            table[4]
+
+    def testIsPrintable(self):
+        table = self.makeTable()
+        self.assertEqual([True, False, True, False], [t.isPrintable() for t in table])
+
+    def testAppendToken(self):
+        table = TokenTable()
+        loc = Location("test", 2, 3, 2, 3)
+        table.append(Token(";", INTERNAL, loc))
+        self.assertEqual("test", table.fileName)
+        self.assertEqual(Token(";", INTERNAL, loc), table[0])
+        self.assertEqual(table[0], Token(";", INTERNAL, loc))
+
+    def testAppendView(self):
+        table = self.makeTable()
+        copy = TokenTable.fromTokens(filter(lambda t: t.isPrintable(), table),
+                                     table.fileName, table.source)
+        self.assertEqual(["var", "x"], [t.text for t in copy])
+        self.assertEqual([], copy.texts)
+        self.assertEqual(table[2], copy[1])
+
+    def testViewEquality(self):
+        table = self.makeTable()
+        token = Token("x", SYMBOL, Location("test", 1, 5, 1, 6))
+        self.assertEqual(token, table[2])
+        self.assertEqual(hash(token), hash(table[2]))
+        self.assertNotEqual(token, table[0])
+
+    def testAppendRange(self):
+        table = self.makeTable()
+        copy = TokenTable("test", "  var x\n", texts=table.texts)
+        copy.appendRange(table, 0, 3, offsetDelta=2, columnRow=1, columnDelta=2)
+        self.assertEqual(["var", " ", "x"], [t.text for t in copy])
+        self.assertEqual(Location("test", 1, 7, 1, 8), copy[2].location)
+
+    def testAppendRangeRows(self):
+        table = self.makeTable()
+        copy = TokenTable("test", table.source, texts=table.texts)
+        copy.append(Token("}", INTERNAL, Location("test", 1, 1, 1, 1)))
+        copy.appendRange(table, 2, 4, rowDelta=3)
+        self.assertEqual(["}", "x", "\n"], [t.text for t in copy])
+        self.assertEqual(Location("test", 4, 5, 4, 6), copy[1].location)
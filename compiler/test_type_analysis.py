@@ -488,7 +488,7 @@ class TestTypeAnalysis(TestCaseWithDefinitions):
 
     def testNullableType(self):
         info = self.analyzeFromSource("var g: Object?")
-        expected = ClassType(getRootClass(), (), frozenset([NULLABLE_TYPE_FLAG]))
+        expected = ClassType(getRootClass(), (), NULLABLE_TYPE_FLAG)
         self.assertEquals(expected, info.package.findGlobal(name="g").type)
 
     def testCallBuiltin(self):
@@ -738,6 +738,27 @@ class TestTypeAnalysis(TestCaseWithDefinitions):
         f = info.package.findFunction(name="f", pred=pred)
         self.assertIs(use.defnInfo.irDefn, f)
 
+    def testOverloadOnClassParameter(self):
+        source = "class A\n" + \
+                 "class B <: A\n" + \
+                 "class C\n" + \
+                 "def f(a: A, x: i64) = 1i32\n" + \
+                 "def f(c: C, x: i64) = 2.f32\n" + \
+                 "def f(a: A, x: i32) = true\n" + \
+                 "def g(b: B, c: C) =\n" + \
+                 "  f(b, 1)\n" + \
+                 "  f(c, 1)\n" + \
+                 "  f(b, 1)\n" + \
+                 "  f(b, 1i32)"
+        info = self.analyzeFromSource(source)
+        statements = info.ast.definitions[6].body.statements
+        self.assertEquals([I32Type, F32Type, I32Type, BooleanType],
+                          [info.getType(stmt) for stmt in statements])
+        self.assertIs(info.getUseInfo(statements[0]).defnInfo,
+                      info.getUseInfo(statements[2]).defnInfo)
+        self.assertIsNot(info.getCallInfo(statements[0]).typeArguments,
+                         info.getCallInfo(statements[2]).typeArguments)
+
     def testIdentityTypeParameter(self):
         source = "def id[static T](o: T) = o\n" + \
                  "def f(o: String) = id[String](o)\n"
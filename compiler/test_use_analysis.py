@@ -82,6 +82,27 @@ class TestUseAnalysis(TestCaseWithDefinitions):
         xNameInfo = localScope.lookup("x", NoLoc)
         self.assertIs(xDefnInfo, xNameInfo.getDefnInfo())
 
+    def testUseBeforeDefinitionCheckedAfterCachedLookup(self):
+        info = self.analyzeFromSource("def f = { var x = y; var y = 12; }")
+        scope = info.getScope(info.ast.definitions[0])
+        self.assertRaises(ScopeException, scope.lookup, "y", NoLoc)
+        scope.define("y")
+        yDefnInfo = info.getDefnInfo(info.ast.definitions[0].body.statements[1].pattern)
+        self.assertIs(yDefnInfo, scope.lookup("y", NoLoc).getDefnInfo())
+
+    def testLookupAfterBindInParent(self):
+        info = self.analyzeFromSource("var x = 12\n" + \
+                                      "def f = { { x; }; };")
+        xDefnInfo = info.getDefnInfo(info.ast.definitions[0].pattern)
+        fScope = info.getScope(info.ast.definitions[1])
+        localScope = info.getScope(info.ast.definitions[1].body.statements[0])
+        self.assertIs(xDefnInfo, localScope.lookup("x", NoLoc).getDefnInfo())
+        localXDefnInfo = DefnInfo(self.makeVariable("x"),
+                                  fScope.scopeId, fScope.scopeId, NOT_HERITABLE)
+        fScope.bind("x", localXDefnInfo)
+        fScope.define("x")
+        self.assertIs(localXDefnInfo, localScope.lookup("x", NoLoc).getDefnInfo())
+
     def testUseThisInInitializer(self):
         info = self.analyzeFromSource("class Foo { var x = this; };")
         classScope = info.getScope(info.ast.definitions[0])
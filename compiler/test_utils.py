@@ -58,3 +58,27 @@ class TestUtils(unittest.TestCase):
                  (r'"\U10000"', '\U10000')]
         for expected, str in pairs:
             self.assertEquals(expected, encodeString(str))
+
+    def testLruCacheEviction(self):
+        cache = LruCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEquals(1, cache.get("a"))
+        cache.put("c", 3)
+        self.assertEquals(2, len(cache))
+        self.assertIsNone(cache.get("b"))
+        self.assertEquals(1, cache.get("a"))
+        self.assertEquals(3, cache.get("c"))
+
+    def testLruCacheStats(self):
+        cache = LruCache(4)
+        self.assertEquals(0.0, cache.hitRate())
+        cache.put("a", 1)
+        cache.get("a")
+        cache.get("b")
+        cache.get("a")
+        self.assertEquals(2, cache.hits)
+        self.assertEquals(1, cache.misses)
+        cache.clear()
+        self.assertEquals(0, len(cache))
+        self.assertIsNone(cache.get("a"))
@@ -0,0 +1,72 @@
+# Copyright 2014, Jay Conrod. All rights reserved.
+#
+# This file is part of Gypsum. Use of this source code is governed by
+# the GPL license that can be found in the LICENSE.txt file.
+
+
+import unittest
+
+from visitor import *
+from visitor import DispatchTable
+
+
+class Foo(object):
+    pass
+
+
+class Bar(object):
+    pass
+
+
+class FooVisitor(Visitor):
+    def visitFoo(self, obj, arg):
+        return "foo %s" % arg
+
+    def visitDefault(self, obj, arg):
+        return "default %s" % arg
+
+
+class HookVisitor(FooVisitor):
+    def __init__(self):
+        self.events = []
+
+    def preVisit(self, obj, arg):
+        self.events.append("pre")
+
+    def postVisit(self, obj, arg):
+        self.events.append("post")
+
+    def handleResult(self, obj, result, arg):
+        return result.upper()
+
+
+class RenamingVisitor(FooVisitor):
+    def getMethodName(self, className):
+        return "visitBar" if className == "Foo" else "visitFoo"
+
+    def visitBar(self, obj, arg):
+        return "bar %s" % arg
+
+
+class TestVisitor(unittest.TestCase):
+    def testDispatch(self):
+        visitor = FooVisitor()
+        self.assertEqual("foo 1", visitor.visit(Foo(), 1))
+        self.assertEqual("default 2", visitor.visit(Bar(), 2))
+        self.assertEqual("foo 3", visitor.visit(Foo(), 3))
+
+    def testHooksSkipped(self):
+        table = DispatchTable(FooVisitor)
+        self.assertIsNone(table.preVisit)
+        self.assertIsNone(table.postVisit)
+        self.assertIsNone(table.handleResult)
+
+    def testHooks(self):
+        visitor = HookVisitor()
+        self.assertEqual("FOO 1", visitor.visit(Foo(), 1))
+        self.assertEqual(["pre", "post"], visitor.events)
+
+    def testSubclassesHaveSeparateTables(self):
+        self.assertEqual("foo 1", FooVisitor().visit(Foo(), 1))
+        self.assertEqual("bar 1", RenamingVisitor().visit(Foo(), 1))
+        self.assertEqual("foo 2", RenamingVisitor().visit(Bar(), 2))
@@ -4,7 +4,11 @@
 # the GPL license that can be found in the LICENSE.txt file.
 
 
+from array import array
+
+import utils
 from data import Data
+from location import Location
 
 
 RESERVED = "reserved"
@@ -27,9 +31,213 @@ class Token(Data):
     def __str__(self):
         return '("%s", %s) @ %s' % (self.text, self.tag, str(self.location))
 
+    def __eq__(self, other):
+        return isinstance(other, (Token, TokenView)) and \
+               self.text == other.text and \
+               self.tag == other.tag and \
+               self.location == other.location
+
+    def __hash__(self):
+        return utils.hashList([self.text, self.tag, self.location])
+
     def isPrintable(self):
         return self.tag not in [NEWLINE, SPACE, COMMENT]
 
-__all__ = ["Token", "RESERVED", "ATTRIB", "SYMBOL", "OPERATOR",
+# Tags are stored in token tables as small integer codes. The code for a tag is its index
+# in this list.
+TAGS = [RESERVED, ATTRIB, SYMBOL, OPERATOR, INTEGER, FLOAT, STRING,
+        NEWLINE, SPACE, COMMENT, INTERNAL]
+TAG_CODES = {tag: code for code, tag in enumerate(TAGS)}
+
+
+class TokenTable(object):
+    # A compact sequence of tokens from one file. Instead of a Token and a Location object
+    # for each token, the table keeps one array per property. Token text is stored as an
+    # offset and length into the source when possible. Text that doesn't come from the
+    # source (for example, tokens inserted by layout analysis) is kept in a separate list,
+    # and its index is stored as a negative offset. Indexing or iterating the table creates
+    # TokenView objects on demand.
+    #
+    # Tables derived from one another (for example, by incremental relexing) may share the
+    # list of texts. The list is only ever appended to, so negative offsets stay valid in
+    # every table that shares it.
+    def __init__(self, fileName=None, source=None, texts=None):
+        self.fileName = fileName
+        self.source = source
+        self.tags = array("B")
+        self.offsets = array("i")
+        self.lengths = array("i")
+        self.beginRows = array("i")
+        self.beginColumns = array("i")
+        self.endRows = array("i")
+        self.endColumns = array("i")
+        self.texts = texts if texts is not None else []
+
+    @staticmethod
+    def fromTokens(tokens, fileName=None, source=None):
+        table = TokenTable(fileName, source)
+        table.extend(tokens)
+        return table
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.tags)
+        if not (0 <= index < len(self.tags)):
+            raise IndexError("token index out of range")
+        return TokenView(self, index)
+
+    def __iter__(self):
+        for index in xrange(len(self.tags)):
+            yield TokenView(self, index)
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __repr__(self):
+        return "TokenTable(%s)" % ", ".join(repr(token) for token in self)
+
+    def appendSource(self, tag, offset, length, beginRow, beginColumn, endRow, endColumn):
+        # Appends a token whose text is source[offset:offset+length].
+        self.tags.append(TAG_CODES[tag])
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.beginRows.append(beginRow)
+        self.beginColumns.append(beginColumn)
+        self.endRows.append(endRow)
+        self.endColumns.append(endColumn)
+
+    def append(self, token):
+        if isinstance(token, TokenView) and \
+           token.table.source is self.source and \
+           token.table.offsets[token.index] >= 0:
+            table = token.table
+            index = token.index
+            self.tags.append(table.tags[index])
+            self.offsets.append(table.offsets[index])
+            self.lengths.append(table.lengths[index])
+            self.beginRows.append(table.beginRows[index])
+            self.beginColumns.append(table.beginColumns[index])
+            self.endRows.append(table.endRows[index])
+            self.endColumns.append(table.endColumns[index])
+            return
+
+        location = token.location
+        if self.fileName is None:
+            self.fileName = location.fileName
+        assert location.fileName == self.fileName
+        self.texts.append(token.text)
+        self.tags.append(TAG_CODES[token.tag])
+        self.offsets.append(-len(self.texts))
+        self.lengths.append(len(token.text))
+        self.beginRows.append(location.beginRow)
+        self.beginColumns.append(location.beginColumn)
+        self.endRows.append(location.endRow)
+        self.endColumns.append(location.endColumn)
+
+    def extend(self, tokens):
+        for token in tokens:
+            self.append(token)
+
+    def appendRange(self, other, begin, end,
+                    offsetDelta=0, rowDelta=0, columnRow=None, columnDelta=0):
+        # Appends tokens [begin, end) from another table which shares this table's texts.
+        # The copied tokens may be shifted: offsetDelta is added to source offsets, and
+        # rowDelta is added to rows. columnDelta is added to columns of tokens on
+        # columnRow (before rowDelta is applied).
+        assert other.texts is self.texts
+        if begin >= end:
+            return
+        self.tags.extend(other.tags[begin:end])
+        self.lengths.extend(other.lengths[begin:end])
+        offsets = other.offsets[begin:end]
+        if offsetDelta != 0:
+            offsets = array("i", (o + offsetDelta if o >= 0 else o for o in offsets))
+        self.offsets.extend(offsets)
+        for rows, columns, otherRows, otherColumns in \
+                ((self.beginRows, self.beginColumns, other.beginRows, other.beginColumns),
+                 (self.endRows, self.endColumns, other.endRows, other.endColumns)):
+            copiedRows = otherRows[begin:end]
+            copiedColumns = otherColumns[begin:end]
+            if columnDelta != 0:
+                copiedColumns = array("i", (c + columnDelta if r == columnRow else c
+                                            for r, c in zip(copiedRows, copiedColumns)))
+            if rowDelta != 0:
+                copiedRows = array("i", (r + rowDelta for r in copiedRows))
+            rows.extend(copiedRows)
+            columns.extend(copiedColumns)
+
+    def text(self, index):
+        offset = self.offsets[index]
+        if offset >= 0:
+            return self.source[offset:offset + self.lengths[index]]
+        else:
+            return self.texts[-offset - 1]
+
+    def tag(self, index):
+        return TAGS[self.tags[index]]
+
+    def location(self, index):
+        return Location(self.fileName,
+                        self.beginRows[index], self.beginColumns[index],
+                        self.endRows[index], self.endColumns[index])
+
+
+class TokenView(object):
+    # A token in a TokenTable. Views are created when tokens are read from a table, and
+    # they behave like Token objects. Text and location are looked up when they're used;
+    # text is remembered after the first lookup, since layout analysis reads it repeatedly.
+    __slots__ = ["table", "index", "cachedText"]
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+        self.cachedText = None
+
+    @property
+    def text(self):
+        if self.cachedText is None:
+            self.cachedText = self.table.text(self.index)
+        return self.cachedText
+
+    @property
+    def tag(self):
+        return TAGS[self.table.tags[self.index]]
+
+    @property
+    def location(self):
+        return self.table.location(self.index)
+
+    def __str__(self):
+        return '("%s", %s) @ %s' % (self.text, self.tag, str(self.location))
+
+    def __repr__(self):
+        return "Token(%s, %s, %s)" % (repr(self.text), repr(self.tag), repr(self.location))
+
+    def __eq__(self, other):
+        return isinstance(other, (Token, TokenView)) and \
+               self.text == other.text and \
+               self.tag == other.tag and \
+               self.location == other.location
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return utils.hashList([self.text, self.tag, self.location])
+
+    def isPrintable(self):
+        return self.table.tags[self.index] not in _UNPRINTABLE_TAG_CODES
+
+
+_UNPRINTABLE_TAG_CODES = frozenset(TAG_CODES[tag] for tag in [NEWLINE, SPACE, COMMENT])
+
+
+__all__ = ["Token", "TokenTable", "TokenView", "RESERVED", "ATTRIB", "SYMBOL", "OPERATOR",
            "INTEGER", "FLOAT", "STRING", "NEWLINE", "SPACE",
            "COMMENT", "INTERNAL"]
@@ -44,6 +44,10 @@ def analyzeTypes(info):
                                     "%s: return type is not subtype of overriden function" %
                                     func.name)
 
+    # The type relation caches hold strong references to the types they were called with.
+    # Clear them now that type analysis is done so a discarded package can be collected.
+    ir_t.clearTypeRelationCaches()
+
 
 class TypeVisitorCommon(ast.AstNodeVisitor):
     """Provides common functionality for SubtypeVisitor and TypeVisitor, namely the visitor
@@ -98,7 +102,9 @@ class TypeVisitorCommon(ast.AstNodeVisitor):
         self.scope().use(defnInfo, node.id, USE_AS_TYPE, node.location)
         irDefn = nameInfo.getDefnInfo().irDefn
 
-        flags = frozenset(map(astTypeFlagToIrTypeFlag, node.flags))
+        flags = 0
+        for flag in node.flags:
+            flags |= astTypeFlagToIrTypeFlag(flag)
 
         if isinstance(irDefn, ir.Class):
             explicitTypeParams = getExplicitTypeParameters(irDefn)
@@ -169,6 +175,8 @@ class SubtypeVisitor(TypeVisitorCommon):
                 raise TypeException(node.location,
                                     "%s: supertype may not be nullable" % node.name)
             irClass.supertypes = [supertype]
+        ir.invalidateClassHierarchy()
+        ir_t.clearTypeRelationCaches()
         for member in node.members:
             self.visit(member)
 
@@ -191,6 +199,7 @@ class SubtypeVisitor(TypeVisitorCommon):
 
         irParam.upperBound = visitBound(node.upperBound, ir_t.getRootClassType())
         irParam.lowerBound = visitBound(node.lowerBound, ir_t.getNothingClassType())
+        ir_t.clearTypeRelationCaches()
         if not irParam.lowerBound.isSubtypeOf(irParam.upperBound):
             raise TypeException(node.location,
                                 "%s: lower bound is not subtype of upper bound" % node.name)
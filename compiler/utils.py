@@ -146,12 +146,70 @@ class Counter(object):
         return self.n
 
 
+class LruCache(object):
+    # A dictionary with a bounded number of entries. When it's full, the least recently used
+    # entry is evicted. Entries are [prev, next, key, value] lists in a circular doubly linked
+    # list, ordered from least to most recently used, so an entry can be moved to the end of
+    # the list in constant time.
+    def __init__(self, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self.entries = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        prev, next = entry[0], entry[1]
+        prev[1] = next
+        next[0] = prev
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = entry
+        entry[0] = last
+        entry[1] = root
+        return entry[3]
+
+    def put(self, key, value):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[3] = value
+            return
+        root = self.root
+        if len(self.entries) >= self.capacity:
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self.entries[oldest[2]]
+        last = root[0]
+        entry = [last, root, key, value]
+        last[1] = root[0] = entry
+        self.entries[key] = entry
+
+    def clear(self):
+        self.entries.clear()
+        self.root[:] = [self.root, self.root, None, None]
+
+    def hitRate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total > 0 else 0.0
+
+
 COMPILE_FOR_VALUE = "compile-for-value"
 COMPILE_FOR_EFFECT = "compile-for-effect"
 COMPILE_FOR_MATCH = "compile-for-match"
 COMPILE_FOR_UNINITIALIZED = "compile-for-uninitialized"
 
 
-__all__ = ["encodeString", "tryDecodeString", "Counter", "hashList",
+__all__ = ["encodeString", "tryDecodeString", "Counter", "LruCache", "hashList",
            "COMPILE_FOR_VALUE", "COMPILE_FOR_EFFECT", "COMPILE_FOR_MATCH",
            "COMPILE_FOR_UNINITIALIZED"]
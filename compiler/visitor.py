@@ -5,17 +5,27 @@
 
 
 class Visitor(object):
+    # Visitor methods are looked up once for each pair of visitor class and node class, and
+    # the results are cached in a DispatchTable for the visitor class. This assumes
+    # getMethodName only depends on the class name, and that methods are not added to
+    # visitor classes after they start visiting. Hooks which aren't overridden are skipped.
     def visit(self, obj, *args):
-        self.preVisit(obj, *args)
-        className = obj.__class__.__name__
-        methodName = self.getMethodName(className)
-        if hasattr(self, methodName):
-            result = getattr(self, methodName)(obj, *args)
-        else:
-            result = self.visitDefault(obj, *args)
-
-        result = self.handleResult(obj, result, *args)
-        self.postVisit(obj, *args)
+        table = _dispatchTables.get(self.__class__)
+        if table is None:
+            table = DispatchTable(self.__class__)
+            _dispatchTables[self.__class__] = table
+
+        if table.preVisit is not None:
+            table.preVisit(self, obj, *args)
+        handler = table.handlers.get(obj.__class__)
+        if handler is None:
+            handler = table.findHandler(self, obj.__class__)
+        result = handler(self, obj, *args)
+
+        if table.handleResult is not None:
+            result = table.handleResult(self, obj, result, *args)
+        if table.postVisit is not None:
+            table.postVisit(self, obj, *args)
         return result
 
     def getMethodName(self, className):
@@ -33,4 +43,43 @@ class Visitor(object):
     def handleResult(self, obj, result, *args):
         return result
 
+
+class DispatchTable(object):
+    def __init__(self, visitorClass):
+        self.visitorClass = visitorClass
+        self.handlers = {}
+        self.preVisit = self.findHook("preVisit")
+        self.postVisit = self.findHook("postVisit")
+        self.handleResult = self.findHook("handleResult")
+
+    def findHook(self, name):
+        # Returns the function implementing a hook, or None if the visitor class doesn't
+        # override the default, which does nothing.
+        function = _function(getattr(self.visitorClass, name), name)
+        if function is _function(getattr(Visitor, name), name):
+            return None
+        return function
+
+    def findHandler(self, visitor, nodeClass):
+        methodName = visitor.getMethodName(nodeClass.__name__)
+        method = getattr(self.visitorClass, methodName, None)
+        if method is None:
+            method = self.visitorClass.visitDefault
+            methodName = "visitDefault"
+        handler = _function(method, methodName)
+        self.handlers[nodeClass] = handler
+        return handler
+
+
+def _function(method, name):
+    # Returns the plain function behind an unbound method, which is cheaper to call. If the
+    # attribute isn't a method, it's looked up on the visitor each time instead.
+    function = getattr(method, "__func__", None)
+    if function is None:
+        function = lambda visitor, *args: getattr(visitor, name)(*args)
+    return function
+
+
+_dispatchTables = {}
+
 __all__ = ["Visitor"]